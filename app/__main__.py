@@ -1,40 +1,94 @@
 import argparse
 import asyncio
+import datetime as dt
 import logging
 import logging.config
 import os
+import sys
+from typing import Callable, Dict
 
-from . import sync
 from .config import settings
+from .utils import lazy_import
 
 logger = logging.getLogger(__name__)
 
+# Subsystems are loaded on first use, so every command imports only what it needs
+alerts = lazy_import('app.alerts')
+export = lazy_import('app.export')
+reports = lazy_import('app.reports')
+startup = lazy_import('app.startup')
+sync = lazy_import('app.sync')
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
-    parser.add_argument('command', choices=['sync', 'sync_manual', 'dashboard'])
-    args = parser.parse_args()
 
-    logging.config.dictConfig(settings.LOGGING)
+def run_sync_manual(args: argparse.Namespace) -> None:
+    if args.retry_failed:
+        stages = [sync.retry_failed_jobs]
+    elif args.resume:
+        stages = [sync.resume_unfinished_jobs]
+    else:
+        asyncio.run(sync.main())
+        return
 
-    if args.command == 'sync':
-        asyncio.run(sync.run_scheduler())
+    try:
+        asyncio.run(sync.main(stages=stages, join_as_worker=False))
+    except sync.SyncAlreadyRunningError as e:
+        logger.error('%s', e)
+        sys.exit(1)
 
-    elif args.command == 'sync_manual':
-        asyncio.run(sync.main())
 
-    elif args.command == 'dashboard':
-        cmd = 'streamlit run run_dashboard.py'
+def run_dashboard(args: argparse.Namespace) -> None:
+    cmd = 'streamlit run run_dashboard.py'
+
+    streamlit_args = [
+        '--global.sharingMode off',
+        '--server.port 8000',
+        f'--logger.messageFormat "{settings.LOGGING_FORMAT}"',
+    ]
+
+    if settings.ENVIRONMENT == 'prod':
+        streamlit_args.append('--global.disableWatchdogWarning true')
+        streamlit_args.append('--server.headless true')
+        streamlit_args.append('--server.fileWatcherType none')
+
+    os.system(' '.join([cmd, *streamlit_args]))
 
-        streamlit_args = [
-            '--global.sharingMode off',
-            '--server.port 8000',
-            f'--logger.messageFormat "{settings.LOGGING_FORMAT}"',
-        ]
 
-        if settings.ENVIRONMENT == 'prod':
-            streamlit_args.append('--global.disableWatchdogWarning true')
-            streamlit_args.append('--server.headless true')
-            streamlit_args.append('--server.fileWatcherType none')
+def run_export(args: argparse.Namespace) -> None:
+    asyncio.run(export.run_export(
+        args.output,
+        tickers=args.tickers,
+        timeframes=args.timeframes,
+        start_date=args.start_date,
+        end_date=args.end_date,
+    ))
+
+
+COMMANDS: Dict[str, Callable[[argparse.Namespace], None]] = {
+    'sync': lambda args: asyncio.run(sync.run_scheduler()),
+    'sync_manual': run_sync_manual,
+    'sync_worker': lambda args: asyncio.run(sync.run_worker_daemon()),
+    'sync_report': lambda args: asyncio.run(reports.show_sync_report(args.runs)),
+    'alerts': lambda args: asyncio.run(alerts.run_alerts()),
+    'dashboard': run_dashboard,
+    'export': run_export,
+    'import_profile': lambda args: startup.show_import_profile(args.module),
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=list(COMMANDS))
+    parser.add_argument('--resume', action='store_true', help='Only resume unfinished sync jobs (sync_manual)')
+    parser.add_argument('--retry-failed', action='store_true', help='Only retry failed sync jobs (sync_manual)')
+    parser.add_argument('--runs', type=int, default=7, help='Number of recent runs (sync_report)')
+    parser.add_argument('--output', default='export', help='Directory of Parquet dataset (export)')
+    parser.add_argument('--tickers', nargs='*', help='Export only these tickers (export)')
+    parser.add_argument('--timeframes', nargs='*', help='Export only these timeframes (export)')
+    parser.add_argument('--start-date', type=dt.date.fromisoformat, help='YYYY-MM-DD (export)')
+    parser.add_argument('--end-date', type=dt.date.fromisoformat, help='YYYY-MM-DD (export)')
+    parser.add_argument('--module', default='app.dashboard', help='Module to profile (import_profile)')
+    args = parser.parse_args()
+
+    logging.config.dictConfig(settings.LOGGING)
 
-        os.system(' '.join([cmd, *streamlit_args]))
+    COMMANDS[args.command](args)
@@ -0,0 +1,313 @@
+import asyncio
+import datetime as dt
+import logging
+from bisect import bisect_left, bisect_right
+from concurrent.futures.process import BrokenProcessPool
+from decimal import Decimal
+from typing import Awaitable, Callable, Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+
+import httpx
+import pandas as pd
+from tortoise import timezone as tz
+
+from . import candles, models
+from .config import settings
+from .schema import Candle, Timeframe
+from .support_resistance import SupportResistanceSearch
+from .tinkoff import TinkoffAPIError, TinkoffClient, TinkoffStreamingClient, websockets
+from .utils import process_pool, reset_process_pool
+
+logger = logging.getLogger(__name__)
+
+
+class Alert(NamedTuple):
+    figi: str
+    ticker: str
+    level: float
+    significance: float
+    price: float
+    previous_price: float
+    time: dt.datetime
+
+    @property
+    def direction(self) -> str:
+        return 'up' if self.price > self.previous_price else 'down'
+
+    def __str__(self) -> str:
+        return (
+            f'{self.ticker}: price {self.previous_price} -> {self.price} reached level {self.level:.2f} '
+            f'(significance {self.significance:.2f}) at {self.time}'
+        )
+
+
+AlertSink = Callable[[Alert], Awaitable[None]]
+
+
+async def log_sink(alert: Alert) -> None:
+    logger.info('Alert %s', alert)
+
+
+class LevelIndex:
+    """Price zones (level ± price_error) of one instrument, sorted by price.
+
+    All zones have the same width, so sorted lower bounds give sorted upper bounds as well
+    and the zones overlapping any price range are contiguous: lookup is a pair of bisects.
+    """
+
+    def __init__(self, levels: Sequence[float], significance: Sequence[float], price_error: float):
+        order = sorted(range(len(levels)), key=levels.__getitem__)
+
+        self.levels = [float(levels[i]) for i in order]
+        self.significance = [float(significance[i]) for i in order]
+        self.lower = [level - price_error for level in self.levels]
+        self.upper = [level + price_error for level in self.levels]
+
+    def __len__(self) -> int:
+        return len(self.levels)
+
+    def touched(self, low: float, high: float) -> range:
+        """Zones overlapping price range [low, high]
+        """
+        return range(bisect_left(self.upper, low), bisect_right(self.lower, high))
+
+    def entered(self, previous_price: float, price: float) -> List[int]:
+        """Zones reached by price move, excluding the zones the previous price was already in
+        """
+        inside = self.touched(previous_price, previous_price)
+        return [i for i in self.touched(min(previous_price, price), max(previous_price, price)) if i not in inside]
+
+
+class AlertEngine:
+
+    def __init__(self, sinks: Sequence[AlertSink] = (log_sink, )):
+        self.sinks = list(sinks)
+
+        self._indexes: Dict[str, LevelIndex] = {}
+        self._tickers: Dict[str, str] = {}
+        self._last_prices: Dict[str, float] = {}
+        self._last_candles: Dict[str, Candle] = {}
+
+    @property
+    def figis(self) -> List[str]:
+        return list(self._indexes)
+
+    def set_levels(self, figi: str, ticker: str, index: LevelIndex) -> None:
+        self._indexes[figi] = index
+        self._tickers[figi] = ticker
+
+    def replace_levels(self, levels: Mapping[str, Tuple[str, LevelIndex]]) -> None:
+        """Replace levels of all instruments {figi: (ticker, index)}: instruments without levels are not watched
+        """
+        self._indexes = {figi: index for figi, (_, index) in levels.items()}
+        self._tickers = {figi: ticker for figi, (ticker, _) in levels.items()}
+
+    def on_price(self, figi: str, price: float, time: dt.datetime) -> List[Alert]:
+        """Process new price of the instrument, returns alerts for levels reached since the previous price
+        """
+        previous_price = self._last_prices.get(figi)
+        self._last_prices[figi] = price
+
+        index = self._indexes.get(figi)
+        if index is None or previous_price is None or previous_price == price:
+            return []
+
+        return [
+            Alert(
+                figi=figi,
+                ticker=self._tickers[figi],
+                level=index.levels[i],
+                significance=index.significance[i],
+                price=price,
+                previous_price=previous_price,
+                time=time,
+            )
+            for i in index.entered(previous_price, price)
+        ]
+
+    def on_candle(self, figi: str, candle: Candle) -> List[Alert]:
+        """Process candle as a price path open -> low/high -> high/low -> close
+        """
+        if candle.close >= candle.open:
+            path: Tuple[Decimal, ...] = (candle.open, candle.low, candle.high, candle.close)
+        else:
+            path = (candle.open, candle.high, candle.low, candle.close)
+
+        alerts = []
+        for price in path:
+            alerts.extend(self.on_price(figi, float(price), candle.time))
+
+        return alerts
+
+    def on_candle_update(self, figi: str, candle: Candle, previous: Candle) -> List[Alert]:
+        """Process update of already processed candle: price reached its new extremes, then the new close
+        """
+        path = []
+        if candle.low < previous.low:
+            path.append(candle.low)
+        if candle.high > previous.high:
+            path.append(candle.high)
+        if candle.close < candle.open:
+            path.reverse()  # the same order of extremes as in `on_candle`
+
+        alerts = []
+        for price in path + [candle.close]:
+            alerts.extend(self.on_price(figi, float(price), candle.time))
+
+        return alerts
+
+    def on_candles(self, figi: str, candles: Sequence[Candle]) -> List[Alert]:
+        """Process polled or streamed candles: new candles as price paths, updates of the last processed candle
+        by its new extremes and close
+        """
+        alerts = []
+        for candle in candles:
+            last_candle = self._last_candles.get(figi)
+            if last_candle is not None and candle.time < last_candle.time:
+                continue
+
+            if last_candle is not None and candle.time == last_candle.time:
+                alerts.extend(self.on_candle_update(figi, candle, last_candle))
+            else:
+                alerts.extend(self.on_candle(figi, candle))
+
+            self._last_candles[figi] = candle
+
+        return alerts
+
+    async def emit(self, alerts: Iterable[Alert]) -> None:
+        for alert in alerts:
+            for sink in self.sinks:
+                await sink(alert)
+
+
+def find_levels(candles_df: pd.DataFrame, significance_threshold: float) -> Optional[LevelIndex]:
+    if len(candles_df) < 2:
+        return None
+
+    search = SupportResistanceSearch(candles_df)
+    levels = search.find_levels(Decimal(significance_threshold))
+
+    return LevelIndex(
+        levels.price.astype(float).tolist(),
+        levels.significance.astype(float).tolist(),
+        float(search.price_error),
+    )
+
+
+async def load_levels(engine: AlertEngine, tickers: Sequence[str]) -> None:
+    """Find S/R levels of instruments on day candles (in the shared process pool) and load them into the engine
+    """
+    instruments = dict(await models.Instrument.filter(ticker__in=tickers).values_list('ticker', 'figi'))
+
+    end_date = dt.date.today()
+    start_date = end_date - dt.timedelta(days=settings.ALERT_HISTORY_DAYS)
+    candles_dfs = await candles.load_candles_dfs(list(tickers), start_date, end_date, Timeframe.D1)
+
+    loop = asyncio.get_running_loop()
+    pool = process_pool()
+    try:
+        indexes = await asyncio.gather(*(
+            loop.run_in_executor(pool, find_levels, candles_df, settings.ALERT_SR_SIGNIFICANCE_THRESHOLD)
+            for candles_df in candles_dfs.values()
+        ))
+    except BrokenProcessPool:
+        reset_process_pool(pool)
+        raise
+
+    # Levels which are not found anymore must not fire alerts, so the whole mapping is replaced
+    engine.replace_levels({
+        instruments[ticker]: (ticker, index)
+        for ticker, index in zip(candles_dfs, indexes)
+        if index is not None and ticker in instruments
+    })
+
+    logger.info('Levels loaded for %s instruments', len(engine.figis))
+
+
+async def reload_levels(engine: AlertEngine, tickers: Sequence[str], data_version: int) -> None:
+    """Reload levels every `ALERT_LEVELS_RELOAD_INTERVAL` if stored candles have changed since `data_version`
+    """
+    while True:
+        await asyncio.sleep(settings.ALERT_LEVELS_RELOAD_INTERVAL)
+
+        try:
+            version = await candles.get_data_version(tickers, [Timeframe.D1])
+            if version != data_version:
+                await load_levels(engine, tickers)
+                data_version = version
+
+        # Alerts keep firing on the previous levels, the reload is retried after the interval
+        except Exception:
+            logger.exception('Unable to reload levels')
+
+
+async def poll_prices(engine: AlertEngine, client: TinkoffClient) -> None:
+    """Feed the engine with the latest minute candles of all instruments.
+
+    Requests are paced by client rate limiter, so a cycle over the whole universe takes minutes;
+    the streaming feed (`stream_prices`) is used when it's available.
+    """
+    end_dt = tz.now()
+    start_dt = end_dt - dt.timedelta(minutes=5)
+
+    for figi in engine.figis:
+        try:
+            new_candles = await client.get_candles(figi, Timeframe.M1, start_dt, end_dt)
+        except (TinkoffAPIError, httpx.HTTPError) as e:
+            logger.warning('Unable to get candles of %s: %s', figi, e)
+            continue
+
+        await engine.emit(engine.on_candles(figi, new_candles))
+
+
+async def stream_prices(engine: AlertEngine, client: TinkoffStreamingClient, figis: Sequence[str]) -> None:
+    """Feed the engine with updates of minute candles from streaming API, reconnecting on errors
+    """
+    while True:
+        try:
+            async for figi, candle in client.stream_candles(figis, Timeframe.M1):
+                try:
+                    await engine.emit(engine.on_candles(figi, [candle]))
+                except Exception:
+                    logger.exception('Unable to process candle of %s', figi)
+        except TinkoffAPIError as e:
+            logger.warning('%s, reconnecting', e)
+
+        await asyncio.sleep(settings.ALERT_POLL_INTERVAL)
+
+
+async def feed_prices(engine: AlertEngine, client: TinkoffClient, figis: Sequence[str]) -> None:
+    if settings.ALERT_STREAMING and websockets is not None:
+        await stream_prices(engine, TinkoffStreamingClient(), figis)
+        return
+
+    logger.info('Streaming API is not available, polling prices every %s s', settings.ALERT_POLL_INTERVAL)
+    while True:
+        await poll_prices(engine, client)
+        await asyncio.sleep(settings.ALERT_POLL_INTERVAL)
+
+
+async def run_alerts(sinks: Sequence[AlertSink] = (log_sink, )) -> None:
+    await models.init_db()
+    client = TinkoffClient()
+
+    try:
+        instruments = (
+            models.Instrument
+            .filter(type=models.InstrumentType.STOCK, delisted_at__isnull=True, deleted_at__isnull=True)
+        )
+        if settings.ALERT_TICKERS:
+            instruments = instruments.filter(ticker__in=settings.ALERT_TICKERS)
+        rows = await instruments.values_list('ticker', 'figi')
+        tickers = [ticker for ticker, _ in rows]
+        figis = [figi for _, figi in rows]
+
+        engine = AlertEngine(sinks)
+        data_version = await candles.get_data_version(tickers, [Timeframe.D1])
+        await load_levels(engine, tickers)
+
+        await asyncio.gather(reload_levels(engine, tickers, data_version), feed_prices(engine, client, figis))
+
+    finally:
+        await client.close()
+        await models.close_db()
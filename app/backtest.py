@@ -0,0 +1,281 @@
+import itertools
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .screener import ema
+from .support_resistance import StreamingSupportResistanceSearch
+
+logger = logging.getLogger(__name__)
+
+
+class Candles(NamedTuple):
+    time: np.ndarray
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+
+    @classmethod
+    def from_df(cls, candles: pd.DataFrame) -> 'Candles':
+        candles = candles.sort_values('time')
+        return cls(
+            time=candles.time.to_numpy(),
+            **{column: candles[column].to_numpy(dtype=float) for column in ('open', 'high', 'low', 'close')},
+        )
+
+
+class Signals(NamedTuple):
+    """Entry signals of a long-only strategy. Prices are NaN where not applicable
+    """
+    entries: np.ndarray
+    exits: Optional[np.ndarray] = None
+    stop: Optional[np.ndarray] = None
+    take: Optional[np.ndarray] = None
+
+
+def window_levels(candles: Candles, start: int, stop: int, min_significance: float) -> Tuple[np.ndarray, float]:
+    """Levels found by `SupportResistanceSearch` on candles[start:stop] and its price error
+    """
+    window = pd.DataFrame({
+        'time': candles.time[start:stop], 'high': candles.high[start:stop], 'low': candles.low[start:stop]
+    })
+    # Single-candle blocks give the same levels as `SupportResistanceSearch`, only faster
+    search = StreamingSupportResistanceSearch([window], block_size=1)
+    levels = search.find_levels(Decimal(min_significance))
+    return levels.price.to_numpy(dtype=float), float(search.price_error)
+
+
+def rolling_levels(
+    candles: Candles,
+    window: int = 250,
+    step: int = 20,
+    min_significance: float = 0.3,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Support/resistance levels known at every candle, shape (candles, levels), and price error per candle
+
+    Levels are recalculated every `step` candles from previous `window` candles only, so there is no look-ahead.
+    """
+    num_of_candles = len(candles.close)
+    block_starts = range(window, num_of_candles, step)
+    if not len(block_starts):
+        return np.full((num_of_candles, 1), np.nan), np.full(num_of_candles, np.nan)
+
+    found = [window_levels(candles, start - window, start, min_significance) for start in block_starts]
+    price_error = np.array([error for _, error in found])
+    levels = np.full((len(found), max(len(prices) for prices, _ in found) or 1), np.nan)
+    for i, (prices, _) in enumerate(found):
+        levels[i, :len(prices)] = prices
+
+    # Candles before the first full window have no levels
+    blocks = (np.arange(num_of_candles) - window) // step
+    known = blocks >= 0
+    blocks = np.clip(blocks, 0, len(block_starts) - 1)
+
+    return (
+        np.where(known[:, None], levels[blocks], np.nan),
+        np.where(known, price_error[blocks], np.nan),
+    )
+
+
+def _nearest_levels(levels: np.ndarray, price: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Nearest level below or equal to price (support) and above it (resistance)
+    """
+    below = np.where(levels <= price[:, None], levels, -np.inf).max(axis=1, initial=-np.inf)
+    above = np.where(levels > price[:, None], levels, np.inf).min(axis=1, initial=np.inf)
+    return np.where(np.isfinite(below), below, np.nan), np.where(np.isfinite(above), above, np.nan)
+
+
+def _previous(values: np.ndarray) -> np.ndarray:
+    return np.concatenate([[np.nan], values[:-1]])
+
+
+def level_bounce(candles: Candles, window: int = 250, step: int = 20, min_significance: float = 0.3) -> Signals:
+    """Buy when price touches support known before the candle and closes above it.
+
+    Stop is below the support, take profit is at the nearest resistance.
+    """
+    levels, price_error = rolling_levels(candles, window, step, min_significance)
+    support, _ = _nearest_levels(levels, _previous(candles.close))
+    _, resistance = _nearest_levels(levels, candles.close)
+
+    with np.errstate(invalid='ignore'):
+        entries = (candles.low <= support + price_error) & (candles.close > support)
+
+    return Signals(entries=entries, stop=support - price_error, take=resistance)
+
+
+def level_breakout(candles: Candles, window: int = 250, step: int = 20, min_significance: float = 0.3) -> Signals:
+    """Buy when candle closes above resistance known before the candle; stop is back below the level
+    """
+    levels, price_error = rolling_levels(candles, window, step, min_significance)
+    _, resistance = _nearest_levels(levels, _previous(candles.close))
+
+    with np.errstate(invalid='ignore'):
+        entries = candles.close > resistance + price_error
+
+    return Signals(entries=entries, stop=resistance - price_error)
+
+
+def macd_cross(candles: Candles, long: int = 26, short: int = 12, signal: int = 9) -> Signals:
+    """Buy when MACD histogram crosses zero upwards, sell when it crosses back
+    """
+    macd = ema(candles.close[None, :], short) - ema(candles.close[None, :], long)
+    histogram = (macd - ema(macd, signal))[0]
+    previous = _previous(histogram)
+
+    # Skip warm-up period of the long EMA
+    warmed_up = np.arange(len(histogram)) >= long
+
+    with np.errstate(invalid='ignore'):
+        return Signals(
+            entries=(previous <= 0) & (histogram > 0) & warmed_up,
+            exits=(previous >= 0) & (histogram < 0),
+        )
+
+
+STRATEGIES: Dict[str, Callable[..., Signals]] = {
+    'level_bounce': level_bounce,
+    'level_breakout': level_breakout,
+    'macd_cross': macd_cross,
+}
+
+
+def _first_hits(candles: Candles, entry_idx: np.ndarray, signals: Signals, max_hold: int) -> np.ndarray:
+    """Offset of the first candle after entry where stop or take profit is reached (max_hold + 1 if never)
+    """
+    num_of_candles = len(candles.close)
+    future_idx = entry_idx[:, None] + np.arange(1, max_hold + 1)
+    in_range = future_idx < num_of_candles
+    future_idx = np.minimum(future_idx, num_of_candles - 1)
+
+    hits = np.zeros(future_idx.shape, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        if signals.stop is not None:
+            hits |= candles.low[future_idx] <= signals.stop[entry_idx][:, None]
+        if signals.take is not None:
+            hits |= candles.high[future_idx] >= signals.take[entry_idx][:, None]
+
+    hits &= in_range
+    return np.where(hits.any(axis=1), hits.argmax(axis=1) + 1, max_hold + 1)
+
+
+def simulate(candles: Candles, signals: Signals, max_hold: int = 20) -> pd.DataFrame:
+    """Turn signals into trades. Entry is made at close of signal candle, only one position at a time.
+
+    Position is closed at stop / take profit price (stop first if both reached by one candle; a gap through
+    the price fills at open), on exit signal or after `max_hold` candles at close price.
+    """
+    num_of_candles = len(candles.close)
+    entry_idx = np.flatnonzero(signals.entries[:-1])
+    columns = ['entry_time', 'exit_time', 'entry_price', 'exit_price', 'return', 'holding']
+    if not len(entry_idx):
+        return pd.DataFrame(columns=columns)
+
+    exit_idx = np.minimum(entry_idx + max_hold, num_of_candles - 1)
+    if signals.exits is not None:
+        exit_signals = np.flatnonzero(signals.exits)
+        next_signal = np.searchsorted(exit_signals, entry_idx, side='right')
+        has_signal = next_signal < len(exit_signals)
+        signal_idx = exit_signals[np.minimum(next_signal, len(exit_signals) - 1)] if len(exit_signals) else exit_idx
+        exit_idx = np.where(has_signal, np.minimum(exit_idx, signal_idx), exit_idx)
+
+    hit_idx = entry_idx + _first_hits(candles, entry_idx, signals, max_hold)
+    hit_first = hit_idx <= exit_idx
+    exit_idx = np.where(hit_first, hit_idx, exit_idx)
+    exit_price = candles.close[exit_idx]
+
+    if signals.stop is not None or signals.take is not None:
+        stop = signals.stop[entry_idx] if signals.stop is not None else np.full(len(entry_idx), np.nan)
+        take = signals.take[entry_idx] if signals.take is not None else np.full(len(entry_idx), np.nan)
+        with np.errstate(invalid='ignore'):
+            stopped = hit_first & (candles.low[exit_idx] <= stop)
+        stop_price = np.minimum(stop, candles.open[exit_idx])
+        take_price = np.maximum(take, candles.open[exit_idx])
+        exit_price = np.where(hit_first, np.where(stopped, stop_price, take_price), exit_price)
+
+    # Drop entries made while previous position is still open (loop is over trades, not candles)
+    keep = np.zeros(len(entry_idx), dtype=bool)
+    position_closed_at = -1
+    for i, (entry, exit_) in enumerate(zip(entry_idx, exit_idx)):
+        if entry >= position_closed_at:
+            keep[i] = True
+            position_closed_at = exit_
+
+    entry_idx, exit_idx, exit_price = entry_idx[keep], exit_idx[keep], exit_price[keep]
+    entry_price = candles.close[entry_idx]
+
+    return pd.DataFrame({
+        'entry_time': candles.time[entry_idx],
+        'exit_time': candles.time[exit_idx],
+        'entry_price': entry_price,
+        'exit_price': exit_price,
+        'return': exit_price / entry_price - 1,
+        'holding': exit_idx - entry_idx,
+    }, columns=columns)
+
+
+def trades_stats(trades: pd.DataFrame) -> Dict[str, float]:
+    returns = trades['return'].to_numpy(dtype=float)
+    if not len(returns):
+        return {'trades': 0, 'win_rate': np.nan, 'avg_return': np.nan, 'total_return': 0.0,
+                'max_drawdown': 0.0, 'profit_factor': np.nan, 'avg_holding': np.nan}
+
+    equity = np.cumprod(1 + returns)
+    drawdown = 1 - equity / np.maximum.accumulate(np.concatenate([[1.0], equity]))[1:]
+    losses = -returns[returns < 0].sum()
+
+    return {
+        'trades': len(returns),
+        'win_rate': float((returns > 0).mean()),
+        'avg_return': float(returns.mean()),
+        'total_return': float(equity[-1] - 1),
+        'max_drawdown': float(drawdown.max()),
+        'profit_factor': float(returns[returns > 0].sum() / losses) if losses else np.inf,
+        'avg_holding': float(trades['holding'].mean()),
+    }
+
+
+def run_backtest(
+    candles: pd.DataFrame, strategy: str, max_hold: int = 20, **params: Any
+) -> Tuple[pd.DataFrame, Dict[str, float]]:
+    """Backtest strategy from `STRATEGIES` on candles DataFrame, returns trades and aggregate statistics
+    """
+    candles_arr = Candles.from_df(candles)
+    trades = simulate(candles_arr, STRATEGIES[strategy](candles_arr, **params), max_hold=max_hold)
+    return trades, trades_stats(trades)
+
+
+def _run_sweep_task(task: Tuple[str, Candles, str, Dict[str, Any]]) -> Dict[str, Any]:
+    ticker, candles, strategy, params = task
+    params = dict(params)
+    max_hold = params.pop('max_hold', 20)
+
+    trades = simulate(candles, STRATEGIES[strategy](candles, **params), max_hold=max_hold)
+    return {'ticker': ticker, 'max_hold': max_hold, **params, **trades_stats(trades)}
+
+
+def sweep(
+    candles: Dict[str, pd.DataFrame],
+    strategy: str,
+    param_grid: Dict[str, Sequence[Any]],
+    max_workers: Optional[int] = None,
+) -> pd.DataFrame:
+    """Run strategy for every ticker and every combination of parameters in a process pool
+
+    `param_grid` may include `max_hold` along with strategy parameters.
+    Returns statistics per (ticker, parameters).
+    """
+    arrays = {ticker: Candles.from_df(df) for ticker, df in candles.items()}
+    combinations = [dict(zip(param_grid, values)) for values in itertools.product(*param_grid.values())]
+    tasks = [(ticker, arr, strategy, params) for ticker, arr in arrays.items() for params in combinations]
+
+    logger.info('Running %s backtests of %s', len(tasks), strategy)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results: List[Dict[str, Any]] = list(executor.map(_run_sweep_task, tasks, chunksize=8))
+
+    return pd.DataFrame(results)
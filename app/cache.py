@@ -0,0 +1,129 @@
+import functools
+import pickle
+import threading
+from collections import OrderedDict
+from enum import Enum
+from typing import Any, Callable, Dict, Hashable, Tuple, TypeVar
+
+import numpy as np
+import pandas as pd
+
+T = TypeVar('T')
+
+
+def sizeof(value: Any) -> int:
+    """Approximate memory size of cached value in bytes
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+
+    if isinstance(value, tuple):
+        return sum(sizeof(item) for item in value)
+
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return 1024
+
+
+def _normalize(value: Any) -> Hashable:
+    # `Timeframe.D1` and 'day' are equal, but hashed differently
+    if isinstance(value, Enum):
+        return value.value  # type: ignore
+
+    return value  # type: ignore
+
+
+class ComputeCache:
+    """Thread-safe LRU cache bounded by memory size of values
+
+    Values computed from stored candles should be keyed by version of these candles (see `candles.get_data_version`):
+    values of outdated versions are not requested anymore and get evicted.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+
+        self._items: 'OrderedDict[Hashable, Tuple[Any, int]]' = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._items.move_to_end(key)
+            return self._items[key][0]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        size = sizeof(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._items:
+                self._size -= self._items.pop(key)[1]
+
+            self._items[key] = (value, size)
+            self._size += size
+
+            while self._size > self.max_bytes:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self._size -= evicted_size
+                self.evictions += 1
+
+    def get_or_compute(self, key: Hashable, func: Callable[[], T]) -> T:
+        missing = object()
+        value = self.get(key, missing)
+
+        if value is missing:
+            # Computed outside of the lock: concurrent misses may compute the same value twice
+            value = func()
+            self.set(key, value)
+
+        return value  # type: ignore
+
+    def memoize(self, func: Callable[..., T]) -> Callable[..., T]:
+        """Cache function results by its arguments, which should be cheap hashable values (not DataFrames)
+        """
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> T:
+            key = (
+                func.__qualname__,
+                tuple(_normalize(arg) for arg in args),
+                tuple(sorted((name, _normalize(arg)) for name, arg in kwargs.items())),
+            )
+            return self.get_or_compute(key, lambda: func(*args, **kwargs))
+
+        return wrapper
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'items': len(self._items),
+                'size_mb': self._size / 2 ** 20,
+                'max_size_mb': self.max_bytes / 2 ** 20,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0,
+                'evictions': self.evictions,
+            }
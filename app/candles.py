@@ -0,0 +1,96 @@
+import datetime as dt
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from . import models
+from .config import settings
+from .schema import Timeframe
+from .utils import localize_dt
+
+CANDLE_COLUMNS = ('open', 'close', 'high', 'low', 'volume', 'time')
+CANDLE_COLUMN_TYPES = {
+    'open': 'float8',
+    'close': 'float8',
+    'high': 'float8',
+    'low': 'float8',
+    'volume': 'int8',
+    'time': 'timestamptz',
+}
+
+# Read by binary COPY (see `models.db_query_df`), so no trailing semicolon
+CANDLES_SQL = '''
+    SELECT array_position($1::text[], instrument.ticker)::int4, {columns} FROM candle
+        JOIN instrument ON instrument.figi = candle.instrument_id
+    WHERE instrument.ticker = ANY($1::text[]) AND candle.timeframe = $2 AND candle.time >= $3 AND candle.time <= $4
+    ORDER BY candle.instrument_id, candle.time
+'''.format(columns=', '.join(f'candle.{column}::{CANDLE_COLUMN_TYPES[column]}' for column in CANDLE_COLUMNS))
+
+
+def date_range_to_dt(start_date: dt.date, end_date: dt.date) -> Tuple[dt.datetime, dt.datetime]:
+    return (
+        localize_dt(dt.datetime.combine(start_date, dt.time())),
+        localize_dt(dt.datetime.combine(end_date, dt.time(23, 59))),
+    )
+
+
+async def _load_candles(
+    tickers: List[str], start_date: dt.date, end_date: dt.date, timeframe: Timeframe, label: str
+) -> pd.DataFrame:
+    start_dt, end_dt = date_range_to_dt(start_date, end_date)
+
+    candles = await models.db_query_df(
+        CANDLES_SQL,
+        {'ticker_idx': 'int4', **{column: CANDLE_COLUMN_TYPES[column] for column in CANDLE_COLUMNS}},
+        [tickers, timeframe.value, start_dt, end_dt],
+        label=label,
+    )
+    candles['time'] = candles.time.dt.tz_convert(settings.TZ_NAME)
+    return candles
+
+
+async def load_candles_df(ticker: str, start_date: dt.date, end_date: dt.date, timeframe: Timeframe) -> pd.DataFrame:
+    """Load stored candles of the instrument for the date range
+    """
+    candles = await _load_candles([ticker], start_date, end_date, timeframe, label='load_candles_df')
+    return candles.drop(columns='ticker_idx')
+
+
+async def load_candles_dfs(
+    tickers: List[str], start_date: dt.date, end_date: dt.date, timeframe: Timeframe
+) -> Dict[str, pd.DataFrame]:
+    """Load stored candles of many instruments by single query and split them by ticker in memory
+    """
+    candles = await _load_candles(tickers, start_date, end_date, timeframe, label='load_candles_dfs')
+
+    result = {ticker: candles.iloc[:0].drop(columns='ticker_idx') for ticker in tickers}
+    for ticker_idx, ticker_candles in candles.groupby('ticker_idx', sort=False):
+        result[tickers[ticker_idx - 1]] = ticker_candles.drop(columns='ticker_idx').reset_index(drop=True)
+
+    return result
+
+
+# Every (instrument, timeframe) max(id) is a lookup in index (instrument_id, timeframe, id). Written candles
+# get ids greater than all existing ones: replaced by sync jobs and updated by rollups too (see `rollups.ROLLUP_SQL`),
+# so the max of them changes with every write
+DATA_VERSION_SQL = '''
+    SELECT coalesce(max((
+        SELECT max(candle.id) FROM candle
+        WHERE candle.instrument_id = instrument.figi AND candle.timeframe = requested.timeframe
+    )), 0)
+    FROM instrument, unnest($2::text[]) AS requested(timeframe)
+    WHERE $1::text[] IS NULL OR instrument.ticker = ANY($1::text[]);
+'''
+
+
+async def get_data_version(
+    tickers: Optional[Sequence[str]] = None, timeframes: Optional[Sequence[Timeframe]] = None
+) -> int:
+    """Watermark of stored candles of the instruments and timeframes (all by default): changes whenever
+    their candles are written, but not when other instruments or timeframes are synced
+    """
+    timeframe_values = [Timeframe(timeframe).value for timeframe in timeframes or Timeframe]
+    result = await models.db_query(
+        DATA_VERSION_SQL, [list(tickers) if tickers is not None else None, timeframe_values], label='data_version'
+    )
+    return result[0][0]  # type: ignore
@@ -1,16 +1,19 @@
+import datetime as dt
 import logging
-from typing import Any, Dict, Literal, Optional
+from typing import Any, Dict, List, Literal, Optional
 
-import httpx
 import pytz
-from pydantic import AnyUrl, BaseSettings, Field, SecretStr, root_validator
+from pydantic import AnyUrl, BaseSettings, Field, SecretStr, root_validator, validator
 from pytz.tzinfo import DstTzInfo
 
+# Timeframes which can be rolled up, same as buckets of `rollups.BUCKET_SQL`. Day candles are always downloaded
+ROLLUP_TARGETS = ('5min', '10min', '30min', 'hour', 'week', 'month')
+
 
 class Settings(BaseSettings):
     ENVIRONMENT: Literal['local', 'prod'] = 'local'
 
-    TINKOFF_HTTP_URL: httpx.URL = httpx.URL('https://api-invest.tinkoff.ru/openapi/')
+    TINKOFF_HTTP_URL: str = 'https://api-invest.tinkoff.ru/openapi/'
     TINKOFF_WS_URL: AnyUrl = Field('wss://api-invest.tinkoff.ru/openapi/md/v1/md-openapi/ws')
     TINKOFF_TOKEN: SecretStr = SecretStr('')
 
@@ -29,6 +32,63 @@ class Settings(BaseSettings):
     LOGGING_FORMAT: str = '[%(asctime)s] %(levelname)s %(name)s: %(message)s'
     LOGGING: Dict[str, Any] = {}
 
+    METRICS_HOST: str = '127.0.0.1'
+    METRICS_PORT: int = 9100
+    METRICS_ENABLED: bool = True
+    TRACING_ENABLED: bool = False
+
+    SYNC_PROFILE_ENABLED: bool = False
+    SYNC_PROFILE_THRESHOLD: float = 300  # seconds; dump cProfile stats only for stages slower than this
+    SYNC_PROFILE_DIR: str = 'profiles'
+
+    TINKOFF_RATE_LIMIT: int = 240  # requests per minute for the whole token
+    TINKOFF_MAX_CONNECTIONS: int = 20
+    TINKOFF_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    TINKOFF_TIMEOUT: float = 30  # seconds, for read/write/pool
+    TINKOFF_CONNECT_TIMEOUT: float = 5  # seconds
+    TINKOFF_HTTP2: bool = True  # used only if `h2` package is installed (`httpx[http2]`)
+    SYNC_WORKERS: int = 1  # number of sync processes sharing the token rate limit
+    SYNC_JOB_LEASE: int = 600  # seconds
+    SYNC_WORKER_POLL_INTERVAL: int = 5  # seconds
+
+    # Adaptive scheduler keeps candles fresh by staleness: watchlist during market hours, the rest after close
+    SYNC_SCHEDULER_RATE_LIMIT: int = 60  # requests per minute, part of `TINKOFF_RATE_LIMIT`
+    SYNC_SCHEDULER_TIMEFRAMES: List[str] = ['day']
+    SYNC_WATCHLIST: List[str] = []  # tickers
+    SYNC_WATCHLIST_INTERVAL: int = 300  # seconds, refresh interval of watchlist during market hours
+    SYNC_MARKET_OPEN: dt.time = dt.time(19, 30)  # local time, session may end after midnight
+    SYNC_MARKET_CLOSE: dt.time = dt.time(2, 0)
+
+    # Coarse timeframes aggregated in DB from finer ones at the end of sync: {target: source}.
+    # Intraday rollups (e.g. {"hour": "1min"}) can be added once intraday candles are stored
+    CANDLE_ROLLUPS: Dict[str, str] = {'week': 'day', 'month': 'day'}
+    # Candles older than this number of days are removed after being rolled up: {timeframe: days}.
+    # Every timeframe should be a source of a rollup, e.g. {"1min": 90} with rollups {"hour": "1min"}
+    CANDLE_RETENTION: Dict[str, int] = {}
+    CANDLE_RETENTION_BATCH: int = 10_000  # rows removed per DELETE statement
+    DASHBOARD_MIN_POINTS: int = 150  # the coarsest timeframe giving at least this number of candles is used
+
+    DASHBOARD_CACHE_DIR: str = '.cache/dashboard'  # should be shared by all dashboard replicas and sync
+    DASHBOARD_CACHE_MAX_AGE: int = 7  # days
+    DASHBOARD_CACHE_MAX_SIZE: int = 1024  # MB, the oldest figures are removed above it
+    DASHBOARD_CACHE_PRUNE_INTERVAL: int = 600  # seconds between prunes made by dashboard replicas on save
+    DASHBOARD_PREWARM_ENABLED: bool = False
+    DASHBOARD_PREWARM_PROCESSES: Optional[int] = None  # tickers prewarmed at once, number of CPUs by default
+    DASHBOARD_MEMORY_CACHE_SIZE: int = 512  # MB, in-process cache of candles and figures of each dashboard replica
+
+    ALERT_TICKERS: List[str] = []  # all active stocks if empty
+    ALERT_HISTORY_DAYS: int = 365  # day candles used to find S/R levels
+    ALERT_SR_SIGNIFICANCE_THRESHOLD: float = 0.25
+    ALERT_POLL_INTERVAL: int = 5  # seconds, also delay of reconnection to streaming API
+    ALERT_STREAMING: bool = True  # used only if `websockets` package is installed, prices are polled otherwise
+    ALERT_LEVELS_RELOAD_INTERVAL: int = 3600  # seconds, levels are reloaded if stored candles have changed
+
+    @validator('TIMEZONE', pre=True)
+    @classmethod
+    def timezone_from_name(cls, value: Any) -> None:
+        # Set by `TZ_NAME` only: Tortoise exports TIMEZONE env var with the name, which is inherited by subprocesses
+        return None
+
     @root_validator
     @classmethod
     def post_init(cls, values: Dict[str, Any]) -> Dict[str, Any]:
@@ -85,6 +145,14 @@ class Settings(BaseSettings):
 
         values['TIMEZONE'] = pytz.timezone(values['TZ_NAME'])
 
+        unsupported = set(values['CANDLE_ROLLUPS']) - set(ROLLUP_TARGETS)
+        if unsupported:
+            raise RuntimeError(f'Rollups to unsupported timeframes: {", ".join(sorted(unsupported))}')
+
+        unpaired = set(values['CANDLE_RETENTION']) - set(values['CANDLE_ROLLUPS'].values())
+        if unpaired:
+            raise RuntimeError(f'Candle retention of timeframes without rollups: {", ".join(sorted(unpaired))}')
+
         return values
 
     class Config:
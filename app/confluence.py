@@ -0,0 +1,148 @@
+import logging
+import statistics
+from concurrent.futures.process import BrokenProcessPool
+from decimal import Decimal
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from .schema import Timeframe
+from .support_resistance import StreamingSupportResistanceSearch
+from .utils import process_pool, reset_process_pool
+
+logger = logging.getLogger(__name__)
+
+CONFLUENCE_COLUMNS = ['price', 'time', 'significance', 'timeframes', 'confluence']
+
+
+class SearchParams(NamedTuple):
+    min_size_of_batch: int
+    recent_level_rate: int = 16
+    max_batch_iterations: Optional[int] = None
+    weight: float = 1  # contribution of the timeframe levels to merged significance
+
+
+# Day parameters are the defaults of `SupportResistanceSearch`. Other timeframes keep batches of comparable
+# duration: a few months of week candles, a few days of hour candles (their history is also much longer)
+SEARCH_PARAMS: Dict[Timeframe, SearchParams] = {
+    Timeframe.H1: SearchParams(min_size_of_batch=40, max_batch_iterations=250, weight=1),
+    Timeframe.D1: SearchParams(min_size_of_batch=5, weight=2),
+    Timeframe.D7: SearchParams(min_size_of_batch=3, weight=3),
+    Timeframe.D30: SearchParams(min_size_of_batch=3, weight=4),
+}
+
+# Smaller searches take less time than sending candles to worker processes, so they are run in-process
+PARALLEL_MIN_CANDLES = 5000
+
+
+def find_timeframe_levels(
+    timeframe: Timeframe, candles: pd.DataFrame, significance_threshold: float
+) -> Tuple[pd.DataFrame, float]:
+    """Levels of one timeframe (price, time in UTC, significance, timeframe) and price error used to find them
+    """
+    params = SEARCH_PARAMS[timeframe]
+
+    # Streaming search with single-candle blocks gives the same levels as `SupportResistanceSearch`, only faster
+    search = StreamingSupportResistanceSearch(
+        [candles],
+        min_size_of_batch=params.min_size_of_batch,
+        recent_level_rate=params.recent_level_rate,
+        block_size=1,
+        max_batch_iterations=params.max_batch_iterations,
+    )
+    levels = search.find_levels(Decimal(significance_threshold))
+
+    levels = pd.DataFrame({
+        'price': levels.price.astype(float),
+        'time': pd.to_datetime(levels.time, utc=True),
+        'significance': levels.significance.astype(float),
+        'timeframe': timeframe,
+    })
+    return levels, float(search.price_error)
+
+
+def _zones(prices: Sequence[float], price_error: float) -> List[int]:
+    """Zone number of every sorted price: a zone spans `price_error` from its lowest price
+    """
+    zones = []
+    zone, zone_start = -1, None
+    for price in prices:
+        if zone_start is None or price - zone_start > price_error:
+            zone, zone_start = zone + 1, price
+        zones.append(zone)
+
+    return zones
+
+
+def merge_levels(levels: Sequence[pd.DataFrame], price_error: float) -> pd.DataFrame:
+    """Merge levels of several timeframes which are closer than `price_error`.
+
+    Weight of a level is its significance times weight of its timeframe. Merged level has weighted mean price,
+    the earliest time, the timeframes it was found on (`confluence` is their number) and significance
+    relative to the heaviest merged level.
+    """
+    levels = [timeframe_levels for timeframe_levels in levels if not timeframe_levels.empty]
+    if not levels:
+        return pd.DataFrame(columns=CONFLUENCE_COLUMNS)
+
+    all_levels = pd.concat(levels, ignore_index=True).sort_values('price', ignore_index=True)
+    weight = all_levels.significance * all_levels.timeframe.map(lambda timeframe: SEARCH_PARAMS[timeframe].weight)
+    all_levels = all_levels.assign(
+        zone=_zones(all_levels.price.tolist(), price_error),
+        weight=weight,
+        weighted_price=all_levels.price * weight,
+    )
+
+    order = list(SEARCH_PARAMS)
+    zones = all_levels.groupby('zone', sort=True)
+    merged = pd.DataFrame({
+        'price': zones.weighted_price.sum() / zones.weight.sum(),
+        'time': zones.time.min(),
+        'significance': zones.weight.sum() / zones.weight.sum().max(),
+        'timeframes': zones.timeframe.agg(lambda timeframes: tuple(sorted(set(timeframes), key=order.index))),
+    })
+    merged['confluence'] = merged.timeframes.map(len)
+
+    return merged.reset_index(drop=True)[CONFLUENCE_COLUMNS]
+
+
+def find_confluence_levels(
+    candles: Mapping[Timeframe, pd.DataFrame],
+    significance_threshold: float = 0.25,
+    min_confluence: int = 1,
+) -> pd.DataFrame:
+    """S/R levels found on candles of several timeframes (in a process pool if there are many candles)
+    and merged into common zones.
+
+    Zone width is the median of price errors of the timeframes, e.g. the day one for (hour, day, week).
+    Timeframes without search parameters (see `SEARCH_PARAMS`) are not supported.
+    """
+    unsupported = set(candles) - set(SEARCH_PARAMS)
+    if unsupported:
+        raise ValueError(f'No S/R search parameters for timeframes: {", ".join(map(str, unsupported))}')
+
+    timeframes = [
+        timeframe for timeframe, timeframe_candles in candles.items()
+        if len(timeframe_candles) >= 2 * SEARCH_PARAMS[timeframe].min_size_of_batch
+    ]
+    if not timeframes:
+        return pd.DataFrame(columns=CONFLUENCE_COLUMNS)
+
+    tasks = (timeframes, [candles[timeframe] for timeframe in timeframes], [significance_threshold] * len(timeframes))
+
+    results: Optional[Iterable[Tuple[pd.DataFrame, float]]] = None
+    if len(timeframes) > 1 and sum(len(candles[timeframe]) for timeframe in timeframes) >= PARALLEL_MIN_CANDLES:
+        pool = process_pool()
+        try:
+            results = list(pool.map(find_timeframe_levels, *tasks))
+        except BrokenProcessPool:
+            logger.warning('Process pool is broken, searching S/R levels in-process')
+            reset_process_pool(pool)
+
+    if results is None:
+        results = map(find_timeframe_levels, *tasks)
+
+    levels, price_errors = zip(*results)
+
+    merged = merge_levels(levels, statistics.median(price_errors))
+    return merged[merged.confluence >= min_confluence]
@@ -2,21 +2,28 @@
 import asyncio
 import datetime as dt
 import logging
-from decimal import Decimal
 from enum import Enum
-from typing import Optional
+from typing import TYPE_CHECKING, Optional, Tuple
 
 import pandas as pd
-import plotly.graph_objects as go
 import streamlit as st
 from cachetools.func import ttl_cache
 
-from app.tinkoff import TinkoffClient
-
-from . import graphs, models
+from . import candles, models, rollups
+from .cache import ComputeCache
+from .config import settings
 from .schema import Timeframe
-from .support_resistance import SupportResistanceSearch
-from .utils import localize_dt
+from .utils import lazy_import
+
+if TYPE_CHECKING:  # pragma: no cover
+    import plotly.graph_objects as go
+
+# Plotly and S/R search are loaded when the first graph is built, so the main page is drawn without them
+confluence = lazy_import('app.confluence')
+dashboard_cache = lazy_import('app.dashboard_cache')
+graphs = lazy_import('app.graphs')
+screener = lazy_import('app.screener')
+watchlist = lazy_import('app.watchlist')
 
 logger = logging.getLogger(__name__)
 
@@ -24,14 +31,27 @@ EMPTY_CHOICE = '-----'
 
 loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
 
-
-tinkoff_client = TinkoffClient()
+# Keyed by cheap arguments (ticker, dates, timeframe) instead of hashing DataFrames. Memoized functions also get
+# version of the candles they use, so values computed from other instruments survive their sync
+compute_cache = ComputeCache(max_bytes=settings.DASHBOARD_MEMORY_CACHE_SIZE * 2 ** 20)
 
 
 def _await(coro):
     return loop.run_until_complete(coro)
 
 
+def get_data_version(tickers: Optional[Tuple[str, ...]], timeframes: Tuple[Timeframe, ...]) -> int:
+    return _await(candles.get_data_version(tickers, timeframes))
+
+
+@st.cache(allow_output_mutation=True)
+def get_tinkoff_client():
+    # Created on the first download from API, so pages reading stored candles work without a token
+    from .tinkoff import TinkoffClient
+
+    return TinkoffClient()
+
+
 @st.cache
 def init():
     _await(models.init_db())
@@ -55,10 +75,14 @@ class MainPage(Page):
     def show(self):
         st.write('Welcome!')
 
+        st.subheader('Cache')
+        st.table(pd.Series(compute_cache.stats(), name='value').astype(str))
+
 
 class StocksViewerPage(Page):
 
-    def __init__(self, default_start_date: dt.datetime, default_end_date: dt.datetime):
+    def __init__(self, default_start_date: dt.date, default_end_date: Optional[dt.date]):
+        # Page is cached for the whole process lifetime, so `None` end date means today of every run
         self.default_candle_start_date = default_start_date
         self.default_candle_end_date = default_end_date
 
@@ -77,6 +101,7 @@ class StocksViewerPage(Page):
         self.sr_start_date = None
         self.sr_end_date = None
         self.sr_significance_threshold = None
+        self.sr_timeframes = None
 
         self.show_macd = None
 
@@ -86,10 +111,10 @@ class StocksViewerPage(Page):
     @st.cache(allow_output_mutation=True)
     def init(
         cls,
-        default_start_date: dt.datetime = dt.date(2021, 1, 1),
-        default_end_date: dt.datetime = dt.date.today(),
+        default_start_date: Optional[dt.date] = None,
+        default_end_date: Optional[dt.date] = None,
     ) -> 'StocksViewerPage':
-        return cls(default_start_date, default_end_date)
+        return cls(default_start_date or dashboard_cache.DEFAULT_START_DATE, default_end_date)
 
     @staticmethod
     @st.cache
@@ -111,51 +136,31 @@ class StocksViewerPage(Page):
     @classmethod
     @ttl_cache(ttl=600)
     def download_candles(cls, figi: str, start_dt: dt.datetime, end_dt: dt.datetime, timeframe: Timeframe):
-        return _await(tinkoff_client.get_candles(
+        return _await(get_tinkoff_client().get_candles(
             figi=figi, timeframe=timeframe, start_dt=start_dt, end_dt=end_dt
         ))
 
     @classmethod
-    @st.cache(allow_output_mutation=True)
+    @compute_cache.memoize
     def get_candles_df(
         cls,
         ticker: str,
         start_date: dt.date,
         end_date: dt.date,
         timeframe: Timeframe,
+        data_version: int,
     ):
+        if timeframe in rollups.stored_timeframes():
+            return _await(candles.load_candles_df(ticker, start_date, end_date, timeframe))
+
         stock = _await(models.Instrument.get(ticker=ticker))
-        start_dt = localize_dt(dt.datetime.combine(start_date, dt.time()))
-        end_dt = localize_dt(dt.datetime.combine(end_date, dt.time(23, 59)))
-
-        if timeframe == Timeframe.D1:
-            candles_data = _await(
-                models.Candle.filter(
-                    instrument=stock,
-                    timeframe=Timeframe.D1,
-                )
-                .filter(time__gte=start_dt, time__lte=end_dt)
-                .values('open', 'close', 'high', 'low', 'volume', 'time')
-            )
-        else:
-            candles_data = (o.dict() for o in cls.download_candles(stock.figi, start_dt, end_dt, timeframe))
+        start_dt, end_dt = candles.date_range_to_dt(start_date, end_date)
+        candles_data = (o.dict() for o in cls.download_candles(stock.figi, start_dt, end_dt, timeframe))
 
         return pd.DataFrame.from_dict(candles_data)
 
     @classmethod
-    @st.cache(allow_output_mutation=True)
-    def get_macd_graph(cls, candles: pd.DataFrame):
-        ema_long = candles.close.ewm(span=26, adjust=False).mean()
-        ema_short = candles.close.ewm(span=12, adjust=False).mean()
-        macd = ema_short - ema_long
-
-        signal_ema = macd.ewm(span=9, adjust=False).mean()
-        macd_histogram = macd - signal_ema
-
-        return go.Bar(x=candles.time, y=macd_histogram, name='MACD(26,12,9)')
-
-    @classmethod
-    @st.cache(allow_output_mutation=True)
+    @compute_cache.memoize
     def get_candles_graph(
         cls,
         ticker: str,
@@ -166,31 +171,59 @@ class StocksViewerPage(Page):
         sr_end_date: Optional[dt.date] = None,
         sr_significance_threshold: Optional[float] = None,
         macd: bool = False,
+        sr_timeframes: Tuple[Timeframe, ...] = (Timeframe.D1, ),
+        data_version: int = 0,
     ):
-        candles_df = cls.get_candles_df(ticker, candle_start_date, candle_end_date, candle_timeframe)
-
-        macd_graph = cls.get_macd_graph(candles_df) if macd else None
-        graph = graphs.get_candles_graph(ticker, candles_df, macd_graph)
-
-        if sr_start_date and sr_end_date:
-            sr_candles_df = cls.get_candles_df(ticker, sr_start_date, sr_end_date, Timeframe.D1)
+        """`data_version` - version of candles of the ticker in candle and S/R timeframes
+        """
+        # Views prewarmed by sync (or built by another replica) are taken from the shared cache
+        cache_key = dashboard_cache.view_key(
+            ticker, candle_start_date, candle_end_date, candle_timeframe,
+            sr_start_date, sr_end_date, sr_significance_threshold, macd, ','.join(sr_timeframes),
+            data_version,
+        )
+        graph = dashboard_cache.load_figure(cache_key)
+        if graph is not None:
+            return graph
+
+        candles_df = cls.get_candles_df(ticker, candle_start_date, candle_end_date, candle_timeframe, data_version)
+        sr_candles_df = sr_levels = None
+        if sr_start_date and sr_end_date and tuple(sr_timeframes) == (Timeframe.D1, ):
+            sr_candles_df = cls.get_candles_df(ticker, sr_start_date, sr_end_date, Timeframe.D1, data_version)
+        elif sr_start_date and sr_end_date:
+            sr_levels = cls.get_confluence_levels(
+                ticker, sr_start_date, sr_end_date, tuple(sr_timeframes), sr_significance_threshold, data_version
+            )
 
-            sr_levels = SupportResistanceSearch(sr_candles_df).find_levels(Decimal(sr_significance_threshold))
-            for _, level in sr_levels.iterrows():
-                graphs.draw_line(
-                    graph=graph,
-                    x0=min(candles_df.time),
-                    x1=max(candles_df.time),
-                    y0=level['price'],
-                    y1=level['price'],
-                    opacity=level['significance']
-                )
+        graph = graphs.build_candles_graph(
+            ticker, candles_df, sr_candles_df, sr_significance_threshold, macd, sr_levels=sr_levels
+        )
+        dashboard_cache.save_figure(cache_key, graph.to_json())
 
         return graph
 
+    @classmethod
+    @compute_cache.memoize
+    def get_confluence_levels(
+        cls,
+        ticker: str,
+        start_date: dt.date,
+        end_date: dt.date,
+        timeframes: Tuple[Timeframe, ...],
+        significance_threshold: float,
+        data_version: int,
+    ):
+        """Levels are searched on stored candles only: downloading years of hour candles takes hours
+        """
+        sr_candles_dfs = {
+            timeframe: _await(candles.load_candles_df(ticker, start_date, end_date, timeframe))
+            for timeframe in timeframes
+            if timeframe in rollups.stored_timeframes()
+        }
+        return confluence.find_confluence_levels(sr_candles_dfs, significance_threshold)
+
     @staticmethod
-    @st.cache
-    def update_graph_hover(graph: go.Figure, show_hover: bool):
+    def update_graph_hover(graph: 'go.Figure', show_hover: bool):
         graphs.update_graph_hover(graph, show_hover)
 
     def show_sidebar(self):
@@ -201,20 +234,33 @@ class StocksViewerPage(Page):
             format_func=self.format_stocks_selectbox
         )
         self.candle_start_date = st.sidebar.date_input('Start Date', value=self.default_candle_start_date)
-        self.candle_end_date = st.sidebar.date_input('End Date', value=self.default_candle_end_date)
+        self.candle_end_date = st.sidebar.date_input('End Date', value=self.default_candle_end_date or dt.date.today())
         self.candle_timeframe = st.sidebar.selectbox(
             'Timeframe',
             Timeframe.as_list(),
             Timeframe.as_list().index(Timeframe.D1),
         )
+        if st.sidebar.checkbox('Auto Timeframe', value=True):
+            self.candle_timeframe = rollups.pick_timeframe(
+                self.candle_start_date, self.candle_end_date, base=Timeframe(self.candle_timeframe)
+            )
         self.show_hover = st.sidebar.checkbox('Show Hover', value=False)
 
         st.sidebar.markdown('---')
         st.sidebar.text('Support/Resistance Levels')
         self.show_sr_levels = st.sidebar.checkbox('Show Levels', value=False)
         self.sr_start_date = st.sidebar.date_input('S/R Start Date', value=self.default_sr_start_date)
-        self.sr_end_date = st.sidebar.date_input('S/R End Date', value=self.default_sr_end_date)
-        self.sr_significance_threshold = st.sidebar.number_input('Significnce Threshold', value=0.25)
+        self.sr_end_date = st.sidebar.date_input('S/R End Date', value=self.default_sr_end_date or dt.date.today())
+        self.sr_significance_threshold = st.sidebar.number_input(
+            'Significnce Threshold', value=dashboard_cache.DEFAULT_SR_SIGNIFICANCE_THRESHOLD
+        )
+        # Levels found on several timeframes are merged, the ones found on many of them are the strongest
+        sr_timeframes = st.sidebar.multiselect(
+            'S/R Timeframes',
+            [timeframe.value for timeframe in confluence.SEARCH_PARAMS if timeframe in rollups.stored_timeframes()],
+            [timeframe.value for timeframe in dashboard_cache.DEFAULT_SR_TIMEFRAMES],
+        )
+        self.sr_timeframes = tuple(Timeframe(timeframe) for timeframe in sr_timeframes)
 
         st.sidebar.markdown('---')
         st.sidebar.text('Indicators')
@@ -238,8 +284,13 @@ class StocksViewerPage(Page):
                     **candle_kwargs,
                     'sr_start_date': self.sr_start_date,
                     'sr_end_date': self.sr_end_date,
-                    'sr_significance_threshold': self.sr_significance_threshold
+                    'sr_significance_threshold': self.sr_significance_threshold,
+                    'sr_timeframes': self.sr_timeframes or dashboard_cache.DEFAULT_SR_TIMEFRAMES,
                 }
+            candle_kwargs['data_version'] = get_data_version(
+                (self.ticker, ),
+                (self.candle_timeframe, *candle_kwargs.get('sr_timeframes', dashboard_cache.DEFAULT_SR_TIMEFRAMES)),
+            )
 
             graph = self.get_candles_graph(**candle_kwargs)
             self.update_graph_hover(graph, self.show_hover)
@@ -247,8 +298,162 @@ class StocksViewerPage(Page):
             st.plotly_chart(graph, use_container_width=True, config={'displayModeBar': False})
 
 
+class ScreenerPage(Page):
+
+    def __init__(self):
+        self.history_start_date = None
+        self.max_support_distance = None
+        self.min_significance = None
+        self.macd_cross_within = None
+
+    @classmethod
+    def init(cls):
+        return cls()
+
+    @staticmethod
+    @compute_cache.memoize
+    def load_price_panel(start_date: dt.date, end_date: dt.date, data_version: int):
+        return _await(screener.load_price_panel(start_date, end_date))
+
+    def show_sidebar(self):
+        st.sidebar.text('History')
+        self.history_start_date = st.sidebar.date_input('Start Date', value=dt.date.today() - dt.timedelta(days=365))
+
+        st.sidebar.markdown('---')
+        st.sidebar.text('Support Levels')
+        self.max_support_distance = st.sidebar.number_input('Max Distance to Support, %', value=2.0) / 100
+        self.min_significance = st.sidebar.number_input('Significnce Threshold', value=0.25)
+
+        st.sidebar.markdown('---')
+        st.sidebar.text('Indicators')
+        if st.sidebar.checkbox('Bullish MACD(26, 12, 9) Cross', value=False):
+            self.macd_cross_within = st.sidebar.number_input('Within Last Candles', value=3, min_value=1)
+        else:
+            self.macd_cross_within = None
+
+    def show(self):
+        self.show_sidebar()
+
+        panel = self.load_price_panel(
+            self.history_start_date, dt.date.today(), get_data_version(None, (Timeframe.D1, ))
+        )
+        result = screener.screen(
+            panel,
+            max_support_distance=self.max_support_distance,
+            min_significance=self.min_significance,
+            macd_cross_within=self.macd_cross_within,
+        )
+
+        st.title('Screener')
+        st.write(f'Found {len(result)} of {len(panel.figis)} stocks')
+        st.dataframe(result)
+
+
+class WatchlistPage(Page):
+
+    def __init__(self, stocks_choices):
+        self.stocks_choices = stocks_choices
+
+        self.tickers = None
+        self.start_date = None
+        self.end_date = None
+        self.timeframe = None
+        self.normalized = None
+
+        self.show_sr_levels = None
+        self.sr_significance_threshold = None
+        self.show_macd = None
+
+    @classmethod
+    def init(cls):
+        return cls(StocksViewerPage._get_stocks_choices())
+
+    @staticmethod
+    @compute_cache.memoize
+    def get_candles_dfs(
+        tickers: tuple, start_date: dt.date, end_date: dt.date, timeframe: Timeframe, data_version: int
+    ):
+        return _await(candles.load_candles_dfs(list(tickers), start_date, end_date, timeframe))
+
+    @classmethod
+    @compute_cache.memoize
+    def get_graphs(
+        cls,
+        tickers: tuple,
+        start_date: dt.date,
+        end_date: dt.date,
+        timeframe: Timeframe,
+        sr_significance_threshold: Optional[float] = None,
+        macd: bool = False,
+        data_version: int = 0,
+    ):
+        candles_dfs = cls.get_candles_dfs(tickers, start_date, end_date, timeframe, data_version)
+
+        sr_candles_dfs = None
+        if sr_significance_threshold is not None:
+            sr_candles_dfs = cls.get_candles_dfs(tickers, start_date, end_date, Timeframe.D1, data_version)
+
+        return watchlist.build_graphs(candles_dfs, sr_candles_dfs, sr_significance_threshold, macd)
+
+    def show_sidebar(self):
+        st.sidebar.text('Watchlist')
+        self.tickers = st.sidebar.multiselect('Tickers', list(self.stocks_choices.keys()))
+        self.start_date = st.sidebar.date_input('Start Date', value=dashboard_cache.DEFAULT_START_DATE)
+        self.end_date = st.sidebar.date_input('End Date', value=dt.date.today())
+        self.timeframe = rollups.pick_timeframe(self.start_date, self.end_date)
+        self.normalized = st.sidebar.checkbox('Normalized Overlay', value=False)
+
+        st.sidebar.markdown('---')
+        st.sidebar.text('Support/Resistance Levels')
+        self.show_sr_levels = st.sidebar.checkbox('Show Levels', value=False)
+        self.sr_significance_threshold = st.sidebar.number_input(
+            'Significnce Threshold', value=dashboard_cache.DEFAULT_SR_SIGNIFICANCE_THRESHOLD
+        )
+
+        st.sidebar.markdown('---')
+        st.sidebar.text('Indicators')
+        self.show_macd = st.sidebar.checkbox('Show MACD(26, 12, 9)', value=False)
+
+    def show(self):
+        self.show_sidebar()
+
+        st.title('Watchlist')
+        if not self.tickers:
+            return
+
+        tickers = tuple(sorted(self.tickers))
+        data_version = get_data_version(tickers, (self.timeframe, Timeframe.D1))
+
+        if self.normalized:
+            candles_dfs = self.get_candles_dfs(tickers, self.start_date, self.end_date, self.timeframe, data_version)
+            graph = watchlist.get_normalized_graph(candles_dfs)
+            st.plotly_chart(graph, use_container_width=True, config={'displayModeBar': False})
+            return
+
+        graphs_by_ticker = self.get_graphs(
+            tickers,
+            self.start_date,
+            self.end_date,
+            self.timeframe,
+            self.sr_significance_threshold if self.show_sr_levels else None,
+            self.show_macd,
+            data_version,
+        )
+        columns = st.beta_columns(2)
+        for i, ticker in enumerate(tickers):
+            with columns[i % 2]:
+                st.subheader(f'{ticker} ({self.stocks_choices[ticker]})')
+                if ticker not in graphs_by_ticker:
+                    st.write('No candles')
+                    continue
+
+                st.plotly_chart(graphs_by_ticker[ticker], use_container_width=True, config={'displayModeBar': False})
+
+
 class MenuChoices(str, Enum):
     STOCKS_VIEWER = 'Stocks Viewer'
+    SCREENER = 'Screener'
+    WATCHLIST = 'Watchlist'
     MAIN_PAGE = 'Main Page'
 
     def __str__(self):
@@ -259,6 +464,8 @@ class MenuChoices(str, Enum):
         return {
             self.MAIN_PAGE: MainPage,
             self.STOCKS_VIEWER: StocksViewerPage,
+            self.SCREENER: ScreenerPage,
+            self.WATCHLIST: WatchlistPage,
         }[self]
 
 
@@ -0,0 +1,170 @@
+import asyncio
+import datetime as dt
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Optional
+
+import plotly.graph_objects as go
+import plotly.io as pio
+
+from . import graphs, metrics, models, rollups
+from .candles import get_data_version, load_candles_df
+from .config import settings
+from .schema import Timeframe
+from .tinkoff import TinkoffClient
+from .utils import process_pool, reset_process_pool
+
+logger = logging.getLogger(__name__)
+
+STAGE = 'prewarm_dashboard'
+
+# Default view of `StocksViewerPage`
+DEFAULT_START_DATE = dt.date(2021, 1, 1)
+DEFAULT_SR_SIGNIFICANCE_THRESHOLD = 0.25
+DEFAULT_SR_TIMEFRAMES = (Timeframe.D1, )
+
+
+def view_key(*params: Any) -> str:
+    """Cache key of dashboard view. Data version should be a part of params, so new sync invalidates the cache
+    """
+    return hashlib.sha1(json.dumps([str(param) for param in params]).encode()).hexdigest()
+
+
+def _figure_path(key: str) -> Path:
+    return Path(settings.DASHBOARD_CACHE_DIR) / 'figures' / f'{key}.json'
+
+
+def load_figure(key: str) -> Optional[go.Figure]:
+    path = _figure_path(key)
+    if not path.exists():
+        return None
+
+    return pio.from_json(path.read_text())
+
+
+# Time of the last prune made by `save_figure` in this process
+_pruned_at = 0.0
+
+
+def save_figure(key: str, figure_json: str) -> None:
+    """Write figure atomically, so replicas reading the shared directory never see partial files
+
+    Stale figures are pruned at most once per `DASHBOARD_CACHE_PRUNE_INTERVAL`, so the directory stays bounded
+    without the prewarm stage as well.
+    """
+    global _pruned_at
+
+    path = _figure_path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+    tmp_path.write_text(figure_json)
+    os.replace(tmp_path, path)
+
+    if time.time() - _pruned_at >= settings.DASHBOARD_CACHE_PRUNE_INTERVAL:
+        _pruned_at = time.time()
+        prune_figures(dt.timedelta(days=settings.DASHBOARD_CACHE_MAX_AGE), settings.DASHBOARD_CACHE_MAX_SIZE * 2 ** 20)
+
+
+def prune_figures(max_age: dt.timedelta, max_bytes: Optional[int] = None) -> int:
+    """Remove figures older than `max_age`, then the oldest ones above `max_bytes`. Returns number of removed files
+    """
+    directory = _figure_path('').parent
+    if not directory.exists():
+        return 0
+
+    files = []
+    for path in directory.iterdir():
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue  # removed by another replica
+        files.append((stat.st_mtime, stat.st_size, path))
+
+    files.sort(key=lambda file: file[0])
+    deadline = time.time() - max_age.total_seconds()
+    total_size = sum(size for _, size, _ in files)
+
+    removed = 0
+    for mtime, size, path in files:
+        if mtime >= deadline and (max_bytes is None or total_size <= max_bytes):
+            break
+
+        path.unlink(missing_ok=True)
+        total_size -= size
+        removed += 1
+
+    return removed
+
+
+async def _prewarm_ticker(
+    pool: ProcessPoolExecutor, semaphore: asyncio.Semaphore, ticker: str, timeframe: Timeframe
+) -> None:
+    today = dt.date.today()
+
+    async with semaphore:
+        # Same version as `StocksViewerPage.show` gets for the view
+        data_version = await get_data_version([ticker], [timeframe, *DEFAULT_SR_TIMEFRAMES])
+        candles = await load_candles_df(ticker, DEFAULT_START_DATE, today, timeframe)
+        if candles.empty:
+            return
+
+        sr_candles = candles if timeframe == Timeframe.D1 else await load_candles_df(
+            ticker, DEFAULT_START_DATE, today, Timeframe.D1
+        )
+        sr_timeframes = ','.join(DEFAULT_SR_TIMEFRAMES)
+        views = [
+            # Same arguments as `StocksViewerPage.get_candles_graph` gets with default sidebar values
+            ((ticker, DEFAULT_START_DATE, today, timeframe, None, None, None, False, sr_timeframes), None, None),
+            (
+                (ticker, DEFAULT_START_DATE, today, timeframe, DEFAULT_START_DATE, today,
+                 DEFAULT_SR_SIGNIFICANCE_THRESHOLD, False, sr_timeframes),
+                sr_candles,
+                DEFAULT_SR_SIGNIFICANCE_THRESHOLD,
+            ),
+        ]
+
+        loop = asyncio.get_running_loop()
+        for params, view_sr_candles, threshold in views:
+            figure_json = await loop.run_in_executor(
+                pool, graphs.build_candles_graph_json, ticker, candles, view_sr_candles, threshold
+            )
+            save_figure(view_key(*params, data_version), figure_json)
+
+    metrics.sync_rows_total.inc(len(views), stage=STAGE)
+
+
+async def prewarm_dashboard(client: TinkoffClient) -> None:
+    """Sync stage: build default views of stocks viewer for all active tickers and store them in the shared cache
+    """
+    tickers = await (
+        models.Instrument
+        .filter(delisted_at__isnull=True, deleted_at__isnull=True)
+        .order_by('ticker')
+        .values_list('ticker', flat=True)
+    )
+    timeframe = rollups.pick_timeframe(DEFAULT_START_DATE, dt.date.today())
+
+    # Every ticker builds its graphs one by one, so this is also the number of busy workers of the shared pool
+    processes = settings.DASHBOARD_PREWARM_PROCESSES or os.cpu_count() or 1
+    semaphore = asyncio.Semaphore(processes)
+
+    pool = process_pool()
+    try:
+        await asyncio.gather(*(
+            _prewarm_ticker(pool, semaphore, ticker, timeframe) for ticker in tickers
+        ))
+    except BrokenProcessPool:
+        reset_process_pool(pool)
+        raise
+
+    removed = prune_figures(
+        dt.timedelta(days=settings.DASHBOARD_CACHE_MAX_AGE), settings.DASHBOARD_CACHE_MAX_SIZE * 2 ** 20
+    )
+    logger.info('Dashboard cache prewarmed for %s tickers, removed %s stale figures', len(tickers), removed)
@@ -0,0 +1,280 @@
+import datetime as dt
+import logging
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from . import models
+from .candles import date_range_to_dt
+from .config import settings
+from .schema import Timeframe
+
+if TYPE_CHECKING:  # pragma: no cover
+    import numpy as np
+    import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50_000
+
+# Read by binary COPY (see `models.db_query_batches`): instruments and timeframes are returned as 1-based positions
+# in the arrays of parameters, so all columns are fixed-width. Rows come ordered by partition key,
+# so every partition is written by a single writer, one at a time
+EXPORT_SQL = '''
+    SELECT array_position($2::text[], candle.instrument_id::text)::int4,
+           array_position($3::text[], candle.timeframe::text)::int4,
+           extract(year FROM candle.time AT TIME ZONE $1)::int4,
+           candle.time::timestamptz,
+           candle.open::float8, candle.high::float8, candle.low::float8, candle.close::float8, candle.volume::int8
+    FROM candle
+    WHERE candle.instrument_id = ANY($2::text[]) AND candle.timeframe = ANY($3::text[])
+        AND ($4::timestamptz IS NULL OR candle.time >= $4)
+        AND ($5::timestamptz IS NULL OR candle.time <= $5)
+    ORDER BY candle.instrument_id, candle.timeframe, candle.time
+'''
+EXPORT_COLUMNS = {
+    'figi_idx': 'int4',
+    'timeframe_idx': 'int4',
+    'year': 'int4',
+    'time': 'timestamptz',
+    'open': 'float8',
+    'high': 'float8',
+    'low': 'float8',
+    'close': 'float8',
+    'volume': 'int8',
+}
+
+PartitionKey = Tuple[str, str, int]
+
+
+def _import_pyarrow() -> Any:
+    # `pyarrow` is an optional dependency, used only for research exports
+    try:
+        import pyarrow
+        import pyarrow.compute  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError as e:  # pragma: no cover
+        raise RuntimeError('`pyarrow` is required for candles export, install `export` extra') from e
+
+    return pyarrow
+
+
+def candles_schema() -> 'pa.Schema':
+    pa = _import_pyarrow()
+    return pa.schema([
+        ('ticker', pa.string()),
+        ('time', pa.timestamp('us', tz='UTC')),
+        ('open', pa.float64()),
+        ('high', pa.float64()),
+        ('low', pa.float64()),
+        ('close', pa.float64()),
+        ('volume', pa.int64()),
+    ])
+
+
+def partition_path(root: Path, key: PartitionKey) -> Path:
+    figi, timeframe, year = key
+    return root / f'timeframe={timeframe}' / f'figi={figi}' / f'year={year}' / 'candles.parquet'
+
+
+class _PartitionWriter:
+    """Writes record batches to the Parquet file of current partition, switching files on partition change.
+
+    Exported range replaces the same range of an existing partition file: its candles before and after the range
+    are kept, so partial exports (e.g. monthly ones) accumulate in the yearly file. The file is written
+    under a temporary name (ignored by dataset readers) and replaces the old one when the partition is finished.
+    """
+
+    def __init__(self, root: Path, start_dt: Optional[dt.datetime] = None, end_dt: Optional[dt.datetime] = None):
+        self.pa = _import_pyarrow()
+        self.schema = candles_schema()
+        self.root = root
+
+        time_type = self.schema.field('time').type
+        self._start = self.pa.scalar(start_dt, type=time_type) if start_dt else None
+        self._end = self.pa.scalar(end_dt, type=time_type) if end_dt else None
+
+        self.partitions = 0
+        self._key: Optional[PartitionKey] = None
+        self._writer: Any = None
+        self._path: Optional[Path] = None
+        self._tail: Optional['pa.Table'] = None
+
+    def _tmp_path(self) -> Path:
+        assert self._path is not None
+        return self._path.with_name(f'.{self._path.name}.tmp')
+
+    def _open(self, key: PartitionKey) -> None:
+        self._key = key
+        self._path = partition_path(self.root, key)
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._writer = self.pa.parquet.ParquetWriter(self._tmp_path(), self.schema)
+        self.partitions += 1
+
+        if not self._path.exists():
+            return
+
+        existing = self.pa.parquet.read_table(self._path, schema=self.schema)
+        compute = self.pa.compute
+        if self._start is not None:
+            self._writer.write_table(existing.filter(compute.less(existing['time'], self._start)))
+        if self._end is not None:
+            self._tail = existing.filter(compute.greater(existing['time'], self._end))
+
+    def write(self, key: PartitionKey, ticker: str, columns: Dict[str, 'np.ndarray']) -> None:
+        if key != self._key:
+            self.close()
+            self._open(key)
+
+        size = len(columns['time'])
+        arrays = [self.pa.repeat(ticker, size)] + [
+            self.pa.array(columns[field.name], type=field.type) for field in list(self.schema)[1:]
+        ]
+        self._writer.write_batch(self.pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+
+    def close(self) -> None:
+        if self._writer is None:
+            return
+
+        assert self._path is not None
+
+        if self._tail is not None:
+            self._writer.write_table(self._tail)
+        self._writer.close()
+        os.replace(self._tmp_path(), self._path)
+
+        self._writer = self._path = self._tail = None
+
+    def abort(self) -> None:
+        """Drop current unfinished partition, keeping its previous file
+        """
+        if self._writer is None:
+            return
+
+        self._writer.close()
+        self._tmp_path().unlink(missing_ok=True)
+        self._writer = self._path = self._tail = None
+
+
+def _split_partitions(batch: Dict[str, 'np.ndarray']) -> Iterator[Tuple[int, int, int, int, int]]:
+    """Ranges of batch rows with the same partition key: (figi index, timeframe index, year, start, stop)
+    """
+    import numpy as np
+
+    keys = np.stack([batch['figi_idx'], batch['timeframe_idx'], batch['year']])
+    bounds = (np.flatnonzero((np.diff(keys, axis=1) != 0).any(axis=0)) + 1).tolist()
+
+    for start, stop in zip([0] + bounds, bounds + [keys.shape[1]]):
+        figi_idx, timeframe_idx, year = keys[:, start].tolist()
+        yield figi_idx, timeframe_idx, year, start, stop
+
+
+async def export_candles(
+    root: Path,
+    tickers: Optional[List[str]] = None,
+    timeframes: Optional[List[Timeframe]] = None,
+    start_date: Optional[dt.date] = None,
+    end_date: Optional[dt.date] = None,
+    batch_size: int = BATCH_SIZE,
+) -> int:
+    """Stream stored candles from Postgres into partitioned Parquet dataset. Returns number of exported rows
+
+    Dataset layout: `{root}/timeframe={timeframe}/figi={figi}/year={year}/candles.parquet`.
+    Rows are read by binary COPY straight into NumPy columns, in batches of `batch_size`, so memory usage
+    doesn't depend on data size. Exporting a date range replaces only this range in existing partitions.
+    """
+    instruments = models.Instrument.all()
+    if tickers:
+        instruments = instruments.filter(ticker__in=tickers)
+    rows = await instruments.values_list('figi', 'ticker')
+    figis = [figi for figi, _ in rows]
+    instrument_tickers = [ticker for _, ticker in rows]
+
+    timeframe_values = [timeframe.value for timeframe in timeframes or Timeframe]
+    start_dt = date_range_to_dt(start_date, start_date)[0] if start_date else None
+    end_dt = date_range_to_dt(end_date, end_date)[1] if end_date else None
+
+    writer = _PartitionWriter(root, start_dt, end_dt)
+
+    def write_batch(batch: Dict[str, 'np.ndarray']) -> None:
+        for figi_idx, timeframe_idx, year, start, stop in _split_partitions(batch):
+            key = (figis[figi_idx - 1], timeframe_values[timeframe_idx - 1], year)
+            columns = {name: values[start:stop] for name, values in batch.items()}
+            writer.write(key, instrument_tickers[figi_idx - 1], columns)
+
+        logger.info('Exported %s candles', len(batch['time']))
+
+    try:
+        exported = await models.db_query_batches(
+            EXPORT_SQL,
+            EXPORT_COLUMNS,
+            write_batch,
+            [settings.TZ_NAME, figis, timeframe_values, start_dt, end_dt],
+            batch_size=batch_size,
+            label='export_candles',
+        )
+    except BaseException:
+        writer.abort()
+        raise
+
+    writer.close()
+
+    logger.info('Export finished: %s candles in %s partitions', exported, writer.partitions)
+    return exported
+
+
+def load_candles(
+    root: Path,
+    timeframe: Timeframe = Timeframe.D1,
+    figis: Optional[List[str]] = None,
+    years: Optional[List[int]] = None,
+) -> pd.DataFrame:
+    """Load exported candles into pandas. Files are memory-mapped and converted with minimum of copies
+    """
+    pa = _import_pyarrow()
+
+    filters: List[Tuple[str, str, Any]] = [('timeframe', '=', timeframe.value)]
+    if figis:
+        filters.append(('figi', 'in', set(figis)))
+    if years:
+        filters.append(('year', 'in', set(years)))
+
+    table = pa.parquet.read_table(root, filters=filters, memory_map=True, partitioning='hive')
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def iter_candle_chunks(
+    root: Path, figi: str, timeframe: Timeframe = Timeframe.D1, chunk_size: int = BATCH_SIZE
+) -> Iterator[pd.DataFrame]:
+    """Read exported candles of the instrument by chunks in time order (e.g. for `StreamingSupportResistanceSearch`)
+    """
+    pa = _import_pyarrow()
+
+    instrument_dir = root / f'timeframe={timeframe.value}' / f'figi={figi}'
+    paths = sorted(instrument_dir.glob('year=*/candles.parquet'), key=lambda path: int(path.parent.name[5:]))
+
+    for path in paths:
+        for batch in pa.parquet.ParquetFile(path, memory_map=True).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+
+
+async def run_export(
+    output: str,
+    tickers: Optional[List[str]] = None,
+    timeframes: Optional[List[str]] = None,
+    start_date: Optional[dt.date] = None,
+    end_date: Optional[dt.date] = None,
+) -> None:
+    await models.init_db()
+    try:
+        await export_candles(
+            Path(output),
+            tickers=tickers,
+            timeframes=[Timeframe(timeframe) for timeframe in timeframes] if timeframes else None,
+            start_date=start_date,
+            end_date=end_date,
+        )
+    finally:
+        await models.close_db()
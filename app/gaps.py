@@ -0,0 +1,120 @@
+import datetime as dt
+import logging
+from typing import List, NamedTuple, Optional, Sequence
+
+from . import jobs, models
+from .config import settings
+from .schema import Timeframe
+from .tinkoff import TinkoffClient
+from .utils import localize_dt
+
+logger = logging.getLogger(__name__)
+
+STAGE = 'fill_day_candle_gaps'
+
+# Trading calendar is built from stored candles: the day is a trading day when at least this share of
+# instruments listed at the moment has a candle for it. This way exchange holidays are excluded as well.
+DEFAULT_MIN_COVERAGE = 0.5
+
+FIND_GAPS_SQL = '''
+    WITH daily AS (
+        SELECT instrument_id, (time AT TIME ZONE $1)::date AS day FROM candle
+        WHERE timeframe = 'day'
+    ),
+    bounds AS (
+        SELECT instrument_id, min(day) AS first_day, max(day) AS last_day FROM daily
+        GROUP BY instrument_id
+    ),
+    listing_events AS (
+        SELECT day, sum(delta) AS delta FROM (
+            SELECT first_day AS day, 1 AS delta FROM bounds
+            UNION ALL
+            SELECT last_day + 1, -1 FROM bounds
+        ) AS events
+        GROUP BY day
+    ),
+    coverage AS (
+        SELECT day, count(*) AS stored FROM daily GROUP BY day
+    ),
+    calendar AS (
+        SELECT day, row_number() OVER (ORDER BY day) AS idx FROM (
+            SELECT day, stored, sum(coalesce(delta, 0)) OVER (ORDER BY day) AS listed
+            FROM coverage FULL JOIN listing_events USING (day)
+        ) AS days
+        WHERE stored >= $2::float8 * listed
+    ),
+    missing AS (
+        SELECT bounds.instrument_id, calendar.day, calendar.idx FROM bounds
+            JOIN calendar ON calendar.day BETWEEN bounds.first_day AND bounds.last_day
+        WHERE NOT EXISTS (
+            SELECT 1 FROM daily WHERE daily.instrument_id = bounds.instrument_id AND daily.day = calendar.day
+        )
+    )
+    SELECT instrument_id, min(day), max(day), count(*) FROM (
+        SELECT *, idx - row_number() OVER (PARTITION BY instrument_id ORDER BY idx) AS island FROM missing
+    ) AS missing_islands
+    GROUP BY instrument_id, island
+    ORDER BY instrument_id, min(day);
+'''
+
+
+class Gap(NamedTuple):
+    figi: str
+    start: dt.date
+    end: dt.date
+    missing_days: int
+
+
+async def find_day_candle_gaps(min_coverage: float = DEFAULT_MIN_COVERAGE) -> List[Gap]:
+    """Find holes in history of day candles for all instruments with a single query
+
+    Consecutive missing trading days are returned as one gap.
+    """
+    rows = await models.db_query(FIND_GAPS_SQL, [settings.TZ_NAME, min_coverage], label='find_day_candle_gaps')
+    return [Gap(*row) for row in rows]
+
+
+def merge_gaps(gaps: Sequence[Gap], max_window: dt.timedelta) -> List[Gap]:
+    """Merge gaps of the same instrument, which can be downloaded by single API request
+    """
+    merged: List[Gap] = []
+    for gap in sorted(gaps):
+        last: Optional[Gap] = merged[-1] if merged else None
+
+        if last and last.figi == gap.figi and gap.end - last.start < max_window:
+            merged[-1] = Gap(gap.figi, last.start, gap.end, last.missing_days + gap.missing_days)
+        else:
+            merged.append(gap)
+
+    return merged
+
+
+async def fill_day_candle_gaps(client: TinkoffClient, min_coverage: float = DEFAULT_MIN_COVERAGE) -> None:
+    """Download only missing windows of day candles.
+
+    Each window is journaled as `SyncJob`, so gaps which API has no data for are not requested again.
+    """
+    logger.info('Searching for gaps in day candles...')
+    gaps = await find_day_candle_gaps(min_coverage)
+
+    # Single API request covers a year of day candles (see `TinkoffClient.CANDLE_REQUEST_BATCH`)
+    windows = merge_gaps(gaps, max_window=dt.timedelta(days=365))
+
+    for window in windows:
+        start_dt = localize_dt(dt.datetime.combine(window.start, dt.time()))
+        end_dt = localize_dt(dt.datetime.combine(window.end + dt.timedelta(days=1), dt.time()))
+
+        await models.SyncJob.get_or_create(
+            instrument_id=window.figi,
+            timeframe=Timeframe.D1,
+            stage=STAGE,
+            start_dt=start_dt,
+            end_dt=end_dt,
+            defaults={'cursor': start_dt},
+        )
+
+    failed_jobs = await jobs.run_jobs(client, stage=STAGE)
+    logger.info(
+        'Found %s gaps (%s missing days), requested %s windows, failed: %s',
+        len(gaps), sum(gap.missing_days for gap in gaps), len(windows), len(failed_jobs),
+    )
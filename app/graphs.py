@@ -1,11 +1,16 @@
+from decimal import Decimal
 from typing import Any, Optional
 
 import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
+from .support_resistance import SupportResistanceSearch
 
-def get_candles_graph(ticker: str, candles: pd.DataFrame, extra_graph: Optional[go.Figure] = None) -> go.Figure:
+
+def get_candles_graph(
+    ticker: str, candles: pd.DataFrame, extra_graph: Optional[go.Figure] = None, height: int = 700
+) -> go.Figure:
     fig = make_subplots(rows=2, cols=1, row_heights=[0.8, 0.15], vertical_spacing=0.05)
 
     fig.add_trace(
@@ -37,7 +42,7 @@ def get_candles_graph(ticker: str, candles: pd.DataFrame, extra_graph: Optional[
     fig.update_layout(
         {'plot_bgcolor': '#ffffff', 'paper_bgcolor': '#ffffff', 'legend_orientation': "h"},
         legend=dict(y=1, x=0),
-        height=700,
+        height=height,
         hovermode='x unified',
         margin=dict(b=20, t=0, l=0, r=40),
         bargap=0.1,
@@ -71,3 +76,58 @@ def draw_line(graph: go.Figure, x0: Any, y0: Any, x1: Any, y1: Any, opacity: flo
 
 def draw_vline(graph: go.Figure, x: Any, width: int = 1, opacity: float = 1) -> None:
     graph.add_vline(x=x, line_color='#7658e0', line_width=width, opacity=opacity)
+
+
+def get_macd_graph(candles: pd.DataFrame) -> go.Bar:
+    ema_long = candles.close.ewm(span=26, adjust=False).mean()
+    ema_short = candles.close.ewm(span=12, adjust=False).mean()
+    macd = ema_short - ema_long
+
+    signal_ema = macd.ewm(span=9, adjust=False).mean()
+    macd_histogram = macd - signal_ema
+
+    return go.Bar(x=candles.time, y=macd_histogram, name='MACD(26,12,9)')
+
+
+def draw_levels(graph: go.Figure, levels: pd.DataFrame, x0: Any, x1: Any) -> None:
+    for _, level in levels.iterrows():
+        draw_line(graph=graph, x0=x0, x1=x1, y0=level['price'], y1=level['price'], opacity=level['significance'])
+
+
+def build_candles_graph(
+    ticker: str,
+    candles: pd.DataFrame,
+    sr_candles: Optional[pd.DataFrame] = None,
+    sr_significance_threshold: Optional[float] = None,
+    macd: bool = False,
+    height: int = 700,
+    sr_levels: Optional[pd.DataFrame] = None,
+) -> go.Figure:
+    """Candles graph with optional MACD and support/resistance levels found on `sr_candles`
+    or found beforehand (`sr_levels`, e.g. confluence of several timeframes)
+    """
+    macd_graph = get_macd_graph(candles) if macd else None
+    graph = get_candles_graph(ticker, candles, macd_graph, height)
+
+    if sr_levels is None and sr_candles is not None and sr_significance_threshold is not None:
+        sr_levels = SupportResistanceSearch(sr_candles).find_levels(Decimal(sr_significance_threshold))
+
+    if sr_levels is not None:
+        draw_levels(graph, sr_levels, x0=min(candles.time), x1=max(candles.time))
+
+    return graph
+
+
+def build_candles_graph_json(
+    ticker: str,
+    candles: pd.DataFrame,
+    sr_candles: Optional[pd.DataFrame] = None,
+    sr_significance_threshold: Optional[float] = None,
+    macd: bool = False,
+    height: int = 700,
+) -> str:
+    """`build_candles_graph` serialized to JSON, to build figures in worker processes and to store them
+    """
+    return build_candles_graph(  # type: ignore
+        ticker, candles, sr_candles, sr_significance_threshold, macd, height
+    ).to_json()
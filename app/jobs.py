@@ -0,0 +1,235 @@
+import asyncio
+import datetime as dt
+import logging
+import os
+import socket
+from typing import Any, Iterable, List, Optional, Sequence
+
+from tortoise import timezone as tz
+from tortoise.transactions import in_transaction
+
+from . import metrics, models
+from .config import settings
+from .schema import Candle, Timeframe
+from .tinkoff import TinkoffAPIError, TinkoffClient
+
+logger = logging.getLogger(__name__)
+
+UNFINISHED_STATUSES = (models.SyncJobStatus.PENDING, models.SyncJobStatus.RUNNING, models.SyncJobStatus.FAILED)
+
+# Failed jobs are retried only when explicitly asked (`sync_manual --retry-failed`) or planned again,
+# otherwise long-running workers would retry them every poll interval
+CLAIMABLE_STATUSES = (models.SyncJobStatus.PENDING, models.SyncJobStatus.RUNNING)
+
+WORKER_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+CLAIM_JOB_SQL = '''
+    UPDATE sync_job SET
+        status = 'running',
+        worker = $1,
+        lease_until = now() + $2::float8 * interval '1 second',
+        attempts = attempts + 1,
+        updated_at = now()
+    WHERE id = (
+        SELECT id FROM sync_job
+        WHERE status = ANY($3::varchar[])
+            AND ($4::varchar IS NULL OR stage = $4::varchar)
+            AND NOT (id = ANY($5::int[]))
+            AND ($6::int IS NULL OR id = $6::int)
+            AND (status <> 'running' OR lease_until IS NULL OR lease_until < now())
+        ORDER BY id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id;
+'''
+
+
+async def plan_job(
+    figi: str, stage: str, start_dt: dt.datetime, end_dt: dt.datetime, timeframe: Timeframe = Timeframe.D1
+) -> models.SyncJob:
+    """Add candles download job to journal. Unfinished job for the same instrument and stage is reused:
+    failed one is queued again, and the period of a job not running now is extended to `end_dt`
+    """
+    job = await models.SyncJob.filter(
+        instrument_id=figi, timeframe=timeframe, stage=stage, status__in=UNFINISHED_STATUSES
+    ).first()
+
+    if job is not None:
+        update_fields = []
+        if job.status == models.SyncJobStatus.FAILED:
+            job.status = models.SyncJobStatus.PENDING
+            update_fields.append('status')
+        if job.status != models.SyncJobStatus.RUNNING and end_dt > job.end_dt:
+            job.end_dt = end_dt  # type: ignore
+            update_fields.append('end_dt')
+
+        if update_fields:
+            await job.save(update_fields=[*update_fields, 'updated_at'])
+
+        return job
+
+    return await models.SyncJob.create(
+        instrument_id=figi,
+        timeframe=timeframe,
+        stage=stage,
+        start_dt=start_dt,
+        end_dt=end_dt,
+        cursor=start_dt,
+    )
+
+
+def _candle_prices(candle: Candle) -> List[Any]:
+    # Same precision as stored in DB
+    return [round(candle.open, 2), round(candle.high, 2), round(candle.low, 2), round(candle.close, 2), candle.volume]
+
+
+async def run_job(client: TinkoffClient, job: models.SyncJob) -> int:
+    """Download candles window by window. Each window is written in one transaction with job progress
+
+    Candles already stored in DB are skipped, so windows may overlap existing data. Stored candles with changed
+    prices (candle of the current day) are replaced, so they get new ids and are picked up by rollups.
+    Job should be claimed by `claim_job` first; its lease is extended with every written window.
+    """
+    figi: str = job.instrument_id  # type: ignore
+    batch_size = TinkoffClient.CANDLE_REQUEST_BATCH[job.timeframe]
+    candles_count = 0
+
+    while job.cursor < job.end_dt:
+        window_end = min(job.cursor + batch_size, job.end_dt)
+        candles = await client.get_candles(
+            figi, timeframe=job.timeframe, start_dt=job.cursor, end_dt=window_end
+        )
+
+        async with in_transaction() as conn:
+            stored_candles = {
+                time: prices
+                for time, *prices in await models.Candle
+                .filter(instrument_id=figi, timeframe=job.timeframe)
+                .filter(time__gte=job.cursor, time__lte=window_end)
+                .using_db(conn)
+                .values_list('time', 'open', 'high', 'low', 'close', 'volume')
+            }
+            changed_times = [
+                candle.time for candle in candles
+                if candle.time in stored_candles and stored_candles[candle.time] != _candle_prices(candle)
+            ]
+            candles = [
+                candle for candle in candles if candle.time not in stored_candles or candle.time in changed_times
+            ]
+
+            if changed_times:
+                await (
+                    models.Candle
+                    .filter(instrument_id=figi, timeframe=job.timeframe, time__in=changed_times)
+                    .using_db(conn)
+                    .delete()
+                )
+
+            with metrics.db_query_seconds.time(query='candle_bulk_create'):
+                await models.Candle.bulk_create(
+                    [
+                        models.Candle(instrument_id=figi, timeframe=job.timeframe, **candle.dict())
+                        for candle in candles
+                    ],
+                    using_db=conn,
+                )
+
+            job.cursor = window_end
+            job.lease_until = tz.now() + dt.timedelta(seconds=settings.SYNC_JOB_LEASE)  # type: ignore
+            if job.cursor >= job.end_dt:
+                job.status = models.SyncJobStatus.DONE
+                job.error = None  # type: ignore
+
+            await job.save(using_db=conn, update_fields=['cursor', 'lease_until', 'status', 'error', 'updated_at'])
+
+        candles_count += len(candles)
+        metrics.sync_rows_total.inc(len(candles), stage=job.stage)
+
+    if job.status != models.SyncJobStatus.DONE:
+        # Empty period (start_dt == end_dt)
+        job.status = models.SyncJobStatus.DONE
+        await job.save(update_fields=['status', 'updated_at'])
+
+    return candles_count
+
+
+async def claim_job(
+    stage: Optional[str] = None,
+    statuses: Iterable[models.SyncJobStatus] = CLAIMABLE_STATUSES,
+    exclude_ids: Sequence[int] = (),
+    job_id: Optional[int] = None,
+) -> Optional[models.SyncJob]:
+    """Take the next job from the queue (or the job `job_id`), skipping rows locked by other workers.
+
+    Running jobs are claimed only when their lease is expired (worker has died).
+    """
+    rows = await models.db_query(
+        CLAIM_JOB_SQL,
+        [WORKER_ID, settings.SYNC_JOB_LEASE, [status.value for status in statuses], stage, list(exclude_ids), job_id],
+        label='claim_sync_job',
+    )
+    if not rows:
+        return None
+
+    return await models.SyncJob.filter(id=rows[0]['id']).prefetch_related('instrument').first()
+
+
+async def prune_jobs(stage: str, finished_before: dt.datetime) -> int:
+    """Remove done jobs of the stage finished before the time, returns number of removed jobs
+    """
+    return await models.SyncJob.filter(
+        stage=stage, status=models.SyncJobStatus.DONE, updated_at__lt=finished_before
+    ).delete()
+
+
+async def wait_for_workers(stage: str) -> None:
+    """Wait until jobs of the stage claimed by other workers are finished (or their leases expire)
+    """
+    while await models.SyncJob.filter(
+        stage=stage, status=models.SyncJobStatus.RUNNING, lease_until__gt=tz.now()
+    ).exists():
+        await asyncio.sleep(settings.SYNC_WORKER_POLL_INTERVAL)
+
+
+async def run_jobs(
+    client: TinkoffClient,
+    stage: Optional[str] = None,
+    statuses: Iterable[models.SyncJobStatus] = CLAIMABLE_STATUSES,
+) -> List[models.SyncJob]:
+    """Run journaled jobs (pending and abandoned by dead workers by default) and return the ones that failed
+
+    Jobs are claimed one by one, so several workers can drain the same queue without double work.
+    When `stage` is specified, also waits for jobs of that stage taken by other workers.
+
+    API errors are saved to journal and processing goes on with the next instrument,
+    any other error interrupts the whole run (job can be resumed later from its cursor).
+    """
+    statuses = list(statuses)
+    processed_ids: List[int] = []
+    failed_jobs = []
+
+    while (job := await claim_job(stage, statuses, processed_ids)) is not None:
+        processed_ids.append(job.id)
+
+        try:
+            candles_count = await run_job(client, job)
+
+        except Exception as exc:
+            job.status = models.SyncJobStatus.FAILED
+            job.error = f'{type(exc).__name__}: {exc}'  # type: ignore
+            await job.save(update_fields=['status', 'error', 'updated_at'])
+
+            if not isinstance(exc, TinkoffAPIError):
+                raise
+
+            logger.error('Job %s failed: %s', job, job.error)
+            failed_jobs.append(job)
+            continue
+
+        logger.info('Uploaded %s candles for %s', candles_count, job.instrument.ticker)  # type: ignore
+
+    if stage is not None:
+        await wait_for_workers(stage)
+
+    return failed_jobs
@@ -0,0 +1,273 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .config import settings
+
+try:
+    from opentelemetry import trace
+except ImportError:  # pragma: no cover
+    trace = None
+
+logger = logging.getLogger(__name__)
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+class Metric:
+    """Base class for in-process metrics, rendered in Prometheus text format
+    """
+    type_name = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+        REGISTRY.register(self)
+
+    def _label_values(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'Metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, values: LabelValues, **extra: str) -> str:
+        pairs = [*zip(self.labelnames, values), *extra.items()]
+        if not pairs:
+            return ''
+
+        escaped = (value.replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return '\n'.join([
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.type_name}',
+            *self.samples(),
+        ])
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._label_values(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: Any) -> float:
+        return self._values.get(self._label_values(labels), 0)
+
+    def total(self) -> float:
+        return sum(self._values.values())
+
+    def samples(self) -> List[str]:
+        return [f'{self.name}{self._format_labels(key)} {value}' for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    type_name = 'gauge'
+
+    def set(self, value: float, **labels: Any) -> None:
+        self._values[self._label_values(labels)] = value
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._label_values(labels)
+        counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        counts[-1] += 1
+        self._sums[key] = self._sums.get(key, 0) + value
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: Any) -> int:
+        counts = self._counts.get(self._label_values(labels))
+        return counts[-1] if counts else 0
+
+    def sum(self, **labels: Any) -> float:
+        return self._sums.get(self._label_values(labels), 0)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, counts in self._counts.items():
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{self._format_labels(key, le=str(bound))} {count}')
+
+            lines.append(f'{self.name}_bucket{self._format_labels(key, le="+Inf")} {counts[-1]}')
+            lines.append(f'{self.name}_sum{self._format_labels(key)} {self._sums[key]}')
+            lines.append(f'{self.name}_count{self._format_labels(key)} {counts[-1]}')
+
+        return lines
+
+
+class Registry:
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f'Metric {metric.name} already registered')
+
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self._metrics.values()) + '\n'
+
+
+REGISTRY = Registry()
+
+
+api_request_seconds = Histogram(
+    'tinkoff_request_seconds', 'Latency of Invest API HTTP requests', ['endpoint']
+)
+api_parse_seconds = Histogram(
+    'tinkoff_parse_seconds', 'Time spent parsing Invest API responses into schema objects', ['endpoint']
+)
+api_requests_total = Counter(
+    'tinkoff_requests_total', 'Invest API HTTP requests by response status', ['endpoint', 'status']
+)
+api_ratelimit_total = Counter(
+    'tinkoff_ratelimit_total', 'Invest API responses with 429 status', ['endpoint']
+)
+api_retries_total = Counter(
+    'tinkoff_retries_total', 'Invest API requests retried after hitting rate limit', ['endpoint']
+)
+api_ratelimit_sleep_seconds = Counter(
+    'tinkoff_ratelimit_sleep_seconds_total', 'Time spent waiting for Invest API rate limit reset'
+)
+api_coalesced_total = Counter(
+    'tinkoff_coalesced_total', 'Invest API requests served by identical request already in flight', ['endpoint']
+)
+api_throttle_seconds = Counter(
+    'tinkoff_throttle_seconds_total', 'Time spent waiting for a slot of client-side request rate limiter'
+)
+
+db_query_seconds = Histogram(
+    'db_query_seconds', 'Duration of database queries', ['query']
+)
+
+sync_stage_seconds = Histogram(
+    'sync_stage_seconds', 'Duration of sync stages', ['stage']
+)
+sync_rows_total = Counter(
+    'sync_rows_written_total', 'Rows written to database by sync stages', ['stage']
+)
+sync_candle_staleness_seconds = Histogram(
+    'sync_candle_staleness_seconds', 'Time since previous refresh of instrument candles by adaptive scheduler',
+    ['timeframe', 'watched'], buckets=(60, 300, 900, 3600, 4 * 3600, 86400, 3 * 86400, 7 * 86400),
+)
+sync_scheduler_queue_size = Gauge(
+    'sync_scheduler_queue_size', 'Instrument timeframes tracked by adaptive sync scheduler'
+)
+sync_stage_rows_per_second = Gauge(
+    'sync_stage_rows_per_second', 'Write throughput of the last sync stage run', ['stage']
+)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[None]:
+    """Trace a block of code as OpenTelemetry span (if tracing enabled and `opentelemetry` installed)
+    """
+    start = time.perf_counter()
+
+    if settings.TRACING_ENABLED and trace is not None:
+        with trace.get_tracer('third-eye').start_as_current_span(name, attributes=attributes):
+            yield
+    else:
+        yield
+
+    logger.debug('Span %s finished in %.3fs', name, time.perf_counter() - start)
+
+
+@contextmanager
+def track_stage(stage: str) -> Iterator[None]:
+    """Measure duration and write throughput of sync stage
+    """
+    rows_before = sync_rows_total.get(stage=stage)
+    start = time.perf_counter()
+
+    try:
+        with span(f'sync.{stage}'):
+            yield
+
+    finally:
+        elapsed = time.perf_counter() - start
+        rows = sync_rows_total.get(stage=stage) - rows_before
+
+        sync_stage_seconds.observe(elapsed, stage=stage)
+        sync_stage_rows_per_second.set(rows / elapsed if elapsed else 0, stage=stage)
+
+
+async def _handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()).strip():
+            pass  # skip headers
+
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            status, body = '200 OK', REGISTRY.render().encode()
+        else:
+            status, body = '404 Not Found', b'Not Found\n'
+
+        writer.write(
+            f'HTTP/1.1 {status}\r\n'
+            'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            'Connection: close\r\n\r\n'.encode() + body
+        )
+        await writer.drain()
+
+    finally:
+        writer.close()
+
+
+async def start_http_server(
+    host: Optional[str] = None, port: Optional[int] = None
+) -> asyncio.AbstractServer:
+    """Serve metrics in Prometheus text format on `http://<host>:<port>/metrics`
+    """
+    host = host or settings.METRICS_HOST
+    port = port or settings.METRICS_PORT
+
+    server = await asyncio.start_server(_handle_http, host, port)
+    logger.info('Serving metrics on http://%s:%s/metrics', host, port)
+
+    return server
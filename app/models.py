@@ -1,11 +1,20 @@
+import math
+import struct
+from contextlib import asynccontextmanager
 from enum import Enum
-from typing import Any, Dict, Sequence
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Union
 
 from tortoise import Tortoise, fields, models
 
+from . import metrics
 from .config import settings
 from .schema import Currency, Timeframe
 
+# NumPy and pandas are imported on the first `db_query_df` call: models are loaded by every command
+if TYPE_CHECKING:  # pragma: no cover
+    import numpy as np
+    import pandas as pd
+
 
 async def init_db() -> None:
     await Tortoise.init(settings.TORTOISE_ORM)
@@ -15,15 +24,281 @@ async def close_db() -> None:
     await Tortoise.close_connections()
 
 
-async def db_query(sql: str) -> Sequence[Dict[Any, Any]]:
+async def db_query(sql: str, values: Optional[List[Any]] = None, label: str = 'raw') -> Sequence[Dict[Any, Any]]:
     conn = Tortoise.get_connection("default")
-    _, result = await conn.execute_query(sql)
+    with metrics.db_query_seconds.time(query=label):
+        _, result = await conn.execute_query(sql, values)
 
     return result
 
 
+# Fixed-width Postgres types supported by `db_query_df` and `db_query_batches`: {type: dtype of binary COPY field}.
+# `db_query_df` also reads `numeric` (as float64), but more slowly
+COPY_DTYPES = {
+    'bool': '?',
+    'int4': '>i4',
+    'int8': '>i8',
+    'float8': '>f8',
+    'date': '>i4',  # days since 2000-01-01
+    'timestamptz': '>i8',  # microseconds since 2000-01-01 UTC
+}
+COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+COPY_TRAILER = b'\xff\xff'  # int16 -1 instead of fields count
+PG_EPOCH = '2000-01-01T00:00:00'
+
+# Signs of binary `numeric`
+NUMERIC_NEG = 0x4000
+NUMERIC_NAN = 0xC000
+NUMERIC_INFINITY = {0xD000: math.inf, 0xF000: -math.inf}
+
+
+def _copy_header_size(data: Union[bytes, bytearray]) -> int:
+    if not data.startswith(COPY_SIGNATURE):
+        raise ValueError('Invalid binary COPY signature')
+
+    # Signature, int32 flags and int32 size of header extension
+    return 19 + int.from_bytes(data[15:19], 'big')
+
+
+def _copy_row_dtype(types: Sequence[str]) -> 'np.dtype':
+    import numpy as np
+
+    fields_spec = [('count', '>i2')]
+    for i, pg_type in enumerate(types):
+        fields_spec += [(f'size{i}', '>i4'), (f'value{i}', COPY_DTYPES[pg_type])]
+
+    return np.dtype(fields_spec)
+
+
+def _convert_copy_values(values: 'np.ndarray', pg_type: str) -> 'np.ndarray':
+    import numpy as np
+
+    values = values.astype(values.dtype.newbyteorder('='))
+
+    epoch = np.datetime64(PG_EPOCH, 'us')
+    if pg_type == 'timestamptz':
+        values = epoch + values.astype('timedelta64[us]')
+    elif pg_type == 'date':
+        values = epoch.astype('datetime64[D]') + values.astype('timedelta64[D]')
+
+    return values
+
+
+def _decode_copy_rows(body: Union[bytes, memoryview], types: Sequence[str]) -> List['np.ndarray']:
+    import numpy as np
+
+    row_dtype = _copy_row_dtype(types)
+    if len(body) % row_dtype.itemsize:
+        raise ValueError('Unexpected size of COPY data: result has NULLs or columns of other types')
+
+    rows = np.frombuffer(body, dtype=row_dtype)
+
+    columns = []
+    for i, pg_type in enumerate(types):
+        if (rows[f'size{i}'] != row_dtype[f'value{i}'].itemsize).any():
+            raise ValueError(f'Column {i} has NULL values')
+
+        columns.append(_convert_copy_values(rows[f'value{i}'], pg_type))
+
+    return columns
+
+
+def decode_numeric(field: bytes) -> float:
+    """Binary `numeric`: int16 number of digits, int16 weight of the first digit, uint16 sign, int16 display scale,
+    then base-10000 digits
+    """
+    ndigits, weight, sign, _ = struct.unpack_from('>hhHh', field)
+    if sign == NUMERIC_NAN:
+        return math.nan
+    if sign in NUMERIC_INFINITY:
+        return NUMERIC_INFINITY[sign]
+
+    value = 0
+    for digit in struct.unpack_from(f'>{ndigits}h', field, 8):
+        value = value * 10000 + digit
+
+    # True division of integers keeps the result correctly rounded
+    exponent = weight - ndigits + 1
+    result = float(value * 10000 ** exponent) if exponent >= 0 else value / 10000 ** -exponent
+
+    return -result if sign == NUMERIC_NEG else result
+
+
+def _decode_copy_fields(body: Union[bytes, memoryview], types: Sequence[str]) -> List['np.ndarray']:
+    """Decode rows with `numeric` fields one by one: fixed-width fields are still converted by columns
+    """
+    import numpy as np
+
+    fields: List[List[Any]] = [[] for _ in types]
+
+    offset = 0
+    while offset < len(body):
+        count, = struct.unpack_from('>h', body, offset)
+        if count != len(types):
+            raise ValueError(f'Unexpected number of fields in COPY row: {count}')
+        offset += 2
+
+        for i, pg_type in enumerate(types):
+            size, = struct.unpack_from('>i', body, offset)
+            if size < 0:
+                raise ValueError(f'Column {i} has NULL values')
+
+            field = bytes(body[offset + 4:offset + 4 + size])
+            fields[i].append(decode_numeric(field) if pg_type == 'numeric' else field)
+            offset += 4 + size
+
+    columns = []
+    for pg_type, values in zip(types, fields):
+        if pg_type == 'numeric':
+            columns.append(np.array(values, dtype='float64'))
+        else:
+            columns.append(_convert_copy_values(np.frombuffer(b''.join(values), COPY_DTYPES[pg_type]), pg_type))
+
+    return columns
+
+
+def decode_binary_copy(data: bytes, types: Sequence[str]) -> List['np.ndarray']:
+    """Decode output of `COPY ... TO STDOUT (FORMAT binary)` into NumPy columns.
+
+    When all fields are fixed-width rows have the same size, so the whole body is viewed
+    as a structured array without touching single rows. `numeric` fields are variable-width,
+    such rows are walked one by one and numbers are converted to float64.
+    """
+    header_size = _copy_header_size(data)
+    if not data.endswith(COPY_TRAILER) or len(data) < header_size + len(COPY_TRAILER):
+        raise ValueError('Binary COPY data is truncated')
+
+    body = memoryview(data)[header_size:len(data) - len(COPY_TRAILER)]
+    if 'numeric' in types:
+        return _decode_copy_fields(body, types)
+
+    return _decode_copy_rows(body, types)
+
+
+async def db_query_batches(
+    sql: str,
+    columns: Dict[str, str],
+    callback: Callable[[Dict[str, 'np.ndarray']], None],
+    values: Optional[List[Any]] = None,
+    batch_size: int = 50_000,
+    label: str = 'raw',
+) -> int:
+    """Run query through binary COPY and pass its rows to `callback` by batches of NumPy columns.
+
+    Requirements to `columns` are the same as in `db_query_df`, except all of them should be fixed-width
+    (see `COPY_DTYPES`). Timestamps are naive UTC `datetime64[us]`.
+    COPY waits for the callback, so memory usage is bounded by `batch_size` rows. Returns number of rows.
+    """
+    types = list(columns.values())
+    batch_bytes = batch_size * _copy_row_dtype(types).itemsize
+
+    buffer = bytearray()
+    header_size: Optional[int] = None
+    rows = 0
+
+    def flush(size: int) -> None:
+        nonlocal rows
+
+        arrays = _decode_copy_rows(bytes(buffer[:size]), types)
+        del buffer[:size]
+
+        rows += len(arrays[0])
+        callback(dict(zip(columns, arrays)))
+
+    async def write(chunk: bytes) -> None:
+        nonlocal header_size
+
+        buffer.extend(chunk)
+        if header_size is None:
+            if len(buffer) < 19 or len(buffer) < _copy_header_size(buffer):
+                return
+
+            header_size = _copy_header_size(buffer)
+            del buffer[:header_size]
+
+        while len(buffer) >= batch_bytes + len(COPY_TRAILER):
+            flush(batch_bytes)
+
+    conn = Tortoise.get_connection("default")
+    with metrics.db_query_seconds.time(query=label):
+        async with conn.acquire_connection() as connection:
+            await connection.copy_from_query(sql, *(values or []), output=write, format='binary')
+
+    if header_size is None or not buffer.endswith(COPY_TRAILER):
+        raise ValueError('Binary COPY data is truncated')
+    if len(buffer) > len(COPY_TRAILER):
+        flush(len(buffer) - len(COPY_TRAILER))
+
+    return rows
+
+
+async def db_query_df(
+    sql: str, columns: Dict[str, str], values: Optional[List[Any]] = None, label: str = 'raw'
+) -> 'pd.DataFrame':
+    """Run query through binary COPY and decode result straight into typed DataFrame columns.
+
+    `columns` maps names of result columns to their Postgres types (see `COPY_DTYPES` and `numeric`),
+    columns should be cast explicitly in the query (e.g. `close::float8`) and should not have NULLs.
+    Timestamps are returned in UTC.
+    """
+    import pandas as pd
+
+    chunks: List[bytes] = []
+
+    async def write(chunk: bytes) -> None:
+        chunks.append(chunk)
+
+    conn = Tortoise.get_connection("default")
+    with metrics.db_query_seconds.time(query=label):
+        async with conn.acquire_connection() as connection:
+            await connection.copy_from_query(sql, *(values or []), output=write, format='binary')
+
+        arrays = decode_binary_copy(b''.join(chunks), list(columns.values()))
+
+    df = pd.DataFrame(dict(zip(columns, arrays)), columns=list(columns))
+    for name, pg_type in columns.items():
+        if pg_type == 'timestamptz':
+            df[name] = df[name].dt.tz_localize('UTC')
+
+    return df
+
+
+@asynccontextmanager
+async def advisory_lock(key: int) -> AsyncIterator[bool]:
+    """Try to take Postgres session-level advisory lock, yields whether the lock was acquired
+    """
+    conn = Tortoise.get_connection("default")
+    async with conn.acquire_connection() as connection:
+        locked = await connection.fetchval('SELECT pg_try_advisory_lock($1);', key)
+        try:
+            yield locked
+
+        finally:
+            if locked:
+                await connection.execute('SELECT pg_advisory_unlock($1);', key)
+
+
+# Lock taken by `pg_try_advisory_lock(bigint)`: high and low halves of the key are in classid and objid
+ADVISORY_LOCK_HELD_SQL = '''
+    SELECT EXISTS (
+        SELECT 1 FROM pg_locks
+        WHERE locktype = 'advisory' AND granted
+            AND database = (SELECT oid FROM pg_database WHERE datname = current_database())
+            AND classid = ($1::bigint >> 32)::oid AND objid = ($1::bigint & 4294967295)::oid AND objsubid = 1
+    ) AS locked;
+'''
+
+
+async def is_advisory_locked(key: int) -> bool:
+    """Whether the lock is held by any session. The lock is not taken by the check, so it never makes
+    a concurrent `advisory_lock` fail
+    """
+    result = await db_query(ADVISORY_LOCK_HELD_SQL, [key], label='is_advisory_locked')
+    return result[0]['locked']  # type: ignore
+
+
 async def db_size() -> str:
-    result = await db_query(f"SELECT pg_database_size('{settings.DB_NAME}')/1024 AS kb_size;")
+    result = await db_query(f"SELECT pg_database_size('{settings.DB_NAME}')/1024 AS kb_size;", label='db_size')
 
     size_mb = result[0].get('kb_size') / 1024  # type: ignore
     return f'{size_mb:.3f} MB'
@@ -67,6 +342,93 @@ class Candle(models.Model):
 
     class Meta:
         unique_together = (('instrument', 'timeframe', 'time'), )
+        indexes = (
+            ('timeframe', 'time'),  # retention and rollups scan a timeframe of all instruments
+            ('instrument', 'timeframe', 'id'),  # data versions of (instrument, timeframe)
+        )
 
     def __str__(self) -> str:
         return f'{self.time}'
+
+
+class SyncRunStatus(str, Enum):
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+class SyncRun(models.Model):
+    id = fields.IntField(pk=True)
+    status = fields.CharEnumField(SyncRunStatus, default=SyncRunStatus.RUNNING)
+
+    started_at = fields.DatetimeField(auto_now_add=True)
+    finished_at = fields.DatetimeField(null=True)
+
+    api_requests = fields.IntField(default=0)
+    rows_written = fields.IntField(default=0)
+
+    # [{"name": ..., "duration": ..., "api_requests": ..., "rows_written": ..., "profile": ...}, ...]
+    stages = fields.JSONField(default=list)
+
+    class Meta:
+        table = 'sync_run'
+
+    def __str__(self) -> str:
+        return f'Sync run #{self.id} ({self.status})'
+
+
+class SyncJobStatus(str, Enum):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+class SyncJob(models.Model):
+    """Journal entry of candles download for single instrument
+
+    `cursor` points to the end of the last window written to DB, so interrupted job can be resumed from it
+    """
+    id = fields.IntField(pk=True)
+    instrument = fields.ForeignKeyField('models.Instrument', related_name='sync_jobs')
+    timeframe = fields.CharEnumField(Timeframe, max_length=6)
+    stage = fields.CharField(max_length=32)
+
+    status = fields.CharEnumField(SyncJobStatus, default=SyncJobStatus.PENDING)
+    start_dt = fields.DatetimeField()
+    end_dt = fields.DatetimeField()
+    cursor = fields.DatetimeField()
+
+    attempts = fields.IntField(default=0)
+    error = fields.TextField(null=True)
+
+    # Worker which has claimed the job and time until its claim is valid
+    worker = fields.CharField(max_length=64, null=True)
+    lease_until = fields.DatetimeField(null=True)
+
+    created_at = fields.DatetimeField(auto_now_add=True)
+    updated_at = fields.DatetimeField(auto_now=True)
+
+    class Meta:
+        table = 'sync_job'
+        indexes = (('status', 'stage'), )  # workers claim jobs by status and stage
+
+    def __str__(self) -> str:
+        return f'{self.stage}[{self.instrument_id}, {self.timeframe}] ({self.status})'  # type: ignore
+
+
+class RollupState(models.Model):
+    """Watermark of incremental candles rollup: source candles up to `last_candle_id` are aggregated into the timeframe
+
+    Ids are assigned on insert, but become visible on commit, so candles up to `pending_candle_id` (the last one
+    seen by the previous run) may still be committed with lower ids. They are scanned again until all transactions
+    running at the previous run (txid below `pending_xmax`) are finished.
+    """
+    timeframe = fields.CharEnumField(Timeframe, max_length=6, pk=True)
+    last_candle_id = fields.IntField(default=0)
+    pending_candle_id = fields.IntField(default=0)
+    pending_xmax = fields.BigIntField(default=0)
+    updated_at = fields.DatetimeField(auto_now=True)
+
+    class Meta:
+        table = 'rollup_state'
@@ -0,0 +1,88 @@
+import logging
+import statistics
+from typing import Dict, List, Optional, Sequence
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# Stage is reported as regression when it takes this times longer than median of previous runs
+REGRESSION_FACTOR = 1.5
+
+
+def _stage_durations(run: models.SyncRun) -> Dict[str, float]:
+    return {stage['name']: stage['duration'] for stage in run.stages}
+
+
+def find_regressions(runs: Sequence[models.SyncRun], factor: float = REGRESSION_FACTOR) -> Dict[str, float]:
+    """Compare the latest run with previous ones and return slowdown ratio for regressed stages
+
+    `runs` are expected to be ordered from newest to oldest.
+    """
+    if len(runs) < 2:
+        return {}
+
+    latest, previous = _stage_durations(runs[0]), [_stage_durations(run) for run in runs[1:]]
+    regressions: Dict[str, float] = {}
+
+    for name, duration in latest.items():
+        history = [durations[name] for durations in previous if name in durations]
+        if not history:
+            continue
+
+        baseline = statistics.median(history)
+        if baseline > 0 and duration / baseline >= factor:
+            regressions[name] = duration / baseline
+
+    return regressions
+
+
+def format_runs_report(runs: Sequence[models.SyncRun]) -> str:
+    """Render table of stage durations (rows) for recent sync runs (columns)
+    """
+    stage_names: List[str] = []
+    for run in runs:
+        stage_names += [stage['name'] for stage in run.stages if stage['name'] not in stage_names]
+
+    regressions = find_regressions(runs)
+    name_width = max([len(name) for name in stage_names] + [len('stage')])
+    col_width = 12
+
+    def row(title: str, cells: Sequence[str], note: Optional[str] = None) -> str:
+        line = title.ljust(name_width) + ''.join(cell.rjust(col_width) for cell in cells)
+        return f'{line}  {note}' if note else line
+
+    lines = [
+        row('run', [f'#{run.id}' for run in runs]),
+        row('started', [run.started_at.strftime('%m-%d %H:%M') for run in runs]),
+        row('status', [str(run.status) for run in runs]),
+        '-' * (name_width + col_width * len(runs)),
+    ]
+
+    durations = [_stage_durations(run) for run in runs]
+    for name in stage_names:
+        cells = [f'{run_durations[name]:.1f}s' if name in run_durations else '-' for run_durations in durations]
+        note = f'<- x{regressions[name]:.1f} slower' if name in regressions else None
+        lines.append(row(name, cells, note))
+
+    lines += [
+        '-' * (name_width + col_width * len(runs)),
+        row('api requests', [str(run.api_requests) for run in runs]),
+        row('rows written', [str(run.rows_written) for run in runs]),
+    ]
+    return '\n'.join(lines)
+
+
+async def show_sync_report(runs_limit: int = 7) -> None:
+    await models.init_db()
+
+    runs = await models.SyncRun.all().order_by('-id').limit(runs_limit)
+    if runs:
+        print(format_runs_report(runs))
+    else:
+        print('No sync runs recorded yet')
+
+    for name, ratio in find_regressions(runs).items():
+        logger.warning('Stage %s is %.1f times slower than usual', name, ratio)
+
+    await models.close_db()
@@ -0,0 +1,85 @@
+import datetime as dt
+import logging
+from typing import Dict
+
+from tortoise import Tortoise
+from tortoise import timezone as tz
+
+from . import metrics, models
+from .config import settings
+from .rollups import refresh_rollup, rollups
+from .schema import Timeframe
+from .tinkoff import TinkoffClient
+
+logger = logging.getLogger(__name__)
+
+STAGE = 'apply_retention'
+
+# Short statements keep locks and WAL bursts small; `id <= $3` protects candles not rolled up yet
+DELETE_EXPIRED_SQL = '''
+    WITH expired AS (
+        SELECT id FROM candle
+        WHERE timeframe = $1 AND time < $2 AND id <= $3
+        LIMIT $4
+    )
+    DELETE FROM candle WHERE id IN (SELECT id FROM expired);
+'''
+
+
+def retention() -> Dict[Timeframe, dt.timedelta]:
+    """Configured retention {timeframe: max age of candles}
+    """
+    return {Timeframe(timeframe): dt.timedelta(days=days) for timeframe, days in settings.CANDLE_RETENTION.items()}
+
+
+async def rolled_up_watermark(timeframe: Timeframe) -> int:
+    """Refresh rollups sourced from `timeframe` and return the last candle id included in all of them
+    """
+    targets = [target for target, source in rollups().items() if source == timeframe]
+    if not targets:
+        # Settings are validated against it, candles would be lost without coarser copy
+        raise ValueError(f'No rollups from {timeframe} configured, its candles cannot be removed')
+
+    for target in targets:
+        await refresh_rollup(target, timeframe)
+
+    states = await models.RollupState.filter(timeframe__in=targets).values_list('last_candle_id', flat=True)
+    return int(min(states))
+
+
+async def delete_expired_candles(timeframe: Timeframe, max_age: dt.timedelta) -> int:
+    """Roll up and remove candles older than `max_age` in batches, returns number of removed rows
+    """
+    watermark = await rolled_up_watermark(timeframe)
+
+    # Expired candles shouldn't be downloaded again: a late source candle would recalculate
+    # its rollup bucket from the remaining candles only
+    expire_before = tz.now() - max_age
+    removed = 0
+
+    conn = Tortoise.get_connection('default')
+    while True:
+        with metrics.db_query_seconds.time(query=f'retention_{timeframe}'):
+            async with conn.acquire_connection() as connection:
+                status = await connection.execute(
+                    DELETE_EXPIRED_SQL, timeframe.value, expire_before, watermark, settings.CANDLE_RETENTION_BATCH
+                )
+
+        # Status is 'DELETE <rows>'
+        batch_removed = int(status.split()[-1])
+        removed += batch_removed
+        if batch_removed < settings.CANDLE_RETENTION_BATCH:
+            return removed
+
+
+async def apply_retention(client: TinkoffClient) -> None:
+    """Sync stage: remove candles that exceeded retention of their timeframe (client is not used)
+
+    Table `candle` isn't partitioned, so candles are removed by batched DELETEs instead of dropping partitions.
+    """
+    for timeframe, max_age in retention().items():
+        removed = await delete_expired_candles(timeframe, max_age)
+        metrics.sync_rows_total.inc(removed, stage=STAGE)
+
+        if removed:
+            logger.info('Retention %s (%s): %s candles removed', timeframe, max_age, removed)
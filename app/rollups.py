@@ -0,0 +1,143 @@
+import datetime as dt
+import logging
+from typing import Dict, List
+
+from tortoise.transactions import in_transaction
+
+from . import metrics, models
+from .config import settings
+from .schema import Timeframe
+from .tinkoff import TinkoffClient
+
+logger = logging.getLogger(__name__)
+
+STAGE = 'refresh_rollups'
+
+TIMEFRAME_DURATION = {
+    Timeframe.M1: dt.timedelta(minutes=1),
+    Timeframe.M5: dt.timedelta(minutes=5),
+    Timeframe.M10: dt.timedelta(minutes=10),
+    Timeframe.M30: dt.timedelta(minutes=30),
+    Timeframe.H1: dt.timedelta(hours=1),
+    Timeframe.D1: dt.timedelta(days=1),
+    Timeframe.D7: dt.timedelta(days=7),
+    Timeframe.D30: dt.timedelta(days=30),
+}
+
+# SQL expression of the bucket start for candle `time`
+BUCKET_SQL = {
+    Timeframe.M5: "to_timestamp(floor(extract(epoch FROM time) / 300) * 300)",
+    Timeframe.M10: "to_timestamp(floor(extract(epoch FROM time) / 600) * 600)",
+    Timeframe.M30: "to_timestamp(floor(extract(epoch FROM time) / 1800) * 1800)",
+    Timeframe.H1: "date_trunc('hour', time)",
+    Timeframe.D7: "date_trunc('week', time AT TIME ZONE '{tz}') AT TIME ZONE '{tz}'",
+    Timeframe.D30: "date_trunc('month', time AT TIME ZONE '{tz}') AT TIME ZONE '{tz}'",
+}
+
+# Only buckets touched by source candles added after the watermark ($2) are recalculated. Ids are assigned on insert
+# but become visible on commit, so candles up to the last one seen by the previous run ($4) are scanned again until
+# transactions running at that run (txid < $5) are finished. Without other running transactions all candles seen
+# now are committed, so the watermark is moved to the last one at once
+ROLLUP_SQL = '''
+    WITH snapshot AS (
+        SELECT txid_current_snapshot() AS current
+    ),
+    changed AS (
+        SELECT instrument_id, min({bucket}) AS from_time, max(id) AS max_id FROM candle
+        WHERE timeframe = $1 AND id > $2::int
+        GROUP BY instrument_id
+    ),
+    upserted AS (
+        INSERT INTO candle (instrument_id, timeframe, time, open, high, low, close, volume)
+        SELECT source.instrument_id, $3, source.bucket,
+               (array_agg(source.open ORDER BY source.time))[1],
+               max(source.high),
+               min(source.low),
+               (array_agg(source.close ORDER BY source.time DESC))[1],
+               sum(source.volume)
+        FROM (
+            SELECT candle.*, {bucket} AS bucket FROM candle
+                JOIN changed USING (instrument_id)
+            WHERE candle.timeframe = $1 AND candle.time >= changed.from_time
+        ) AS source
+        GROUP BY source.instrument_id, source.bucket
+        -- Changed candle gets a new id, as a replaced one in `jobs.run_job`: data versions are max ids
+        ON CONFLICT (instrument_id, timeframe, time) DO UPDATE SET
+            id = DEFAULT,
+            open = EXCLUDED.open,
+            high = EXCLUDED.high,
+            low = EXCLUDED.low,
+            close = EXCLUDED.close,
+            volume = EXCLUDED.volume
+        -- Candles scanned again are not rewritten
+        WHERE (candle.open, candle.high, candle.low, candle.close, candle.volume)
+            IS DISTINCT FROM (EXCLUDED.open, EXCLUDED.high, EXCLUDED.low, EXCLUDED.close, EXCLUDED.volume)
+        RETURNING 1
+    ),
+    seen AS (
+        SELECT greatest($2::int, $4::int, (SELECT max(max_id) FROM changed)) AS id
+    )
+    SELECT
+        (SELECT count(*) FROM upserted),
+        CASE
+            WHEN (SELECT count(*) FROM snapshot, txid_snapshot_xip(current)) = 0 THEN (SELECT id FROM seen)
+            WHEN (SELECT txid_snapshot_xmin(current) FROM snapshot) >= $5::bigint THEN greatest($2::int, $4::int)
+            ELSE $2::int
+        END,
+        (SELECT id FROM seen),
+        (SELECT txid_snapshot_xmax(current) FROM snapshot);
+'''
+
+
+def rollups() -> Dict[Timeframe, Timeframe]:
+    """Configured rollups {target timeframe: source timeframe}
+    """
+    return {Timeframe(target): Timeframe(source) for target, source in settings.CANDLE_ROLLUPS.items()}
+
+
+def stored_timeframes() -> List[Timeframe]:
+    return [Timeframe.D1, *rollups()]
+
+
+async def refresh_rollup(target: Timeframe, source: Timeframe) -> int:
+    """Recalculate candles of `target` timeframe touched by new `source` candles. Returns number of upserted rows
+    """
+    state, _ = await models.RollupState.get_or_create(timeframe=target)
+    sql = ROLLUP_SQL.format(bucket=BUCKET_SQL[target].format(tz=settings.TZ_NAME))
+
+    async with in_transaction() as conn:
+        with metrics.db_query_seconds.time(query=f'rollup_{target}'):
+            _, rows = await conn.execute_query(sql, [
+                source.value, state.last_candle_id, target.value, state.pending_candle_id, state.pending_xmax
+            ])
+
+        upserted, state.last_candle_id, state.pending_candle_id, state.pending_xmax = rows[0]
+        await state.save(using_db=conn)
+
+    return upserted  # type: ignore
+
+
+async def refresh_rollups(client: TinkoffClient) -> None:
+    """Sync stage: incrementally refresh all configured rollups (client is not used)
+    """
+    for target, source in rollups().items():
+        upserted = await refresh_rollup(target, source)
+        metrics.sync_rows_total.inc(upserted, stage=STAGE)
+
+        logger.info('Rollup %s -> %s: %s candles updated', source, target, upserted)
+
+
+def pick_timeframe(
+    start_date: dt.date, end_date: dt.date, base: Timeframe = Timeframe.D1, min_points: int = 0
+) -> Timeframe:
+    """The coarsest stored timeframe (base or rolled up from it) that still gives `min_points` candles for the range
+    """
+    min_points = min_points or settings.DASHBOARD_MIN_POINTS
+    period = end_date - start_date
+    candidates = [base, *(target for target, source in rollups().items() if source == base)]
+
+    for timeframe in sorted(candidates, key=TIMEFRAME_DURATION.__getitem__, reverse=True):
+        if period / TIMEFRAME_DURATION[timeframe] >= min_points:
+            return timeframe
+
+    return base
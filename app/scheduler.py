@@ -0,0 +1,236 @@
+import asyncio
+import datetime as dt
+import heapq
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from tortoise import timezone as tz
+
+from . import jobs, metrics, models
+from .config import settings
+from .retention import retention
+from .schema import Timeframe
+from .tinkoff import TinkoffClient
+from .utils import localize_dt
+
+logger = logging.getLogger(__name__)
+
+STAGE = 'refresh_candles'
+
+# History downloaded for instruments without candles
+INITIAL_START_DT = dt.datetime(2015, 1, 1)
+INITIAL_INTRADAY_PERIOD = dt.timedelta(days=30)
+
+RELOAD_INTERVAL = dt.timedelta(hours=1)
+# Done refresh jobs are kept in the journal for this time
+FINISHED_JOBS_RETENTION = dt.timedelta(days=1)
+
+TargetKey = Tuple[str, Timeframe]
+
+
+def market_sessions(around: dt.datetime) -> Iterator[Tuple[dt.datetime, dt.datetime]]:
+    """Trading sessions (open, close) of the week before and after `around`, Mon-Fri sessions only
+    """
+    for days in range(-7, 8):
+        day = around.astimezone(settings.TIMEZONE).date() + dt.timedelta(days=days)
+        if day.weekday() >= 5:
+            continue
+
+        open_dt = localize_dt(dt.datetime.combine(day, settings.SYNC_MARKET_OPEN))
+        close_dt = localize_dt(dt.datetime.combine(day, settings.SYNC_MARKET_CLOSE))
+        if close_dt <= open_dt:
+            close_dt += dt.timedelta(days=1)
+
+        yield open_dt, close_dt
+
+
+def is_market_open(now: dt.datetime) -> bool:
+    return any(open_dt <= now < close_dt for open_dt, close_dt in market_sessions(now))
+
+
+def last_market_close(now: dt.datetime) -> dt.datetime:
+    return max(close_dt for _, close_dt in market_sessions(now) if close_dt <= now)
+
+
+def next_market_close(now: dt.datetime) -> dt.datetime:
+    return min(close_dt for _, close_dt in market_sessions(now) if close_dt > now)
+
+
+class RefreshTarget:
+
+    def __init__(self, figi: str, ticker: str, timeframe: Timeframe, last_candle_time: Optional[dt.datetime]):
+        self.figi = figi
+        self.ticker = ticker
+        self.timeframe = timeframe
+        self.last_candle_time = last_candle_time
+        self.refreshed_at: Optional[dt.datetime] = None
+
+    @property
+    def key(self) -> TargetKey:
+        return self.figi, self.timeframe
+
+    @property
+    def watched(self) -> bool:
+        return self.ticker in settings.SYNC_WATCHLIST
+
+    def next_refresh(self, now: dt.datetime) -> dt.datetime:
+        """Watchlist is refreshed every `SYNC_WATCHLIST_INTERVAL` during market hours,
+        every instrument is refreshed once after the market close
+        """
+        if self.refreshed_at is None or self.refreshed_at < last_market_close(now):
+            return now
+
+        if self.watched and is_market_open(now):
+            return self.refreshed_at + dt.timedelta(seconds=settings.SYNC_WATCHLIST_INTERVAL)
+
+        return next_market_close(now)
+
+    def start_dt(self, now: dt.datetime) -> dt.datetime:
+        if self.last_candle_time is not None:
+            return self.last_candle_time
+
+        if self.timeframe == Timeframe.D1:
+            return localize_dt(INITIAL_START_DT)
+
+        return now - retention().get(self.timeframe, INITIAL_INTRADAY_PERIOD)
+
+
+class AdaptiveScheduler:
+    """Refresh candles of every (instrument, timeframe) when they get stale, the stalest and watched ones first
+
+    Targets are kept in a heap ordered by (next refresh time, not watched, previous refresh time);
+    requests are spread evenly over the day by the client rate limiter.
+    """
+
+    def __init__(self, client: TinkoffClient):
+        self.client = client
+
+        self._targets: Dict[TargetKey, RefreshTarget] = {}
+        self._queue: List[Tuple[dt.datetime, bool, dt.datetime, TargetKey]] = []
+        self._reloaded_at: Optional[dt.datetime] = None
+
+    def _push(self, target: RefreshTarget, now: dt.datetime) -> None:
+        heapq.heappush(self._queue, (
+            target.next_refresh(now),
+            not target.watched,
+            target.refreshed_at or dt.datetime.min.replace(tzinfo=dt.timezone.utc),
+            target.key,
+        ))
+
+    async def reload(self) -> None:
+        """Sync targets with active instruments: new ones are added, delisted and deleted are dropped
+        """
+        now = tz.now()
+        instruments = dict(
+            await models.Instrument
+            .filter(type=models.InstrumentType.STOCK, delisted_at__isnull=True, deleted_at__isnull=True)
+            .values_list('figi', 'ticker')
+        )
+        last_candle_times = {
+            (figi, Timeframe(timeframe)): last_time
+            for figi, timeframe, last_time in await models.db_query(
+                'SELECT instrument_id, timeframe, max(time) FROM candle GROUP BY instrument_id, timeframe;',
+                label='last_candle_times',
+            )
+        }
+
+        keys = {
+            (figi, Timeframe(timeframe)) for figi in instruments for timeframe in settings.SYNC_SCHEDULER_TIMEFRAMES
+        }
+        for key in keys - set(self._targets):
+            figi, timeframe = key
+            self._targets[key] = RefreshTarget(figi, instruments[figi], timeframe, last_candle_times.get(key))
+            self._push(self._targets[key], now)
+
+        # Dropped targets are skipped when popped from the queue
+        for key in set(self._targets) - keys:
+            del self._targets[key]
+
+        # Every refresh adds a job, so the journal would grow by thousands of rows per day
+        pruned = await jobs.prune_jobs(STAGE, now - FINISHED_JOBS_RETENTION)
+        logger.debug('Pruned %s finished refresh jobs', pruned)
+
+        self._reloaded_at = now
+        metrics.sync_scheduler_queue_size.set(len(self._targets))
+
+    async def refresh(self, target: RefreshTarget) -> None:
+        now = tz.now()
+        if target.refreshed_at is not None:
+            metrics.sync_candle_staleness_seconds.observe(
+                (now - target.refreshed_at).total_seconds(), timeframe=target.timeframe, watched=target.watched
+            )
+
+        planned_job = await jobs.plan_job(target.figi, STAGE, target.start_dt(now), now, target.timeframe)
+        job = await jobs.claim_job(STAGE, job_id=planned_job.id)
+        if job is None:
+            # Another worker is running the job, its candles are picked up by the next refresh
+            logger.info('Refresh of %s %s is already running', target.ticker, target.timeframe)
+            target.refreshed_at = now
+            return
+
+        try:
+            await jobs.run_job(self.client, job)
+
+        except Exception as exc:
+            job.status = models.SyncJobStatus.FAILED
+            job.error = f'{type(exc).__name__}: {exc}'  # type: ignore
+            await job.save(update_fields=['status', 'error', 'updated_at'])
+            logger.error('Refresh of %s %s failed: %s', target.ticker, target.timeframe, job.error)
+
+        else:
+            # The last candle may be incomplete, so the next refresh starts from it
+            last_candle_times = await (
+                models.Candle
+                .filter(instrument_id=target.figi, timeframe=target.timeframe)
+                .order_by('-time')
+                .limit(1)
+                .values_list('time', flat=True)
+            )
+            if last_candle_times:
+                target.last_candle_time = last_candle_times[0]
+
+        target.refreshed_at = now
+
+    async def _refresh_and_requeue(self, target: RefreshTarget, now: dt.datetime) -> None:
+        try:
+            await self.refresh(target)
+        except Exception:
+            # E.g. DB is unavailable: the target is retried by schedule, as after a failed job
+            logger.exception('Refresh of %s %s failed', target.ticker, target.timeframe)
+            target.refreshed_at = now
+
+        self._push(target, tz.now())
+
+    async def run(self, stop_event: asyncio.Event) -> None:
+        while not stop_event.is_set():
+            now = tz.now()
+            if self._reloaded_at is None or now - self._reloaded_at >= RELOAD_INTERVAL:
+                await self.reload()
+
+            if not self._queue:
+                await _wait(stop_event, RELOAD_INTERVAL)
+                continue
+
+            refresh_at, *_, key = self._queue[0]
+            if refresh_at > now:
+                await _wait(stop_event, min(refresh_at - now, RELOAD_INTERVAL))
+                continue
+
+            heapq.heappop(self._queue)
+            target = self._targets.get(key)
+            if target is None:
+                continue
+
+            # Market state might have changed since the target was queued
+            if target.next_refresh(now) > now:
+                self._push(target, now)
+                continue
+
+            await self._refresh_and_requeue(target, now)
+
+
+async def _wait(stop_event: asyncio.Event, timeout: dt.timedelta) -> None:
+    try:
+        await asyncio.wait_for(stop_event.wait(), timeout.total_seconds())
+    except asyncio.TimeoutError:
+        pass
@@ -0,0 +1,297 @@
+import datetime as dt
+import math
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from . import models
+from .config import settings
+from .utils import localize_dt
+
+# Read by binary COPY (see `models.db_query_df`), so no trailing semicolon
+PANEL_SQL = '''
+    SELECT array_position($1::text[], candle.instrument_id::text)::int4, (candle.time AT TIME ZONE $4)::date,
+           candle.high::float8, candle.low::float8, candle.close::float8
+    FROM candle
+    WHERE candle.instrument_id = ANY($1::text[]) AND candle.timeframe = 'day'
+        AND candle.time >= $2 AND candle.time <= $3
+'''
+# Same as default of `SupportResistanceSearch`: shorter panels have no levels
+MIN_SIZE_OF_BATCH = 5
+
+PANEL_COLUMNS = {'figi_idx': 'int4', 'date': 'date', 'high': 'float8', 'low': 'float8', 'close': 'float8'}
+
+
+class PricePanel(NamedTuple):
+    """Daily prices of many instruments aligned by date: arrays have shape (instruments, dates)
+
+    Missing candles are NaN.
+    """
+    figis: np.ndarray
+    tickers: np.ndarray
+    names: np.ndarray
+    dates: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+
+
+class LevelCandidates(NamedTuple):
+    """Price extremes of candle batches (as in `SupportResistanceSearch._find_levels`), shape (instruments, levels)
+    """
+    prices: np.ndarray
+    weights: np.ndarray
+
+
+async def load_price_panel(start_date: dt.date, end_date: dt.date) -> PricePanel:
+    """Load day candles of all active stocks by single binary COPY query and pack them into 2D arrays
+    """
+    instruments = await (
+        models.Instrument
+        .filter(type=models.InstrumentType.STOCK, delisted_at__isnull=True, deleted_at__isnull=True)
+        .values_list('figi', 'ticker', 'name')
+    )
+    instrument_figis = [figi for figi, _, _ in instruments]
+
+    rows = await models.db_query_df(
+        PANEL_SQL,
+        PANEL_COLUMNS,
+        [
+            instrument_figis,
+            localize_dt(dt.datetime.combine(start_date, dt.time())),
+            localize_dt(dt.datetime.combine(end_date, dt.time(23, 59))),
+            settings.TZ_NAME,
+        ],
+        label='load_price_panel',
+    )
+    if rows.empty:
+        empty = np.empty((0, 0))
+        return PricePanel(np.array([]), np.array([]), np.array([]), np.array([], 'datetime64[D]'), empty, empty, empty)
+
+    # Positions in `instruments` are 1-based
+    instrument_idx, figi_idx = np.unique(rows.figi_idx.to_numpy() - 1, return_inverse=True)
+    dates, date_idx = np.unique(rows.date.to_numpy(dtype='datetime64[D]'), return_inverse=True)
+
+    prices = np.full((3, len(instrument_idx), len(dates)), np.nan)
+    prices[:, figi_idx, date_idx] = rows[['high', 'low', 'close']].to_numpy().T
+
+    return PricePanel(
+        figis=np.array([instruments[i][0] for i in instrument_idx]),
+        tickers=np.array([instruments[i][1] for i in instrument_idx]),
+        names=np.array([instruments[i][2] for i in instrument_idx]),
+        dates=dates,
+        high=prices[0],
+        low=prices[1],
+        close=prices[2],
+    )
+
+
+def ffill(values: np.ndarray) -> np.ndarray:
+    """Forward fill NaN values along dates axis
+    """
+    idx = np.where(np.isnan(values), 0, np.arange(values.shape[1]))
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    return values[np.arange(values.shape[0])[:, None], idx]
+
+
+def ema(values: np.ndarray, span: int) -> np.ndarray:
+    """Exponential moving average along dates axis, same as `pd.Series.ewm(span, adjust=False).mean()`
+    """
+    alpha = 2 / (span + 1)
+    result = np.empty_like(values)
+    prev = values[:, 0]
+    result[:, 0] = prev
+
+    for i in range(1, values.shape[1]):
+        prev = np.where(np.isnan(prev), values[:, i], alpha * values[:, i] + (1 - alpha) * prev)
+        result[:, i] = prev
+
+    return result
+
+
+def macd_histogram(close: np.ndarray, long: int = 26, short: int = 12, signal: int = 9) -> np.ndarray:
+    macd = ema(close, short) - ema(close, long)
+    return macd - ema(macd, signal)  # type: ignore
+
+
+def find_level_candidates(
+    high: np.ndarray,
+    low: np.ndarray,
+    dates: np.ndarray,
+    min_size_of_batch: int = MIN_SIZE_OF_BATCH,
+    recent_level_rate: int = 16,
+    max_batch_iterations: int = 50,
+) -> LevelCandidates:
+    """Find batch extremes for all rows of (instruments, dates) arrays at once.
+
+    Dates axis is shared by all rows, so the batches are the same for every row
+    and each batch is handled with a single vectorized argmax/argmin.
+    Unlike `SupportResistanceSearch`, number of splits is capped by `max_batch_iterations`.
+
+    The same candle is the extreme of many batches: such candidates are merged and their weights summed,
+    which gives the same zone weights, but a few times fewer candidates. Panels shorter than
+    `min_size_of_batch` have no candidates.
+    """
+    num_of_dates = len(dates)
+    if num_of_dates < min_size_of_batch:
+        empty = np.empty((high.shape[0], 0))
+        return LevelCandidates(empty, empty)
+
+    high = np.where(np.isnan(high), -np.inf, high)
+    low = np.where(np.isnan(low), np.inf, low)
+    rows = np.arange(high.shape[0])
+
+    max_delta = max(int((dates[-1] - dates[0]) / np.timedelta64(1, 'D')), 1)
+    time_weights = (dates - dates[0]) / np.timedelta64(1, 'D') * recent_level_rate / max_delta
+
+    # Summed weights of every candle as high and low extreme, shape (2, instruments, dates)
+    extreme_weights = np.zeros((2, *high.shape))
+
+    batch_iterations = min(num_of_dates // min_size_of_batch, max_batch_iterations)
+    for num_of_batches in range(1, batch_iterations + 1):
+        batch_size = math.ceil(num_of_dates / num_of_batches)
+
+        for start in range(0, num_of_dates, batch_size):
+            stop = min(start + batch_size, num_of_dates)
+
+            for weights, extremes, arg_func in zip(extreme_weights, (high, low), (np.argmax, np.argmin)):
+                idx = arg_func(extremes[:, start:stop], axis=1) + start
+                valid = np.isfinite(extremes[rows, idx])
+                weights[rows, idx] += np.where(valid, (stop - start) + time_weights[idx], 0)
+
+    prices = np.concatenate([high, low], axis=1)
+    weights = np.concatenate(extreme_weights, axis=1)
+
+    # Candidates of every row are moved to its start, the rest is padded by NaN prices with zero weights
+    found = weights > 0
+    order = np.argsort(~found, axis=1, kind='stable')[:, :found.sum(axis=1).max(initial=0)]
+    found = np.take_along_axis(found, order, axis=1)
+
+    return LevelCandidates(
+        np.where(found, np.take_along_axis(prices, order, axis=1), np.nan),
+        np.where(found, np.take_along_axis(weights, order, axis=1), 0),
+    )
+
+
+def zone_weights(candidates: LevelCandidates, queries: np.ndarray, price_error: np.ndarray) -> np.ndarray:
+    """Sum of weights of candidates closer than `price_error` to each query price, per instrument.
+
+    This approximates the greedy merge of `SupportResistanceSearch._update_price_levels`, where a candidate
+    is added to the first earlier level within `price_error`: here every candidate is scored by its whole
+    ±`price_error` neighbourhood, so zones don't depend on the order of batches and can overlap.
+
+    `queries` has shape (instruments, queries), `price_error` - (instruments, ).
+
+    All rows are shifted to non-overlapping price bands and flattened, so the lookup for every query
+    of every instrument is done by a single `np.searchsorted` call.
+    """
+    num_of_rows, num_of_candidates = candidates.prices.shape
+    valid = ~np.isnan(candidates.prices)
+
+    finite_prices = np.concatenate([candidates.prices[valid], queries[~np.isnan(queries)]])
+    if not len(finite_prices):
+        return np.zeros_like(queries)
+
+    lowest = finite_prices.min()
+    max_error = price_error.max(initial=0)
+    band = finite_prices.max() - lowest + 4 * max_error + 1
+    offsets = (np.arange(num_of_rows) * band)[:, None]
+
+    prices = np.where(valid, candidates.prices, lowest) - lowest + offsets
+    order = np.argsort(prices, axis=1)
+    sorted_prices = np.take_along_axis(prices, order, axis=1).ravel()
+    sorted_weights = np.take_along_axis(np.where(valid, candidates.weights, 0), order, axis=1)
+    cum_weights = np.concatenate([np.zeros((num_of_rows, 1)), np.cumsum(sorted_weights, axis=1)], axis=1)
+
+    shifted_queries = queries - lowest + offsets
+    row_starts = (np.arange(num_of_rows) * num_of_candidates)[:, None]
+
+    def lookup(values: np.ndarray, side: str) -> np.ndarray:
+        idx = np.searchsorted(sorted_prices, values.ravel(), side=side).reshape(values.shape)  # type: ignore
+        return np.clip(idx - row_starts, 0, num_of_candidates)  # type: ignore
+
+    left = lookup(shifted_queries - price_error[:, None], 'right')
+    right = lookup(shifted_queries + price_error[:, None], 'left')
+
+    rows = np.arange(num_of_rows)[:, None]
+    result = cum_weights[rows, right] - cum_weights[rows, left]
+    return np.where(np.isnan(queries), 0, result)
+
+
+def level_significance(candidates: LevelCandidates, price_error: np.ndarray) -> np.ndarray:
+    """Significance of every candidate level: weight of its price zone relative to the strongest zone
+    """
+    weights = zone_weights(candidates, candidates.prices, price_error)
+    max_weights = weights.max(axis=1, initial=0)[:, None]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(max_weights > 0, weights / max_weights, 0)
+
+
+def nearest_support(
+    close: np.ndarray, candidates: LevelCandidates, significance: np.ndarray, min_significance: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the closest significant level below current price and its significance for every instrument
+    """
+    mask = (significance >= min_significance) & (candidates.prices <= close[:, None])
+    distances = np.where(mask, close[:, None] - candidates.prices, np.inf)
+
+    idx = distances.argmin(axis=1)
+    rows = np.arange(len(close))
+    found = np.isfinite(distances[rows, idx])
+
+    return (
+        np.where(found, candidates.prices[rows, idx], np.nan),
+        np.where(found, significance[rows, idx], np.nan),
+    )
+
+
+def screen(
+    panel: PricePanel,
+    max_support_distance: Optional[float] = 0.02,
+    min_significance: float = 0.25,
+    macd_cross_within: Optional[int] = None,
+) -> pd.DataFrame:
+    """Evaluate screening conditions for all instruments of the panel and rank them by distance to support
+
+    * max_support_distance: max distance from current close to a strong support level (share of price)
+    * min_significance: min significance of support level, by the approximation of `zone_weights`
+      (on the same scale as `SupportResistanceSearch`, but not equal to it)
+    * macd_cross_within: require bullish MACD(26,12,9) histogram cross within this number of last candles
+    """
+    columns = ['ticker', 'name', 'close', 'support', 'support_distance', 'support_significance', 'macd_histogram']
+    if len(panel.dates) < max(2, MIN_SIZE_OF_BATCH):
+        return pd.DataFrame(columns=columns)
+
+    close = ffill(panel.close)
+    last_close = close[:, -1]
+    price_error = np.nan_to_num(np.nanmean(panel.high - panel.low, axis=1) * 0.5)
+
+    candidates = find_level_candidates(panel.high, panel.low, panel.dates, min_size_of_batch=MIN_SIZE_OF_BATCH)
+    significance = level_significance(candidates, price_error)
+    support, support_significance = nearest_support(last_close, candidates, significance, min_significance)
+    support_distance = (last_close - support) / last_close
+
+    histogram = macd_histogram(close)
+    mask = ~np.isnan(last_close)
+
+    if max_support_distance is not None:
+        mask &= support_distance <= max_support_distance
+
+    if macd_cross_within:
+        window = histogram[:, -(macd_cross_within + 1):]
+        crosses = (window[:, :-1] <= 0) & (window[:, 1:] > 0)
+        mask &= crosses.any(axis=1)
+
+    result = pd.DataFrame({
+        'ticker': panel.tickers,
+        'name': panel.names,
+        'close': last_close,
+        'support': support,
+        'support_distance': support_distance,
+        'support_significance': support_significance,
+        'macd_histogram': histogram[:, -1],
+    }, columns=columns)
+
+    return result[mask].sort_values('support_distance').reset_index(drop=True)
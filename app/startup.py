@@ -0,0 +1,72 @@
+import subprocess
+import sys
+from typing import Dict, List, NamedTuple, Sequence
+
+
+class ImportTime(NamedTuple):
+    module: str
+    self_time: float  # seconds
+    cumulative: float  # seconds, including nested imports
+    depth: int  # nesting level, 0 for modules imported by the profiled module itself
+
+
+def parse_importtime(output: str) -> List[ImportTime]:
+    """Parse stderr of `python -X importtime`: lines 'import time: <self us> | <cumulative us> | <name>'
+    """
+    result = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            continue  # header
+
+        result.append(ImportTime(
+            module=name.strip(),
+            self_time=int(self_us) / 1e6,
+            cumulative=int(cumulative_us) / 1e6,
+            depth=(len(name) - len(name.lstrip()) - 1) // 2,
+        ))
+
+    return result
+
+
+def profile_imports(module: str) -> List[ImportTime]:
+    """Import module in a fresh interpreter, so modules already loaded by this process don't hide their cost
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f'Unable to import {module}: {process.stderr.splitlines()[-1]}')
+
+    return parse_importtime(process.stderr)
+
+
+def format_import_profile(module: str, times: Sequence[ImportTime], limit: int = 20) -> str:
+    """Render the total import time, the slowest top-level packages and the slowest single modules
+    """
+    total = max(item.cumulative for item in times if item.module == module)
+
+    # Self times of all modules of the package, so nested imports are not counted twice
+    packages: Dict[str, float] = {}
+    for item in times:
+        package = item.module.split('.')[0]
+        packages[package] = packages.get(package, 0) + item.self_time
+
+    lines = [f'Import of {module}: {total * 1000:.0f}ms', '', 'Packages:']
+    for package, cumulative in sorted(packages.items(), key=lambda item: -item[1])[:limit]:
+        lines.append(f'{cumulative * 1000:10.1f}ms  {package}')
+
+    lines += ['', 'Modules (self):']
+    for item in sorted(times, key=lambda item: -item.self_time)[:limit]:
+        lines.append(f'{item.self_time * 1000:10.1f}ms  {item.module}')
+
+    return '\n'.join(lines)
+
+
+def show_import_profile(module: str = 'app.dashboard', limit: int = 20) -> None:
+    print(format_import_profile(module, profile_imports(module), limit))
@@ -1,5 +1,6 @@
 import datetime as dt
 import decimal
+import hashlib
 import math
 import typing as tp
 from decimal import Decimal
@@ -8,6 +9,14 @@ import numpy as np
 import pandas as pd
 
 
+class BatchExtremes(tp.NamedTuple):
+    high: tp.Any
+    high_time: dt.datetime
+    low: tp.Any
+    low_time: dt.datetime
+    batch_size: int
+
+
 class SupportResistanceSearch:
 
     def __init__(
@@ -93,6 +102,24 @@ class SupportResistanceSearch:
                 time, raw_levels[similar_level_id]['time']
             )
 
+    def _batch_extremes(self) -> tp.Iterator['BatchExtremes']:
+        """Экстремумы batch-ей для каждого разбиения свечей (шаги 2 и 5 алгоритма `_find_levels`)
+        """
+        batch_iterations = len(self.candles) // self.min_size_of_batch
+
+        for num_of_batches in range(1, batch_iterations + 1):
+            for batch in self._divide_to_batches(num_of_batches):
+                max_price_row = batch.iloc[batch.high.astype(float).argmax()]
+                min_price_row = batch.iloc[batch.low.astype(float).argmin()]
+
+                yield BatchExtremes(
+                    high=max_price_row.high,
+                    high_time=max_price_row.time,
+                    low=min_price_row.low,
+                    low_time=min_price_row.time,
+                    batch_size=len(batch),
+                )
+
     def _find_levels(self) -> tp.List[tp.Dict[str, tp.Any]]:
         """Найти ценовые уровни
 
@@ -106,20 +133,11 @@ class SupportResistanceSearch:
            сравнить даты уровней и выбрать минимальную
         5. Разделить набор свечей на (N+1) частей и повторить шаги 2-4 для каждой части
         """
-        batch_iterations = len(self.candles) // self.min_size_of_batch
         raw_levels: tp.List[tp.Dict[str, tp.Any]] = []
 
-        for num_of_batches in range(1, batch_iterations + 1):
-            for batch in self._divide_to_batches(num_of_batches):
-                batch_size = len(batch)
-
-                max_price_id = batch.high.astype(float).argmax()
-                max_price_row = batch.iloc[max_price_id]
-                self._update_price_levels(raw_levels, max_price_row.high, max_price_row.time, batch_size)
-
-                min_price_id = batch.low.astype(float).argmin()
-                min_price_row = batch.iloc[min_price_id]
-                self._update_price_levels(raw_levels, min_price_row.low, min_price_row.time, batch_size)
+        for extremes in self._batch_extremes():
+            self._update_price_levels(raw_levels, extremes.high, extremes.high_time, extremes.batch_size)
+            self._update_price_levels(raw_levels, extremes.low, extremes.low_time, extremes.batch_size)
 
         max_weight = max([level['weight'] for level in raw_levels])
         return [
@@ -136,3 +154,199 @@ class SupportResistanceSearch:
             self._levels = pd.DataFrame.from_dict(self._find_levels())
 
         return self._levels[(self._levels.significance > significance_threshold)]  # type: ignore
+
+
+class CandleBlocks(tp.NamedTuple):
+    """Сводки блоков свечей: экстремумы цены, их время (ns UTC) и количество свечей в блоке.
+
+    Сводки соседних блоков объединяются без исходных свечей, поэтому экстремумы любого диапазона блоков
+    находятся по sparse table за O(1)
+    """
+    high: np.ndarray
+    high_time: np.ndarray
+    low: np.ndarray
+    low_time: np.ndarray
+    size: np.ndarray
+
+
+def _sparse_table(values: np.ndarray, better: tp.Callable[..., np.ndarray]) -> tp.List[np.ndarray]:
+    """Индексы лучших значений для окон из 2^j элементов; при равенстве выбирается левый (более ранний) элемент
+    """
+    table = [np.arange(len(values))]
+    width = 1
+
+    while width * 2 <= len(values):
+        prev = table[-1]
+        left, right = prev[:-width], prev[width:]
+        table.append(np.where(better(values[right], values[left]), right, left))
+        width *= 2
+
+    return table
+
+
+def _query_sparse_table(
+    table: tp.List[np.ndarray], values: np.ndarray, better: tp.Callable[..., np.ndarray], start: int, stop: int
+) -> int:
+    level = (stop - start).bit_length() - 1
+    left, right = table[level][start], table[level][stop - 2 ** level]
+    return int(right if better(values[right], values[left]) else left)
+
+
+class StreamingSupportResistanceSearch(SupportResistanceSearch):
+
+    def __init__(
+        self,
+        chunks: tp.Iterable[pd.DataFrame],
+        price_error: tp.Optional[Decimal] = None,
+        min_size_of_batch: int = 5,
+        recent_level_rate: int = 16,
+        block_size: int = 1000,
+        max_batch_iterations: tp.Optional[int] = None,
+    ):
+        """Поиск ценовых уровней по свечам, которые поступают частями (из БД или Parquet-файлов)
+
+        Свечи не хранятся целиком: за один проход по частям строятся сводки блоков по `block_size` свечей,
+        поэтому память ограничена размером части и числом блоков, а не длиной истории.
+
+        Параметры (помимо параметров `SupportResistanceSearch`):
+            * chunks: DataFrame-ы со свечами (колонки time, high, low), упорядоченные по времени
+            * block_size: Размер блока. Границы batch-ей округляются до границ блоков,
+              при block_size=1 результат совпадает с `SupportResistanceSearch`
+            * max_batch_iterations: Ограничение количества разбиений. По умолчанию их не больше числа блоков,
+              время поиска растет как квадрат числа блоков
+        """
+        self.block_size = block_size
+        self.min_size_of_batch = min_size_of_batch
+        self.recent_level_rate = recent_level_rate
+        self.max_batch_iterations = max_batch_iterations
+
+        self._num_of_candles = 0
+        self._sum_of_ranges = 0.0
+        self._tz: tp.Any = None
+        self._blocks = self._summarize(chunks)
+
+        self.price_error = price_error or self.default_price_error
+        self._levels = None
+
+    @property
+    def default_price_error(self) -> float:
+        return self._sum_of_ranges / max(self._num_of_candles, 1) * 0.5
+
+    def _summarize(self, chunks: tp.Iterable[pd.DataFrame]) -> CandleBlocks:
+        blocks: tp.List[tp.Tuple[np.ndarray, ...]] = []
+        carry: tp.Tuple[np.ndarray, ...] = (np.array([], dtype='int64'), np.array([]), np.array([]))
+
+        for chunk in chunks:
+            if chunk.empty:
+                continue
+
+            times = pd.to_datetime(chunk.time)
+            self._tz = self._tz or times.dt.tz
+            time = times.to_numpy(dtype='datetime64[ns]').astype('int64')
+            high = chunk.high.to_numpy(dtype=float)
+            low = chunk.low.to_numpy(dtype=float)
+
+            self._num_of_candles += len(chunk)
+            self._sum_of_ranges += float((high - low).sum())
+
+            time, high, low = (np.concatenate([carried, new]) for carried, new in zip(carry, (time, high, low)))
+            num_of_full = len(time) // self.block_size * self.block_size
+            blocks.append(self._summarize_blocks(time[:num_of_full], high[:num_of_full], low[:num_of_full]))
+            carry = (time[num_of_full:], high[num_of_full:], low[num_of_full:])
+
+        if len(carry[0]):
+            time, high, low = carry
+            blocks.append(self._summarize_blocks(time, high, low, block_size=len(time)))
+
+        if not self._num_of_candles:
+            raise ValueError('No candles to search levels')
+
+        return CandleBlocks(*(np.concatenate(column) for column in zip(*blocks)))
+
+    def _summarize_blocks(
+        self, time: np.ndarray, high: np.ndarray, low: np.ndarray, block_size: tp.Optional[int] = None
+    ) -> tp.Tuple[np.ndarray, ...]:
+        block_size = block_size or self.block_size
+        time, high, low = (values.reshape(-1, block_size) for values in (time, high, low))
+        rows = np.arange(len(time))
+
+        high_idx, low_idx = high.argmax(axis=1), low.argmin(axis=1)
+        return (
+            high[rows, high_idx], time[rows, high_idx], low[rows, low_idx], time[rows, low_idx],
+            np.full(len(time), block_size),
+        )
+
+    def _to_timestamp(self, time_ns: int) -> pd.Timestamp:
+        return pd.Timestamp(time_ns, tz='UTC').tz_convert(self._tz) if self._tz else pd.Timestamp(time_ns)
+
+    def _partitions(self) -> tp.Iterator[tp.Tuple[np.ndarray, np.ndarray, np.ndarray, int]]:
+        """Разбиения свечей на batch-и, округленные до границ блоков: (первые блоки, концы блоков, размеры batch-ей,
+        количество повторов разбиения)
+
+        Разбиений не больше, чем блоков: более мелкие batch-и не меняют экстремумы. Одинаковые разбиения
+        исходный алгоритм повторяет для соседних N с равным размером batch-а, они возвращаются один раз с числом
+        повторов; разбиения, совпавшие только после округления до блоков, пропускаются
+        """
+        num_of_candles = self._num_of_candles
+        block_starts = np.concatenate([[0], np.cumsum(self._blocks.size)])
+
+        batch_iterations = min(num_of_candles // self.min_size_of_batch, len(self._blocks.size))
+        if self.max_batch_iterations is not None:
+            batch_iterations = min(batch_iterations, self.max_batch_iterations)
+
+        seen: tp.Set[bytes] = set()
+        num_of_batches = 1
+        while num_of_batches <= batch_iterations:
+            batch_size = math.ceil(num_of_candles / num_of_batches)
+
+            # Следующие N с тем же размером batch-а (ceil(n / N) == batch_size при N < n / (batch_size - 1))
+            # дают то же разбиение
+            last_num_of_batches = batch_iterations
+            if batch_size > 1:
+                last_num_of_batches = min(last_num_of_batches, math.ceil(num_of_candles / (batch_size - 1)) - 1)
+
+            repeats = last_num_of_batches - num_of_batches + 1
+            num_of_batches = last_num_of_batches + 1
+
+            starts = np.arange(0, num_of_candles, batch_size)
+            stops = np.minimum(starts + batch_size, num_of_candles)
+            # Batch is rounded to the blocks starting inside of it
+            first_blocks = np.searchsorted(block_starts, starts)
+            last_blocks = np.searchsorted(block_starts, stops)
+
+            non_empty = first_blocks < last_blocks
+            first_blocks, last_blocks = first_blocks[non_empty], last_blocks[non_empty]
+
+            key = hashlib.blake2b(first_blocks.tobytes() + last_blocks.tobytes(), digest_size=16).digest()
+            if key in seen:
+                continue
+            seen.add(key)
+
+            yield first_blocks, last_blocks, (stops - starts)[non_empty], repeats
+
+    def _batch_extremes(self) -> tp.Iterator[BatchExtremes]:
+        blocks = self._blocks
+        self._from_time = self._to_timestamp(min(blocks.high_time.min(), blocks.low_time.min()))
+        self._to_time = self._to_timestamp(max(blocks.high_time.max(), blocks.low_time.max()))
+
+        high_table = _sparse_table(blocks.high, np.greater)
+        low_table = _sparse_table(blocks.low, np.less)
+
+        for first_blocks, last_blocks, batch_sizes, repeats in self._partitions():
+            batches = []
+            for first_block, last_block, batch_size in zip(
+                first_blocks.tolist(), last_blocks.tolist(), batch_sizes.tolist()
+            ):
+                high_block = _query_sparse_table(high_table, blocks.high, np.greater, first_block, last_block)
+                low_block = _query_sparse_table(low_table, blocks.low, np.less, first_block, last_block)
+
+                batches.append(BatchExtremes(
+                    high=blocks.high[high_block],
+                    high_time=self._to_timestamp(blocks.high_time[high_block]),
+                    low=blocks.low[low_block],
+                    low_time=self._to_timestamp(blocks.low_time[low_block]),
+                    batch_size=batch_size,
+                ))
+
+            for _ in range(repeats):
+                yield from batches
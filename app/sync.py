@@ -1,19 +1,36 @@
 import asyncio
+import cProfile
 import datetime as dt
 import logging
 import signal
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Tuple
 
 from aiocron import crontab
-from dateutil.relativedelta import relativedelta
 from tortoise import timezone as tz
 
-from . import models
+from . import jobs, metrics, models
 from .config import settings
-from .schema import Currency, Timeframe
+from .gaps import fill_day_candle_gaps
+from .retention import apply_retention
+from .rollups import refresh_rollups
+from .scheduler import AdaptiveScheduler
+from .schema import Currency
 from .tinkoff import TinkoffClient
+from .utils import localize_dt
 
 logger = logging.getLogger(__name__)
 
+Stage = Callable[[TinkoffClient], Awaitable[None]]
+
+# Advisory lock held by the node which runs sync stages (plans jobs), other nodes only run the jobs
+PLANNER_LOCK_KEY = 7_150_001
+
+
+class SyncAlreadyRunningError(RuntimeError):
+    pass
+
 
 async def update_usd_stocks(client: TinkoffClient) -> None:
     logger.info('Updating USD stocks...')
@@ -38,46 +55,35 @@ async def update_usd_stocks(client: TinkoffClient) -> None:
         for figi in to_create_ids
     ]
 
-    await models.Instrument.bulk_create(to_create_instances)
+    with metrics.db_query_seconds.time(query='instrument_bulk_create'):
+        await models.Instrument.bulk_create(to_create_instances)
     await models.Instrument.filter(figi__in=to_delete_ids).update(deleted_at=tz.now())
+    metrics.sync_rows_total.inc(len(to_create_ids) + len(to_delete_ids), stage='update_usd_stocks')
 
     logger.info('Stocks created: %s, deleted: %s', len(to_create_ids), len(to_delete_ids))
 
 
 async def init_day_candles(client: TinkoffClient) -> None:
-    """Заполнение информации о дневных свечах с текущего дня по дату первого появления
+    """Заполнение информации о дневных свечах с 2015 года по текущий день.
+
+    Загрузка ведется по годам, прогресс сохраняется в журнал задач (`SyncJob`)
     """
     logger.info('Init day candles for stocks...')
     sql = '''
         SELECT instrument.figi, instrument.ticker FROM instrument
-            LEFT JOIN candle ON instrument.figi = candle.instrument_id
+            LEFT JOIN candle ON instrument.figi = candle.instrument_id AND candle.timeframe = 'day'
         WHERE instrument.delisted_at IS NOT NULL
         GROUP BY instrument.figi
         HAVING count(candle.id) = 0;
     '''
-    instruments_to_upd = await models.db_query(sql)
-
-    for figi, ticker in instruments_to_upd:
-        end_dt = tz.now()
-        start_dt = dt.datetime(end_dt.year, 1, 1, tzinfo=settings.TIMEZONE)
-
-        candle_instances = []
-        while start_dt.year >= 2015:
-            candle_instances += [
-                models.Candle(
-                    instrument_id=figi,
-                    timeframe=Timeframe.D1,
-                    **candle.dict(),
-                )
-                for candle in await client.get_candles(
-                    figi, timeframe=Timeframe.D1, start_dt=start_dt, end_dt=end_dt
-                )
-            ]
-            end_dt = start_dt
-            start_dt -= relativedelta(years=1)
-
-        await models.Candle.bulk_create(candle_instances)
-        logger.info('Uploaded %s candles for %s', len(candle_instances), ticker)
+    instruments_to_upd = await models.db_query(sql, label='instruments_without_candles')
+
+    now = tz.now()
+    for figi, _ in instruments_to_upd:
+        await jobs.plan_job(figi, 'init_day_candles', start_dt=localize_dt(dt.datetime(2015, 1, 1)), end_dt=now)
+
+    # Jobs interrupted by previous runs are resumed here as well
+    await jobs.run_jobs(client, stage='init_day_candles')
 
     # TODO: Fix counter when nothing to update
     logger.info('Day candles initialized for %s stocks', len(instruments_to_upd))
@@ -87,15 +93,16 @@ async def update_stocks_emerging_date(client: TinkoffClient) -> None:
     logger.info('Updating stocks emerging dates...')
     sql = '''
         SELECT candle.instrument_id, min(candle.time) FROM instrument
-            LEFT JOIN candle ON instrument.figi = candle.instrument_id
+            LEFT JOIN candle ON instrument.figi = candle.instrument_id AND candle.timeframe = 'day'
         WHERE instrument.emerged_at IS NULL
         GROUP BY candle.instrument_id
         HAVING count(candle.id) > 0;
     '''
-    instruments_to_upd = await models.db_query(sql)
+    instruments_to_upd = await models.db_query(sql, label='instruments_emerging_date')
 
     for figi, first_candle_time in instruments_to_upd:
         await models.Instrument.get(figi=figi).update(emerged_at=first_candle_time.date())  # type: ignore
+    metrics.sync_rows_total.inc(len(instruments_to_upd), stage='update_stocks_emerging_date')
 
     logger.info('Set stock emerging date for %s stocks', len(instruments_to_upd))
 
@@ -104,16 +111,17 @@ async def update_stocks_delisting_date(client: TinkoffClient) -> None:
     logger.info('Updating stocks delisting dates...')
     sql = '''
         SELECT candle.instrument_id, max(candle.time) FROM instrument
-            LEFT JOIN candle ON instrument.figi = candle.instrument_id
+            LEFT JOIN candle ON instrument.figi = candle.instrument_id AND candle.timeframe = 'day'
         WHERE instrument.delisted_at IS NULL
         GROUP BY candle.instrument_id
         HAVING max(candle.time) < now() - '14 days' :: interval
             OR max(candle.time) IS NULl;
     '''
-    instruments_to_upd = await models.db_query(sql)
+    instruments_to_upd = await models.db_query(sql, label='instruments_delisting_date')
     for figi, last_candle_time in instruments_to_upd:
 
         await models.Instrument.get(figi=figi).update(delisted_at=last_candle_time)  # type: ignore
+    metrics.sync_rows_total.inc(len(instruments_to_upd), stage='update_stocks_delisting_date')
 
     logger.info('Set stock delisting date for %s stocks', len(instruments_to_upd))
 
@@ -122,7 +130,8 @@ async def update_day_candles(client: TinkoffClient) -> None:
     dates_of_last_candle = {
         figi: last_time
         for figi, last_time in await models.db_query(
-            'SELECT instrument_id, max(time) FROM candle GROUP BY instrument_id;'
+            "SELECT instrument_id, max(time) FROM candle WHERE timeframe = 'day' GROUP BY instrument_id;",
+            label='last_candle_dates',
         )
     }
     stocks = await models.Instrument.filter(
@@ -137,62 +146,204 @@ async def update_day_candles(client: TinkoffClient) -> None:
         if not last_date_candle or last_date_candle.date() == now.date():
             continue
 
-        start_dt = last_date_candle
-        end_dt = last_date_candle + relativedelta(years=1)
-        candle_instances = []
-
-        while start_dt.date() < now.date():
-            candle_instances += [
-                models.Candle(
-                    instrument=stock,
-                    timeframe=Timeframe.D1,
-                    **candle.dict(),
-                )
-                for candle in await client.get_candles(
-                    stock.figi, timeframe=Timeframe.D1, start_dt=start_dt, end_dt=end_dt
-                )
-            ]
+        await jobs.plan_job(stock.figi, 'update_day_candles', start_dt=last_date_candle, end_dt=now)
 
-            start_dt = end_dt
-            end_dt += relativedelta(years=1)
-
-        await models.Candle.bulk_create(candle_instances)
-        logger.info('Uploaded %s candles for %s', len(candle_instances), stock.ticker)
+    await jobs.run_jobs(client, stage='update_day_candles')
 
     if len(stocks) > 0:
         logger.info('Updated candles for %s stocks', len(stocks))
 
 
-async def main() -> None:
-    await models.init_db()
-    client = TinkoffClient()
+async def resume_unfinished_jobs(client: TinkoffClient) -> None:
+    failed_jobs = await jobs.run_jobs(client)
+    logger.info('Unfinished jobs resumed, failed: %s', len(failed_jobs))
 
-    await update_usd_stocks(client)
 
-    await init_day_candles(client)
-    await update_stocks_emerging_date(client)
+async def retry_failed_jobs(client: TinkoffClient) -> None:
+    failed_jobs = await jobs.run_jobs(client, statuses=[models.SyncJobStatus.FAILED])
+    logger.info('Failed jobs retried, still failing: %s', len(failed_jobs))
 
-    await update_day_candles(client)
-    await update_stocks_delisting_date(client)
 
-    logger.info('Sync done')
+async def prewarm_dashboard(client: TinkoffClient) -> None:
+    # Dashboard cache pulls pandas and plotly, so it's imported only when the stage runs
+    from . import dashboard_cache
 
-    await client.close()
-    await models.close_db()
+    await dashboard_cache.prewarm_dashboard(client)
 
 
-async def run_scheduler() -> None:
+STAGES: Tuple[Stage, ...] = (
+    update_usd_stocks,
+    init_day_candles,
+    update_stocks_emerging_date,
+    update_day_candles,
+    fill_day_candle_gaps,
+    update_stocks_delisting_date,
+    refresh_rollups,
+    apply_retention,
+) + ((prewarm_dashboard, ) if settings.DASHBOARD_PREWARM_ENABLED else ())
+
+# Candles are downloaded by `AdaptiveScheduler` of the `sync` daemon, so its daily run skips candle stages
+MAINTENANCE_STAGES = tuple(stage for stage in STAGES if stage not in (init_day_candles, update_day_candles))
+
+
+async def run_stage(run: models.SyncRun, stage: Stage, client: TinkoffClient) -> None:
+    """Run sync stage and append its timing profile to the run report
+    """
+    name = stage.__name__
+    requests_before = metrics.api_requests_total.total()
+    rows_before = metrics.sync_rows_total.get(stage=name)
+    profiler = cProfile.Profile() if settings.SYNC_PROFILE_ENABLED else None
+    start = time.perf_counter()
+
+    try:
+        with metrics.track_stage(name):
+            if profiler:
+                profiler.enable()
+            try:
+                await stage(client)
+            finally:
+                if profiler:
+                    profiler.disable()
+
+    finally:
+        report: Dict[str, Any] = {
+            'name': name,
+            'duration': time.perf_counter() - start,
+            'api_requests': int(metrics.api_requests_total.total() - requests_before),
+            'rows_written': int(metrics.sync_rows_total.get(stage=name) - rows_before),
+            'profile': None,
+        }
+        if profiler and report['duration'] >= settings.SYNC_PROFILE_THRESHOLD:
+            profile_path = Path(settings.SYNC_PROFILE_DIR) / f'sync_{run.id}_{name}.prof'
+            profile_path.parent.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(profile_path)
+            report['profile'] = str(profile_path)
+
+        run.stages = [*run.stages, report]  # type: ignore
+        run.api_requests += report['api_requests']
+        run.rows_written += report['rows_written']
+        await run.save(update_fields=['stages', 'api_requests', 'rows_written'])
+
+        logger.info('Stage %s finished in %.1fs', name, report['duration'])
+
+
+async def run_stages(client: TinkoffClient, stages: Sequence[Stage]) -> None:
+    run = await models.SyncRun.create()
+
+    try:
+        for stage in stages:
+            await run_stage(run, stage, client)
+
+        run.status = models.SyncRunStatus.DONE
+        logger.info('Sync done')
+
+    except Exception:
+        run.status = models.SyncRunStatus.FAILED
+        raise
+
+    finally:
+        run.finished_at = tz.now()  # type: ignore
+        await run.save(update_fields=['status', 'finished_at'])
+
+
+async def run_worker(client: TinkoffClient, stop_event: Optional[asyncio.Event] = None) -> None:
+    """Drain sync jobs queue together with other workers
+
+    Without `stop_event` returns as soon as the planner is done and there are no jobs left.
+    """
+    while stop_event is None or not stop_event.is_set():
+        planner_running = await models.is_advisory_locked(PLANNER_LOCK_KEY)
+        await jobs.run_jobs(client)
+
+        if stop_event is None and not planner_running:
+            break
+
+        await asyncio.sleep(settings.SYNC_WORKER_POLL_INTERVAL)
+
+
+def make_client() -> TinkoffClient:
+    # Processes share the token, so each of them gets its part of requests limit
+    return TinkoffClient(rate_limit=settings.TINKOFF_RATE_LIMIT / settings.SYNC_WORKERS)
+
+
+async def run_planner(client: TinkoffClient, stages: Sequence[Stage], join_as_worker: bool = True) -> None:
+    """Run sync stages. If they are already running on another node, help it as a worker
+
+    Without `join_as_worker` raises `SyncAlreadyRunningError` instead, so the requested stages are not lost silently.
+    """
+    async with models.advisory_lock(PLANNER_LOCK_KEY) as is_planner:
+        if is_planner:
+            await run_stages(client, stages)
+
+        elif join_as_worker:
+            logger.info('Sync is already running on another node, joining as worker')
+            await run_worker(client)
+
+        else:
+            names = ', '.join(stage.__name__ for stage in stages)
+            raise SyncAlreadyRunningError(f'Sync is already running on another node, stages are not run: {names}')
+
+
+async def main(stages: Sequence[Stage] = STAGES, join_as_worker: bool = True) -> None:
+    await models.init_db()
+    client = make_client()
+
+    try:
+        await run_planner(client, stages, join_as_worker)
+
+    finally:
+        await client.close()
+        await models.close_db()
+
+
+def _stop_event_on_signals() -> asyncio.Event:
     loop = asyncio.get_event_loop()
     stop_event = asyncio.Event()
 
     for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
         loop.add_signal_handler(sig, stop_event.set)
 
-    crontab('0 4 * * tue-sat', func=main, tz=settings.TIMEZONE)
+    return stop_event
+
+
+async def run_worker_daemon() -> None:
+    stop_event = _stop_event_on_signals()
+
+    await models.init_db()
+    client = make_client()
+
+    logger.info('Starting sync worker %s', jobs.WORKER_ID)
+    try:
+        await run_worker(client, stop_event)
+
+    finally:
+        logger.info('Shutting down')
+        await client.close()
+        await models.close_db()
+
+
+async def run_scheduler() -> None:
+    """Keep candles fresh with adaptive scheduler, run maintenance stages once a day
+    """
+    stop_event = _stop_event_on_signals()
+
+    await models.init_db()
+    # Scheduler and maintenance stages share the rate budget of the client
+    client = TinkoffClient(rate_limit=settings.SYNC_SCHEDULER_RATE_LIMIT)
+
+    crontab('0 4 * * tue-sat', func=run_planner, args=(client, MAINTENANCE_STAGES), tz=settings.TIMEZONE)
+
+    metrics_server = await metrics.start_http_server() if settings.METRICS_ENABLED else None
 
     logger.info('Starting sync scheduler')
     try:
-        await stop_event.wait()
+        await AdaptiveScheduler(client).run(stop_event)
 
     finally:
         logger.info('Shutting down')
+        if metrics_server is not None:
+            metrics_server.close()
+            await metrics_server.wait_closed()
+
+        await client.close()
+        await models.close_db()
@@ -1,15 +1,28 @@
 import asyncio
 import datetime as dt
+import json
 import logging
-from typing import Any, Dict, List, Literal, Optional
+import time
+from typing import Any, AsyncIterator, Dict, List, Literal, Optional, Sequence, Tuple, Union
 
 import httpx
 from dateutil.relativedelta import relativedelta
 
+from . import metrics
 from .config import settings
 from .schema import BalanceItem, Candle, Instrument, Timeframe
 from .utils import localize_dt
 
+try:
+    import h2
+except ImportError:  # pragma: no cover
+    h2 = None
+
+try:
+    import websockets
+except ImportError:  # pragma: no cover
+    websockets = None
+
 logger = logging.getLogger(__name__)
 
 
@@ -20,6 +33,24 @@ class TinkoffAPIError(Exception):
     pass
 
 
+class RateLimiter:
+    """Spread requests evenly, so that no more than `rate` requests are made per minute
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 60 / rate if rate > 0 else 0
+        self._next_slot = 0.0
+
+    async def acquire(self) -> None:
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+
+        if slot > now:
+            metrics.api_throttle_seconds.inc(slot - now)
+            await asyncio.sleep(slot - now)
+
+
 class TinkoffClient:
     """Client for making HTTP requests to Invest API
 
@@ -36,13 +67,29 @@ class TinkoffClient:
         Timeframe.D30: relativedelta(years=10),
     }
 
-    def __init__(self, token: str = ''):
+    def __init__(self, token: str = '', rate_limit: Optional[float] = None):
+        """
+        `rate_limit` - max requests per minute made by this client (`TINKOFF_RATE_LIMIT` by default).
+        When several processes share the token, each of them should get its own part of the limit.
+        """
         token = token or settings.TINKOFF_TOKEN.get_secret_value()
         if not token:
             raise RuntimeError('No token specified for Tinkoff client')
 
+        self._rate_limiter = RateLimiter(rate_limit or settings.TINKOFF_RATE_LIMIT)
+        self._base_url = httpx.URL(settings.TINKOFF_HTTP_URL)
+
+        # Identical GET requests in flight: concurrent callers share one HTTP call and one rate limiter slot
+        self._inflight: Dict[Tuple[str, str], 'asyncio.Future[Dict[str, Any]]'] = {}
+
         self._client = httpx.AsyncClient(
-            headers={'Authorization': f'Bearer {token}'}
+            headers={'Authorization': f'Bearer {token}'},
+            limits=httpx.Limits(
+                max_connections=settings.TINKOFF_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.TINKOFF_MAX_KEEPALIVE_CONNECTIONS,
+            ),
+            timeout=httpx.Timeout(settings.TINKOFF_TIMEOUT, connect=settings.TINKOFF_CONNECT_TIMEOUT),
+            http2=settings.TINKOFF_HTTP2 and h2 is not None,
         )
 
     async def close(self) -> None:
@@ -54,24 +101,51 @@ class TinkoffClient:
         endpoint: str,
         json_data: Optional[Dict[str, Any]] = None,
         params: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        if method != 'GET':
+            return await self._send(method, endpoint, json_data, params)
+
+        key = (endpoint, json.dumps(params, sort_keys=True, default=str))
+        if key in self._inflight:
+            metrics.api_coalesced_total.inc(endpoint=endpoint)
+        else:
+            task = asyncio.ensure_future(self._send(method, endpoint, json_data, params))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            self._inflight[key] = task
+
+        # Cancellation of one caller should not cancel the request for others
+        return await asyncio.shield(self._inflight[key])
+
+    async def _send(
+        self,
+        method: Literal['GET', 'POST'],
+        endpoint: str,
+        json_data: Optional[Dict[str, Any]] = None,
+        params: Optional[Dict[str, Any]] = None,
         retries_on_ratelimit: int = 2,
     ) -> Dict[str, Any]:
 
-        url = settings.TINKOFF_HTTP_URL.join(endpoint)
-        response = await self._client.request(
-            method=method,
-            url=url,
-            json=json_data or {},
-            params=params or {},
-        )
+        url = self._base_url.join(endpoint)
+        await self._rate_limiter.acquire()
+        with metrics.api_request_seconds.time(endpoint=endpoint), metrics.span('tinkoff.request', endpoint=endpoint):
+            response = await self._client.request(
+                method=method,
+                url=url,
+                json=json_data or {},
+                params=params or {},
+            )
+        metrics.api_requests_total.inc(endpoint=endpoint, status=response.status_code)
 
         if response.status_code == 429:
+            metrics.api_ratelimit_total.inc(endpoint=endpoint)
             if retries_on_ratelimit <= 0:
                 raise TinkoffAPIError('Rate limit for requests exceed')
 
             logger.info('API requests limit reached. Waiting 1 min...')
             await asyncio.sleep(60)
-            return await self._request(method, endpoint, json_data, params, retries_on_ratelimit - 1)
+            metrics.api_ratelimit_sleep_seconds.inc(60)
+            metrics.api_retries_total.inc(endpoint=endpoint)
+            return await self._send(method, endpoint, json_data, params, retries_on_ratelimit - 1)
 
         response_data = response.json()
         payload: Dict[str, Any] = response_data['payload']
@@ -102,11 +176,14 @@ class TinkoffClient:
     #     ]
 
     async def _get_instruments(self, kind: Literal['stocks', 'bonds', 'currencies']) -> List[Instrument]:
-        response = await self._request('GET', f'market/{kind}')
-        return [
-            Instrument(**obj) for obj in response['instruments']
-            if 'minPriceIncrement' in obj
-        ]
+        endpoint = f'market/{kind}'
+        response = await self._request('GET', endpoint)
+
+        with metrics.api_parse_seconds.time(endpoint=endpoint):
+            return [
+                Instrument(**obj) for obj in response['instruments']
+                if 'minPriceIncrement' in obj
+            ]
 
     async def get_stocks(self) -> List[Instrument]:
         return await self._get_instruments('stocks')
@@ -144,7 +221,8 @@ class TinkoffClient:
                 'to': make_tz_aware(end),
                 'interval': timeframe,
             })
-            candles.extend([Candle(**obj) for obj in response['candles']])
+            with metrics.api_parse_seconds.time(endpoint='market/candles'):
+                candles.extend([Candle(**obj) for obj in response['candles']])
 
             if end == end_dt:
                 break
@@ -155,3 +233,61 @@ class TinkoffClient:
                 end = end_dt
 
         return candles
+
+
+def _parse_candle_event(message: Union[str, bytes]) -> Optional[Tuple[str, Candle]]:
+    """(figi, candle) of candle event, None for other and malformed events: they must not break the subscription
+    """
+    try:
+        event = json.loads(message)
+        if event['event'] == 'error':
+            logger.warning('Streaming API error: %s', event['payload'].get('error'))
+            return None
+        if event['event'] != 'candle':
+            return None
+
+        return event['payload']['figi'], Candle(**event['payload'])
+
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        logger.warning('Unable to parse streaming event %.200r: %s', message, e)
+        return None
+
+
+class TinkoffStreamingClient:
+    """Client of Invest streaming API (websocket), requires `websockets` package
+
+    Documentation: https://tinkoffcreditsystems.github.io/invest-openapi/marketdata/
+    """
+
+    def __init__(self, token: str = ''):
+        if websockets is None:
+            raise RuntimeError('`websockets` is required for streaming API, install `streaming` extra')
+
+        self._token = token or settings.TINKOFF_TOKEN.get_secret_value()
+        if not self._token:
+            raise RuntimeError('No token specified for Tinkoff client')
+
+    async def stream_candles(
+        self, figis: Sequence[str], timeframe: Timeframe = Timeframe.M1
+    ) -> AsyncIterator[Tuple[str, Candle]]:
+        """Subscribe to candles of instruments and yield (figi, candle) on every update of their current candle.
+
+        Connection errors are raised as `TinkoffAPIError`, the caller should reconnect. Malformed events are logged
+        and skipped.
+        """
+        try:
+            async with websockets.connect(
+                settings.TINKOFF_WS_URL, extra_headers={'Authorization': f'Bearer {self._token}'}
+            ) as connection:
+                for figi in figis:
+                    await connection.send(json.dumps({
+                        'event': 'candle:subscribe', 'figi': figi, 'interval': timeframe.value
+                    }))
+
+                async for message in connection:
+                    update = _parse_candle_event(message)
+                    if update is not None:
+                        yield update
+
+        except (OSError, websockets.WebSocketException) as e:
+            raise TinkoffAPIError(f'Streaming API connection failed: {e}') from e
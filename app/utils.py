@@ -1,7 +1,67 @@
 import datetime as dt
+import importlib.util
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from types import ModuleType
+from typing import Optional
 
 from .config import settings
 
 
 def localize_dt(datetime: dt.datetime) -> dt.datetime:
     return settings.TIMEZONE.localize(datetime)  # type: ignore
+
+
+def lazy_import(name: str) -> ModuleType:
+    """Module which is executed on the first attribute access, so heavy subsystems load only when used
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        raise ModuleNotFoundError(f'No module named {name!r}', name=name)
+
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+
+    parent, _, child = name.rpartition('.')
+    if parent:
+        setattr(sys.modules[parent], child, module)
+
+    return module
+
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+
+def process_pool() -> ProcessPoolExecutor:
+    """Process pool shared by all CPU-bound tasks of the process, its workers are started once.
+
+    Workers are spawned, not forked: the dashboard and the daemons have running threads and event loops
+    """
+    global _process_pool
+
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(os.cpu_count() or 1, mp_context=multiprocessing.get_context('spawn'))
+
+        return _process_pool
+
+
+def reset_process_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop broken pool (e.g. a worker was killed by OOM killer), the next task starts a new one
+    """
+    global _process_pool
+
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+
+    pool.shutdown(wait=False)
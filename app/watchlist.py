@@ -0,0 +1,73 @@
+import logging
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, Optional
+
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+
+from . import graphs
+from .utils import process_pool, reset_process_pool
+
+logger = logging.getLogger(__name__)
+
+GRAPH_HEIGHT = 350
+
+
+def build_graphs(
+    candles: Dict[str, pd.DataFrame],
+    sr_candles: Optional[Dict[str, pd.DataFrame]] = None,
+    sr_significance_threshold: Optional[float] = None,
+    macd: bool = False,
+) -> Dict[str, go.Figure]:
+    """Small-multiple candles graphs of many tickers. S/R levels and indicators are computed in the shared
+    process pool
+    """
+    tickers = [ticker for ticker, ticker_candles in candles.items() if not ticker_candles.empty]
+    tasks = (
+        tickers,
+        [candles[ticker] for ticker in tickers],
+        [sr_candles[ticker] if sr_candles and not sr_candles[ticker].empty else None for ticker in tickers],
+        [sr_significance_threshold] * len(tickers),
+        [macd] * len(tickers),
+        [GRAPH_HEIGHT] * len(tickers),
+    )
+
+    figures: Optional[Iterable[str]] = None
+    if len(tickers) > 1:
+        pool = process_pool()
+        try:
+            figures = list(pool.map(graphs.build_candles_graph_json, *tasks))
+        except BrokenProcessPool:
+            logger.warning('Process pool is broken, building graphs in-process')
+            reset_process_pool(pool)
+
+    if figures is None:
+        figures = map(graphs.build_candles_graph_json, *tasks)
+
+    return {ticker: pio.from_json(figure) for ticker, figure in zip(tickers, figures)}
+
+
+def get_normalized_graph(candles: Dict[str, pd.DataFrame]) -> go.Figure:
+    """Close prices of many tickers on one graph, as change (%) relative to the first candle of the range
+    """
+    fig = go.Figure()
+
+    for ticker, ticker_candles in candles.items():
+        if ticker_candles.empty:
+            continue
+
+        close = ticker_candles.close.astype(float)
+        fig.add_trace(go.Scatter(x=ticker_candles.time, y=(close / close.iloc[0] - 1) * 100, name=ticker))
+
+    fig.update_layout(
+        {'plot_bgcolor': '#ffffff', 'paper_bgcolor': '#ffffff', 'legend_orientation': "h"},
+        legend=dict(y=1, x=0),
+        height=700,
+        hovermode='x unified',
+        margin=dict(b=20, t=0, l=0, r=40),
+    )
+    fig.update_yaxes(zeroline=True, showgrid=False, ticksuffix='%')
+    fig.update_xaxes(showgrid=False)
+
+    return fig
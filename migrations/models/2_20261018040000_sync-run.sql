@@ -0,0 +1,13 @@
+-- upgrade --
+CREATE TABLE IF NOT EXISTS "sync_run" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "status" VARCHAR(7) NOT NULL  DEFAULT 'running',
+    "started_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP,
+    "finished_at" TIMESTAMPTZ,
+    "api_requests" INT NOT NULL  DEFAULT 0,
+    "rows_written" INT NOT NULL  DEFAULT 0,
+    "stages" JSONB NOT NULL
+);
+COMMENT ON COLUMN "sync_run"."status" IS 'RUNNING: running\nDONE: done\nFAILED: failed';
+-- downgrade --
+DROP TABLE IF EXISTS "sync_run";
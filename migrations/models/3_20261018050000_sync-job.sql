@@ -0,0 +1,20 @@
+-- upgrade --
+CREATE TABLE IF NOT EXISTS "sync_job" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "timeframe" VARCHAR(6) NOT NULL,
+    "stage" VARCHAR(32) NOT NULL,
+    "status" VARCHAR(7) NOT NULL  DEFAULT 'pending',
+    "start_dt" TIMESTAMPTZ NOT NULL,
+    "end_dt" TIMESTAMPTZ NOT NULL,
+    "cursor" TIMESTAMPTZ NOT NULL,
+    "attempts" INT NOT NULL  DEFAULT 0,
+    "error" TEXT,
+    "created_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP,
+    "updated_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP,
+    "instrument_id" VARCHAR(12) NOT NULL REFERENCES "instrument" ("figi") ON DELETE CASCADE
+);
+CREATE INDEX "idx_sync_job_status_stage" ON "sync_job" ("status", "stage");
+COMMENT ON COLUMN "sync_job"."timeframe" IS 'M1: 1min\nM5: 5min\nM10: 10min\nM30: 30min\nH1: hour\nD1: day\nD7: week\nD30: month';
+COMMENT ON COLUMN "sync_job"."status" IS 'PENDING: pending\nRUNNING: running\nDONE: done\nFAILED: failed';
+-- downgrade --
+DROP TABLE IF EXISTS "sync_job";
@@ -0,0 +1,6 @@
+-- upgrade --
+ALTER TABLE "sync_job" ADD "worker" VARCHAR(64);
+ALTER TABLE "sync_job" ADD "lease_until" TIMESTAMPTZ;
+-- downgrade --
+ALTER TABLE "sync_job" DROP COLUMN "worker";
+ALTER TABLE "sync_job" DROP COLUMN "lease_until";
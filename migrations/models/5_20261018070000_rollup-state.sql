@@ -0,0 +1,9 @@
+-- upgrade --
+CREATE TABLE IF NOT EXISTS "rollup_state" (
+    "timeframe" VARCHAR(6) NOT NULL  PRIMARY KEY,
+    "last_candle_id" INT NOT NULL  DEFAULT 0,
+    "updated_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP
+);
+COMMENT ON COLUMN "rollup_state"."timeframe" IS 'M1: 1min\nM5: 5min\nM10: 10min\nM30: 30min\nH1: hour\nD1: day\nD7: week\nD30: month';
+-- downgrade --
+DROP TABLE IF EXISTS "rollup_state";
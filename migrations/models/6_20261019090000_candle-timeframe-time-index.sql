@@ -0,0 +1,4 @@
+-- upgrade --
+CREATE INDEX "idx_candle_timefra_ea6176" ON "candle" ("timeframe", "time");
+-- downgrade --
+DROP INDEX "idx_candle_timefra_ea6176";
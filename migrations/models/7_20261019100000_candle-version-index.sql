@@ -0,0 +1,4 @@
+-- upgrade --
+CREATE INDEX "idx_candle_instrum_84bb61" ON "candle" ("instrument_id", "timeframe", "id");
+-- downgrade --
+DROP INDEX "idx_candle_instrum_84bb61";
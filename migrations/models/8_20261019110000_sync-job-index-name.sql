@@ -0,0 +1,4 @@
+-- upgrade --
+ALTER INDEX "idx_sync_job_status_stage" RENAME TO "idx_sync_job_status_0a5062";
+-- downgrade --
+ALTER INDEX "idx_sync_job_status_0a5062" RENAME TO "idx_sync_job_status_stage";
@@ -0,0 +1,6 @@
+-- upgrade --
+ALTER TABLE "rollup_state" ADD "pending_candle_id" INT NOT NULL  DEFAULT 0;
+ALTER TABLE "rollup_state" ADD "pending_xmax" BIGINT NOT NULL  DEFAULT 0;
+-- downgrade --
+ALTER TABLE "rollup_state" DROP COLUMN "pending_candle_id";
+ALTER TABLE "rollup_state" DROP COLUMN "pending_xmax";
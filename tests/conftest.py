@@ -0,0 +1,67 @@
+import copy
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator
+
+import asyncpg
+import pytest
+from tortoise import Tortoise
+
+from app import models, utils
+from app.config import settings
+
+MIGRATIONS_DIR = Path(__file__).parent.parent / 'migrations' / 'models'
+TEST_DB_NAME = f'{settings.DB_NAME}_test'
+
+
+def _credentials(database: str) -> Dict[str, Any]:
+    credentials = dict(settings.TORTOISE_ORM['connections']['default']['credentials'])
+    credentials['database'] = database
+    return credentials
+
+
+def _upgrade_sql(path: Path) -> str:
+    return path.read_text().split('-- downgrade --')[0].replace('-- upgrade --', '')
+
+
+@pytest.fixture
+def process_pool() -> Iterator[None]:
+    """Shared process pool is shut down after the test, so every test starts its own workers
+    """
+    yield
+    if utils._process_pool is not None:
+        utils.reset_process_pool(utils._process_pool)
+
+
+@pytest.fixture
+async def db() -> AsyncIterator[None]:
+    """Empty database migrated to the latest schema, recreated for every test. Tests are skipped without Postgres
+    """
+    try:
+        admin = await asyncpg.connect(**_credentials('postgres'))
+    except (OSError, asyncpg.PostgresError) as e:
+        pytest.skip(f'Postgres is not available: {e}')
+
+    await admin.execute(f'DROP DATABASE IF EXISTS {TEST_DB_NAME};')
+    await admin.execute(f'CREATE DATABASE {TEST_DB_NAME};')
+
+    conn = await asyncpg.connect(**_credentials(TEST_DB_NAME))
+    for path in sorted(MIGRATIONS_DIR.glob('*.sql'), key=lambda path: int(path.name.split('_')[0])):
+        await conn.execute(_upgrade_sql(path))
+    await conn.close()
+
+    config = copy.deepcopy(settings.TORTOISE_ORM)
+    config['connections']['default']['credentials']['database'] = TEST_DB_NAME
+    await Tortoise.init(config)
+
+    yield
+
+    await Tortoise.close_connections()
+    await admin.execute(f'DROP DATABASE {TEST_DB_NAME};')
+    await admin.close()
+
+
+@pytest.fixture
+async def instrument(db: None) -> models.Instrument:
+    return await models.Instrument.create(
+        figi='BBG000B9XRY4', type=models.InstrumentType.STOCK, name='Apple', ticker='AAPL', price_increment=0.01
+    )
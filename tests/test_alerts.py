@@ -0,0 +1,139 @@
+import datetime as dt
+import json
+from decimal import Decimal
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from app import alerts, tinkoff
+from app.schema import Candle
+from app.tinkoff import TinkoffAPIError
+
+TIME = dt.datetime(2021, 3, 1, 20, 0, tzinfo=dt.timezone.utc)
+
+
+def _candle(open, high, low, close, time=TIME):
+    return Candle(o=Decimal(open), h=Decimal(high), l=Decimal(low), c=Decimal(close), v=1, time=time.isoformat())
+
+
+def _engine(levels):
+    engine = alerts.AlertEngine(sinks=[])
+    engine.set_levels('FIGI', 'AAPL', alerts.LevelIndex(levels, [1] * len(levels), price_error=0.1))
+    return engine
+
+
+def test_level_index_entered_excludes_zone_of_previous_price():
+    index = alerts.LevelIndex([12, 10, 14], [1, 1, 1], price_error=0.5)
+
+    assert [index.levels[i] for i in index.entered(10.2, 13.8)] == [12, 14]
+    assert index.entered(11, 11.2) == []
+
+
+def test_new_candle_is_processed_as_price_path():
+    engine = _engine([9, 12])
+    engine.on_candles('FIGI', [_candle(10, 10.5, 9.5, 10, time=TIME - dt.timedelta(minutes=1))])
+
+    found = engine.on_candles('FIGI', [_candle(10, 12, 8.9, 11)])
+
+    assert [(alert.level, alert.direction) for alert in found] == [(9, 'down'), (12, 'up')]
+
+
+def test_update_of_last_candle_checks_new_extremes():
+    engine = _engine([12])
+    engine.on_candles('FIGI', [_candle(10, 10.5, 9.5, 10)])
+
+    # Close didn't move, but the high reached the level between updates
+    found = engine.on_candles('FIGI', [_candle(10, 12, 9.5, 10)])
+    assert [(alert.level, alert.price) for alert in found] == [(12, 12)]
+
+    # The same high is not reported again
+    assert engine.on_candles('FIGI', [_candle(10, 12, 9.5, 10.2)]) == []
+
+
+def test_older_candles_are_skipped():
+    engine = _engine([12])
+    engine.on_candles('FIGI', [_candle(10, 10.5, 9.5, 10)])
+
+    assert engine.on_candles('FIGI', [_candle(10, 13, 9.5, 10, time=TIME - dt.timedelta(minutes=1))]) == []
+
+
+class FailingClient:
+
+    def __init__(self, errors):
+        self.errors = errors
+        self.requested = []
+
+    async def get_candles(self, figi, timeframe, start_dt, end_dt):
+        self.requested.append(figi)
+        if figi in self.errors:
+            raise self.errors[figi]
+
+        return [_candle(10, 10.5, 9.5, 10)]
+
+
+@pytest.mark.asyncio
+async def test_poll_prices_skips_failed_instruments():
+    engine = _engine([12])
+    for figi in ('FIGI2', 'FIGI3'):
+        engine.set_levels(figi, figi, alerts.LevelIndex([12], [1], price_error=0.1))
+    client = FailingClient({
+        'FIGI': httpx.ConnectTimeout('timeout', request=httpx.Request('GET', 'https://example.com')),
+        'FIGI2': TinkoffAPIError('error'),
+    })
+
+    await alerts.poll_prices(engine, client)
+
+    assert client.requested == ['FIGI', 'FIGI2', 'FIGI3']
+    assert list(engine._last_candles) == ['FIGI3']
+
+
+def test_replace_levels_drops_instruments_without_levels():
+    engine = _engine([12])
+    engine.replace_levels({'FIGI2': ('MSFT', alerts.LevelIndex([12], [1], price_error=0.1))})
+
+    assert engine.figis == ['FIGI2']
+    engine.on_price('FIGI', 11, TIME)
+    assert engine.on_price('FIGI', 13, TIME) == []
+
+
+class FakeConnection:
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.sent = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def send(self, message):
+        self.sent.append(message)
+
+    def __aiter__(self):
+        return self._messages()
+
+    async def _messages(self):
+        for message in self.messages:
+            yield message
+
+
+@pytest.mark.asyncio
+async def test_stream_candles_skips_malformed_events(monkeypatch):
+    candle = {'figi': 'FIGI', 'o': 10, 'h': 11, 'l': 9, 'c': 10, 'v': 1, 'time': TIME.isoformat(), 'interval': '1min'}
+    connection = FakeConnection([
+        'not json',
+        json.dumps({'event': 'candle', 'payload': {'figi': 'FIGI'}}),
+        json.dumps({'event': 'orderbook', 'payload': {}}),
+        json.dumps({'event': 'candle', 'payload': candle}),
+    ])
+    monkeypatch.setattr(tinkoff, 'websockets', SimpleNamespace(
+        connect=lambda *args, **kwargs: connection, WebSocketException=Exception
+    ))
+
+    updates = [update async for update in tinkoff.TinkoffStreamingClient().stream_candles(['FIGI'])]
+
+    assert updates == [('FIGI', _candle(10, 11, 9, 10))]
+    assert len(connection.sent) == 1
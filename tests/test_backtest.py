@@ -0,0 +1,53 @@
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from app import backtest
+from app.support_resistance import SupportResistanceSearch
+
+
+def make_candles(close, open_=None, high=None, low=None) -> backtest.Candles:
+    close = np.asarray(close, dtype=float)
+    return backtest.Candles(
+        time=pd.date_range('2021-01-01', periods=len(close), freq='D').to_numpy(),
+        open=np.asarray(open_ if open_ is not None else close, dtype=float),
+        high=np.asarray(high if high is not None else close + 1, dtype=float),
+        low=np.asarray(low if low is not None else close - 1, dtype=float),
+        close=close,
+    )
+
+
+def test_window_levels_are_support_resistance_search_levels():
+    rng = np.random.default_rng(0)
+    candles = make_candles(100 + np.cumsum(rng.normal(size=120)))
+
+    prices, price_error = backtest.window_levels(candles, 10, 110, min_significance=0.3)
+
+    window = pd.DataFrame({'time': candles.time[10:110], 'high': candles.high[10:110], 'low': candles.low[10:110]})
+    search = SupportResistanceSearch(window)
+    expected = search.find_levels(Decimal(0.3))
+    np.testing.assert_allclose(prices, expected.price.astype(float))
+    assert price_error == float(search.price_error)
+
+
+def test_simulate_fills_take_profit_at_gap_up_open():
+    candles = make_candles(close=[10, 10, 15], open_=[10, 10, 14], high=[10, 10, 16], low=[10, 10, 13])
+    signals = backtest.Signals(
+        entries=np.array([True, False, False]),
+        stop=np.full(3, 5.0),
+        take=np.full(3, 12.0),
+    )
+
+    trades = backtest.simulate(candles, signals)
+
+    assert trades.exit_price.tolist() == [14.0]
+
+
+def test_simulate_fills_stop_at_gap_down_open():
+    candles = make_candles(close=[10, 10, 6], open_=[10, 10, 7], high=[10, 10, 8], low=[10, 10, 5])
+    signals = backtest.Signals(entries=np.array([True, False, False]), stop=np.full(3, 9.0))
+
+    trades = backtest.simulate(candles, signals)
+
+    assert trades.exit_price.tolist() == [7.0]
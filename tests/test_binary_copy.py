@@ -0,0 +1,122 @@
+import datetime as dt
+import math
+import struct
+
+import numpy as np
+import pytest
+
+from app import models
+
+HEADER = models.COPY_SIGNATURE + struct.pack('>ii', 0, 0)
+
+
+def _copy(rows, header=HEADER, trailer=models.COPY_TRAILER):
+    data = header
+    for row in rows:
+        data += struct.pack('>h', len(row))
+        for field in row:
+            data += struct.pack('>i', -1) if field is None else struct.pack('>i', len(field)) + field
+
+    return data + trailer
+
+
+def _numeric(digits, weight, sign=0, dscale=0):
+    return struct.pack(f'>hhHh{len(digits)}h', len(digits), weight, sign, dscale, *digits)
+
+
+def test_decode_fixed_width_columns():
+    rows = [
+        [struct.pack('>i', 7), struct.pack('>d', 1.5), struct.pack('>q', 86_400_000_000), struct.pack('>i', -1)],
+        [struct.pack('>i', -3), struct.pack('>d', -0.25), struct.pack('>q', -1), struct.pack('>i', 366)],
+    ]
+
+    ints, floats, times, dates = models.decode_binary_copy(_copy(rows), ['int4', 'float8', 'timestamptz', 'date'])
+
+    assert ints.tolist() == [7, -3]
+    assert floats.tolist() == [1.5, -0.25]
+    assert times.tolist() == [dt.datetime(2000, 1, 2), dt.datetime(1999, 12, 31, 23, 59, 59, 999999)]
+    assert dates.tolist() == [dt.date(1999, 12, 31), dt.date(2001, 1, 1)]
+
+
+def test_decode_empty_result():
+    assert [column.tolist() for column in models.decode_binary_copy(_copy([]), ['int4', 'float8'])] == [[], []]
+
+
+@pytest.mark.parametrize('field, expected', [
+    (_numeric([123, 4500], weight=0, dscale=2), 123.45),
+    (_numeric([12], weight=-1, sign=models.NUMERIC_NEG, dscale=4), -0.0012),
+    (_numeric([1000], weight=1), 10_000_000),
+    (_numeric([], weight=0), 0),
+])
+def test_decode_numeric(field, expected):
+    assert models.decode_numeric(field) == expected
+
+
+def test_decode_numeric_special_values():
+    assert math.isnan(models.decode_numeric(_numeric([], weight=0, sign=models.NUMERIC_NAN)))
+    assert models.decode_numeric(_numeric([], weight=0, sign=0xF000)) == -math.inf
+
+
+def test_decode_rows_with_numeric():
+    rows = [
+        [struct.pack('>i', 1), _numeric([123, 4500], weight=0, dscale=2)],
+        [struct.pack('>i', 2), _numeric([5], weight=0, sign=models.NUMERIC_NEG)],
+    ]
+
+    ids, prices = models.decode_binary_copy(_copy(rows), ['int4', 'numeric'])
+
+    assert ids.tolist() == [1, 2]
+    assert prices.dtype == np.float64
+    assert prices.tolist() == [123.45, -5]
+
+
+@pytest.mark.parametrize('types, row', [
+    (['int4', 'float8'], [struct.pack('>i', 1), None]),
+    (['int4', 'numeric'], [struct.pack('>i', 1), None]),
+])
+def test_decode_rejects_nulls(types, row):
+    with pytest.raises(ValueError):
+        models.decode_binary_copy(_copy([row]), types)
+
+
+@pytest.mark.parametrize('data', [
+    b'COPY\n' + _copy([])[5:],
+    _copy([[struct.pack('>i', 1)]], trailer=b''),
+    _copy([[struct.pack('>i', 1)]], trailer=b'\xff'),
+])
+def test_decode_rejects_invalid_data(data):
+    with pytest.raises(ValueError):
+        models.decode_binary_copy(data, ['int4'])
+
+
+def test_decode_skips_header_extension():
+    header = models.COPY_SIGNATURE + struct.pack('>ii', 0, 3) + b'ext'
+    assert models.decode_binary_copy(_copy([[struct.pack('>i', 5)]], header=header), ['int4'])[0].tolist() == [5]
+
+
+@pytest.mark.asyncio
+async def test_db_query_df_reads_postgres_output(db):
+    df = await models.db_query_df(
+        '''
+        SELECT i::int4, (i * 1.25 - 2)::numeric, (i * 1.25 - 2)::float8, 'NaN'::numeric,
+               '2021-03-01 10:00+00'::timestamptz + i * interval '1 day'
+        FROM generate_series(0, 3) AS i
+        ''',
+        {'i': 'int4', 'price': 'numeric', 'float': 'float8', 'nan': 'numeric', 'time': 'timestamptz'},
+    )
+
+    assert df.i.tolist() == [0, 1, 2, 3]
+    assert df.price.tolist() == df.float.tolist() == [-2, -0.75, 0.5, 1.75]
+    assert df.nan.isna().all()
+    assert df.time.tolist()[1].isoformat() == '2021-03-02T10:00:00+00:00'
+
+
+@pytest.mark.asyncio
+async def test_db_query_batches_splits_rows(db):
+    batches = []
+    rows = await models.db_query_batches(
+        'SELECT i::int8 FROM generate_series(1, 10) AS i', {'i': 'int8'}, batches.append, batch_size=4
+    )
+
+    assert rows == 10
+    assert [batch['i'].tolist() for batch in batches] == [[1, 2, 3, 4], [5, 6, 7, 8], [9, 10]]
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import confluence, utils
+from app.schema import Timeframe
+
+
+def make_candles(size, freq='D', seed=0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(size=size)).round(1)
+    return pd.DataFrame({
+        'time': pd.date_range('2020-01-01', periods=size, freq=freq, tz='UTC'),
+        'high': close + rng.uniform(0, 2, size=size).round(1),
+        'low': close - rng.uniform(0, 2, size=size).round(1),
+    })
+
+
+def make_levels(timeframe, prices, significances, days):
+    return pd.DataFrame({
+        'price': prices,
+        'time': [pd.Timestamp('2021-01-01', tz='UTC') + pd.Timedelta(days=day) for day in days],
+        'significance': significances,
+        'timeframe': timeframe,
+    })
+
+
+@pytest.mark.parametrize('prices, price_error, zones', [
+    ([], 1, []),
+    ([1.0, 1.5, 1.6, 3.0], 0.5, [0, 0, 1, 2]),
+    ([1.0, 1.4, 1.8, 2.2], 0.5, [0, 0, 1, 1]),
+])
+def test_zones_start_at_lowest_price(prices, price_error, zones):
+    assert confluence._zones(prices, price_error) == zones
+
+
+def test_merge_levels_weights_levels_by_timeframe():
+    merged = confluence.merge_levels([
+        make_levels(Timeframe.D1, [120.0, 100.0], [0.5, 1.0], [5, 3]),
+        make_levels(Timeframe.D7, [100.4], [0.5], [1]),
+    ], price_error=1)
+
+    # Weights: day 2 * 1 and week 3 * 0.5 in the first zone, day 2 * 0.5 in the second one
+    np.testing.assert_allclose(merged.price, [(100 * 2 + 100.4 * 1.5) / 3.5, 120])
+    np.testing.assert_allclose(merged.significance, [1, 1 / 3.5])
+    assert merged.time.tolist() == [pd.Timestamp('2021-01-02', tz='UTC'), pd.Timestamp('2021-01-06', tz='UTC')]
+    assert merged.timeframes.tolist() == [(Timeframe.D1, Timeframe.D7), (Timeframe.D1, )]
+    assert merged.confluence.tolist() == [2, 1]
+
+
+def test_merge_levels_without_levels():
+    empty = make_levels(Timeframe.D1, [], [], [])
+
+    assert confluence.merge_levels([], 1).columns.tolist() == confluence.CONFLUENCE_COLUMNS
+    assert confluence.merge_levels([empty, empty], 1).empty
+
+
+def test_find_confluence_levels_rejects_unsupported_timeframes():
+    with pytest.raises(ValueError):
+        confluence.find_confluence_levels({Timeframe.M1: make_candles(100)})
+
+
+def test_find_confluence_levels_in_pool_as_in_process(process_pool, monkeypatch):
+    candles = {Timeframe.D1: make_candles(300), Timeframe.D7: make_candles(60, freq='W', seed=1)}
+
+    in_process = confluence.find_confluence_levels(candles)
+
+    monkeypatch.setattr(confluence, 'PARALLEL_MIN_CANDLES', 0)
+    in_pool = confluence.find_confluence_levels(candles)
+    pool = utils._process_pool
+    confluence.find_confluence_levels(candles)
+
+    assert pool is not None and utils._process_pool is pool
+    assert not in_process.empty
+    pd.testing.assert_frame_equal(in_pool, in_process)
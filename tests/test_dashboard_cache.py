@@ -0,0 +1,50 @@
+import datetime as dt
+import os
+import time
+
+import pytest
+
+from app import dashboard_cache
+from app.config import settings
+
+
+@pytest.fixture
+def figures_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(dashboard_cache, '_figure_path', lambda key: tmp_path / 'figures' / f'{key}.json')
+    return tmp_path / 'figures'
+
+
+def _write_figures(figures_dir, ages):
+    figures_dir.mkdir(parents=True, exist_ok=True)
+    now = time.time()
+    for i, age in enumerate(ages):
+        path = figures_dir / f'{i}.json'
+        path.write_text('x' * 100)
+        os.utime(path, (now - age, now - age))
+
+
+def test_prune_figures_removes_expired(figures_dir):
+    _write_figures(figures_dir, [10, 3 * 86400, 20])
+
+    assert dashboard_cache.prune_figures(dt.timedelta(days=1)) == 1
+    assert sorted(path.name for path in figures_dir.iterdir()) == ['0.json', '2.json']
+
+
+def test_prune_figures_removes_oldest_above_size(figures_dir):
+    _write_figures(figures_dir, [10, 30, 20, 40])
+
+    assert dashboard_cache.prune_figures(dt.timedelta(days=1), max_bytes=250) == 2
+    assert sorted(path.name for path in figures_dir.iterdir()) == ['0.json', '2.json']
+
+
+def test_save_figure_prunes_at_most_once_per_interval(figures_dir, monkeypatch):
+    expired = (settings.DASHBOARD_CACHE_MAX_AGE + 1) * 86400
+    _write_figures(figures_dir, [expired])
+    monkeypatch.setattr(dashboard_cache, '_pruned_at', 0.0)
+
+    dashboard_cache.save_figure('a', '{}')
+    assert sorted(path.name for path in figures_dir.iterdir()) == ['a.json']
+
+    _write_figures(figures_dir, [expired])
+    dashboard_cache.save_figure('b', '{}')
+    assert sorted(path.name for path in figures_dir.iterdir()) == ['0.json', 'a.json', 'b.json']
@@ -0,0 +1,51 @@
+import datetime as dt
+
+import pytest
+
+from app import export, models
+from app.schema import Timeframe
+from app.utils import localize_dt
+
+
+async def _create_candle(instrument, day, close, timeframe=Timeframe.D1):
+    return await models.Candle.create(
+        instrument=instrument, timeframe=timeframe, time=localize_dt(dt.datetime.combine(day, dt.time(10))),
+        open=close, high=close + 1, low=close - 1, close=close, volume=1,
+    )
+
+
+@pytest.mark.asyncio
+async def test_export_candles_writes_partitions(instrument, tmp_path):
+    days = [dt.date(2020, 12, 30), dt.date(2020, 12, 31), dt.date(2021, 1, 4), dt.date(2021, 1, 5)]
+    for i, day in enumerate(days):
+        await _create_candle(instrument, day, 10 + i)
+    await _create_candle(instrument, dt.date(2021, 1, 4), 50, Timeframe.D7)
+
+    # Small batches split partitions between batches
+    assert await export.export_candles(tmp_path, batch_size=3) == 5
+
+    candles = export.load_candles(tmp_path, Timeframe.D1)
+    assert candles.close.tolist() == [10, 11, 12, 13]
+    assert set(candles.ticker) == {'AAPL'}
+    assert candles.time.dt.date.tolist() == days
+    assert export.partition_path(tmp_path, (instrument.figi, 'day', 2021)).exists()
+    assert export.load_candles(tmp_path, Timeframe.D7).close.tolist() == [50]
+
+
+@pytest.mark.asyncio
+async def test_export_candles_range_keeps_rest_of_partition(instrument, tmp_path):
+    candles = [await _create_candle(instrument, dt.date(2021, 3, day), day) for day in range(1, 6)]
+    await export.export_candles(tmp_path)
+
+    candles[2].close = 100
+    await candles[2].save()
+    await candles[4].delete()
+
+    # Replaces only 2021-03-02..2021-03-04 in the yearly file
+    exported = await export.export_candles(tmp_path, start_date=dt.date(2021, 3, 2), end_date=dt.date(2021, 3, 4))
+    assert exported == 3
+
+    result = export.load_candles(tmp_path, Timeframe.D1)
+    assert result.close.tolist() == [1, 2, 100, 4, 5]
+    partition_dir = export.partition_path(tmp_path, (instrument.figi, 'day', 2021)).parent
+    assert [path.name for path in partition_dir.iterdir()] == ['candles.parquet']
@@ -0,0 +1,161 @@
+import asyncio
+import datetime as dt
+
+import pytest
+from tortoise import timezone as tz
+
+from app import candles, jobs, models
+from app.schema import Timeframe
+
+START_DT = dt.datetime(2021, 1, 1, tzinfo=dt.timezone.utc)
+END_DT = dt.datetime(2021, 2, 1, tzinfo=dt.timezone.utc)
+
+
+async def create_job(instrument: models.Instrument, status: models.SyncJobStatus, **kwargs) -> models.SyncJob:
+    return await models.SyncJob.create(
+        instrument=instrument,
+        timeframe=Timeframe.D1,
+        stage=kwargs.pop('stage', 'test'),
+        status=status,
+        start_dt=START_DT,
+        end_dt=END_DT,
+        cursor=START_DT,
+        **kwargs,
+    )
+
+
+@pytest.mark.asyncio
+async def test_claim_job_marks_job_running(instrument):
+    job = await create_job(instrument, models.SyncJobStatus.PENDING)
+
+    claimed = await jobs.claim_job()
+
+    assert claimed.id == job.id
+    assert claimed.status == models.SyncJobStatus.RUNNING
+    assert claimed.worker == jobs.WORKER_ID
+    assert claimed.lease_until > tz.now()
+    assert claimed.attempts == 1
+    assert await jobs.claim_job() is None
+
+
+@pytest.mark.asyncio
+async def test_claim_job_skips_failed_jobs(instrument):
+    failed = await create_job(instrument, models.SyncJobStatus.FAILED)
+
+    assert await jobs.claim_job() is None
+
+    claimed = await jobs.claim_job(statuses=[models.SyncJobStatus.FAILED])
+    assert claimed.id == failed.id
+
+
+@pytest.mark.asyncio
+async def test_claim_job_takes_running_job_only_with_expired_lease(instrument):
+    await create_job(instrument, models.SyncJobStatus.RUNNING, lease_until=tz.now() + dt.timedelta(minutes=1))
+    abandoned = await create_job(
+        instrument, models.SyncJobStatus.RUNNING, lease_until=tz.now() - dt.timedelta(minutes=1)
+    )
+
+    claimed = await jobs.claim_job()
+
+    assert claimed.id == abandoned.id
+    assert await jobs.claim_job() is None
+
+
+@pytest.mark.asyncio
+async def test_claim_job_filters_stage_and_excluded_ids(instrument):
+    first = await create_job(instrument, models.SyncJobStatus.PENDING, stage='first')
+    second = await create_job(instrument, models.SyncJobStatus.PENDING, stage='second')
+
+    assert (await jobs.claim_job(stage='second')).id == second.id
+    assert await jobs.claim_job(stage='second') is None
+    assert await jobs.claim_job(exclude_ids=[first.id]) is None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_claims_take_different_jobs(instrument):
+    for _ in range(4):
+        await create_job(instrument, models.SyncJobStatus.PENDING)
+
+    claimed = await asyncio.gather(*(jobs.claim_job() for _ in range(4)))
+
+    assert len({job.id for job in claimed}) == 4
+
+
+@pytest.mark.asyncio
+async def test_plan_job_queues_failed_job_again(instrument):
+    failed = await create_job(instrument, models.SyncJobStatus.FAILED, stage='update_day_candles')
+
+    job = await jobs.plan_job(instrument.figi, 'update_day_candles', START_DT, END_DT)
+
+    assert job.id == failed.id
+    assert job.status == models.SyncJobStatus.PENDING
+    assert (await jobs.claim_job()).id == failed.id
+
+
+@pytest.mark.asyncio
+async def test_plan_job_extends_period_of_reused_job(instrument):
+    failed = await create_job(instrument, models.SyncJobStatus.FAILED, stage='refresh_candles')
+    end_dt = END_DT + dt.timedelta(days=3)
+
+    await jobs.plan_job(instrument.figi, 'refresh_candles', START_DT, end_dt)
+
+    failed = await models.SyncJob.get(id=failed.id)
+    assert failed.status == models.SyncJobStatus.PENDING
+    assert failed.end_dt == end_dt
+
+
+@pytest.mark.asyncio
+async def test_claim_job_by_id(instrument):
+    await create_job(instrument, models.SyncJobStatus.PENDING)
+    job = await create_job(instrument, models.SyncJobStatus.PENDING)
+
+    assert (await jobs.claim_job(job_id=job.id)).id == job.id
+    assert await jobs.claim_job(job_id=job.id) is None
+
+
+@pytest.mark.asyncio
+async def test_prune_jobs_removes_only_old_done_jobs(instrument):
+    done = await create_job(instrument, models.SyncJobStatus.DONE)
+    await create_job(instrument, models.SyncJobStatus.FAILED)
+    await create_job(instrument, models.SyncJobStatus.DONE, stage='other')
+
+    assert await jobs.prune_jobs('test', tz.now() - dt.timedelta(minutes=1)) == 0
+    assert await jobs.prune_jobs('test', tz.now() + dt.timedelta(minutes=1)) == 1
+
+    assert not await models.SyncJob.filter(id=done.id).exists()
+    assert await models.SyncJob.all().count() == 2
+
+
+@pytest.mark.asyncio
+async def test_data_version_changes_only_with_candles_of_instrument(instrument):
+    other = await models.Instrument.create(
+        figi='BBG000BPH459', type=models.InstrumentType.STOCK, name='Microsoft', ticker='MSFT', price_increment=0.01
+    )
+    await models.Candle.create(
+        instrument=other, timeframe=Timeframe.D1, time=START_DT, open=1, high=1, low=1, close=1, volume=1
+    )
+    version = await candles.get_data_version(['MSFT'], [Timeframe.D1])
+
+    await models.Candle.create(
+        instrument=instrument, timeframe=Timeframe.D1, time=START_DT, open=1, high=1, low=1, close=1, volume=1
+    )
+    await models.Candle.create(
+        instrument=other, timeframe=Timeframe.H1, time=START_DT, open=1, high=1, low=1, close=1, volume=1
+    )
+
+    assert await candles.get_data_version(['MSFT'], [Timeframe.D1]) == version
+    assert await candles.get_data_version(['AAPL', 'MSFT'], [Timeframe.D1]) > version
+    assert await candles.get_data_version(['MSFT']) > version
+
+
+@pytest.mark.asyncio
+async def test_is_advisory_locked_does_not_take_lock(db):
+    key = 2 ** 40 + 5
+
+    assert not await models.is_advisory_locked(key)
+    async with models.advisory_lock(key) as locked:
+        assert locked
+        assert await models.is_advisory_locked(key)
+        assert not await models.is_advisory_locked(5)
+
+    assert not await models.is_advisory_locked(key)
@@ -0,0 +1,50 @@
+import datetime as dt
+
+import pytest
+from tortoise import timezone as tz
+
+from app import models, retention
+from app.config import Settings
+from app.schema import Timeframe
+
+
+async def _create_candles(instrument, timeframe, times):
+    for i, time in enumerate(times):
+        await models.Candle.create(
+            instrument=instrument, timeframe=timeframe, time=time,
+            open=10 + i, high=11 + i, low=9 + i, close=10 + i, volume=1,
+        )
+
+
+@pytest.mark.asyncio
+async def test_delete_expired_candles_rolls_them_up_first(instrument):
+    now = tz.now()
+    old = [now - dt.timedelta(days=days) for days in (400, 399, 398)]
+    await _create_candles(instrument, Timeframe.D1, old + [now - dt.timedelta(days=1)])
+
+    # Day candles are sources of the default week and month rollups
+    assert await retention.delete_expired_candles(Timeframe.D1, dt.timedelta(days=365)) == 3
+
+    assert await models.Candle.filter(timeframe=Timeframe.D1).count() == 1
+    week_candles = await models.Candle.filter(timeframe=Timeframe.D7, time__lt=now - dt.timedelta(days=300))
+    assert sum(candle.volume for candle in week_candles) == 3
+
+
+@pytest.mark.asyncio
+async def test_delete_expired_candles_refuses_timeframe_without_rollups(instrument):
+    await _create_candles(instrument, Timeframe.H1, [tz.now() - dt.timedelta(days=400)])
+
+    with pytest.raises(ValueError):
+        await retention.delete_expired_candles(Timeframe.H1, dt.timedelta(days=365))
+
+    assert await models.Candle.filter(timeframe=Timeframe.H1).count() == 1
+
+
+def test_settings_reject_retention_without_rollups(monkeypatch):
+    # Set by `Tortoise.init` of previous tests, it isn't a valid value of `Settings.TIMEZONE`
+    monkeypatch.delenv('TIMEZONE', raising=False)
+
+    with pytest.raises(RuntimeError):
+        Settings(CANDLE_RETENTION={'1min': 90}, CANDLE_ROLLUPS={'week': 'day'})
+
+    Settings(CANDLE_RETENTION={'1min': 90}, CANDLE_ROLLUPS={'hour': '1min'})
@@ -0,0 +1,123 @@
+import datetime as dt
+
+import asyncpg
+import pytest
+
+from app import candles, models, rollups
+from app.config import ROLLUP_TARGETS, Settings
+from app.schema import Timeframe
+from app.utils import localize_dt
+
+from . import conftest
+
+
+async def create_day_candle(instrument, day: dt.date, open_, high, low, close, volume=1) -> models.Candle:
+    return await models.Candle.create(
+        instrument=instrument, timeframe=Timeframe.D1, time=localize_dt(dt.datetime.combine(day, dt.time(10))),
+        open=open_, high=high, low=low, close=close, volume=volume,
+    )
+
+
+async def week_candles(instrument):
+    return await (
+        models.Candle
+        .filter(instrument=instrument, timeframe=Timeframe.D7)
+        .order_by('time')
+        .values_list('time', 'open', 'high', 'low', 'close', 'volume')
+    )
+
+
+@pytest.mark.asyncio
+async def test_refresh_rollup_aggregates_buckets(instrument):
+    # Monday 2021-03-01 ... Monday 2021-03-08
+    await create_day_candle(instrument, dt.date(2021, 3, 1), 10, 12, 9, 11, volume=1)
+    await create_day_candle(instrument, dt.date(2021, 3, 3), 11, 15, 10, 14, volume=2)
+    last = await create_day_candle(instrument, dt.date(2021, 3, 8), 14, 16, 13, 15, volume=3)
+
+    assert await rollups.refresh_rollup(Timeframe.D7, Timeframe.D1) == 2
+
+    assert await week_candles(instrument) == [
+        (localize_dt(dt.datetime(2021, 3, 1)), 10, 15, 9, 14, 3),
+        (localize_dt(dt.datetime(2021, 3, 8)), 14, 16, 13, 15, 3),
+    ]
+    state = await models.RollupState.get(timeframe=Timeframe.D7)
+    assert state.last_candle_id == last.id
+
+
+@pytest.mark.asyncio
+async def test_refresh_rollup_recalculates_only_changed_buckets(instrument):
+    await create_day_candle(instrument, dt.date(2021, 3, 1), 10, 12, 9, 11)
+    await create_day_candle(instrument, dt.date(2021, 3, 8), 14, 16, 13, 15)
+    await rollups.refresh_rollup(Timeframe.D7, Timeframe.D1)
+
+    # Nothing new: watermark is not moved and nothing is upserted
+    assert await rollups.refresh_rollup(Timeframe.D7, Timeframe.D1) == 0
+
+    # Replaced candle (as done by `jobs.run_job` for changed prices) gets a new id and is picked up
+    await models.Candle.filter(instrument=instrument, timeframe=Timeframe.D1, time__gte=dt.datetime(
+        2021, 3, 8, tzinfo=dt.timezone.utc
+    )).delete()
+    await create_day_candle(instrument, dt.date(2021, 3, 8), 14, 20, 13, 19)
+
+    assert await rollups.refresh_rollup(Timeframe.D7, Timeframe.D1) == 1
+    assert (await week_candles(instrument))[-1][1:] == (14, 20, 13, 19, 1)
+
+
+def test_pick_timeframe_prefers_coarsest_with_enough_points():
+    assert rollups.pick_timeframe(dt.date(2010, 1, 1), dt.date(2021, 1, 1), min_points=100) == Timeframe.D30
+    assert rollups.pick_timeframe(dt.date(2019, 1, 1), dt.date(2021, 1, 1), min_points=100) == Timeframe.D7
+    assert rollups.pick_timeframe(dt.date(2020, 10, 1), dt.date(2021, 1, 1), min_points=100) == Timeframe.D1
+
+
+@pytest.mark.asyncio
+async def test_refresh_rollup_picks_up_candles_committed_late(instrument):
+    await create_day_candle(instrument, dt.date(2021, 3, 1), 10, 12, 9, 11)
+
+    # Candle of a running sync transaction gets its id before the next candle, but is committed after the rollup
+    connection = await asyncpg.connect(**conftest._credentials(conftest.TEST_DB_NAME))
+    try:
+        transaction = connection.transaction()
+        await transaction.start()
+        await connection.execute(
+            "INSERT INTO candle (instrument_id, timeframe, time, open, high, low, close, volume) "
+            "VALUES ($1, 'day', $2, 11, 20, 10, 19, 1)",
+            instrument.figi, localize_dt(dt.datetime(2021, 3, 2, 10)),
+        )
+        last = await create_day_candle(instrument, dt.date(2021, 3, 8), 14, 16, 13, 15)
+
+        await rollups.refresh_rollup(Timeframe.D7, Timeframe.D1)
+        assert (await week_candles(instrument))[0][2] == 12
+
+        state = await models.RollupState.get(timeframe=Timeframe.D7)
+        assert state.last_candle_id < last.id
+        assert state.pending_candle_id == last.id
+
+        await transaction.commit()
+    finally:
+        await connection.close()
+
+    assert await rollups.refresh_rollup(Timeframe.D7, Timeframe.D1) == 1
+    assert (await week_candles(instrument))[0][2:5] == (20, 9, 19)
+
+    state = await models.RollupState.get(timeframe=Timeframe.D7)
+    assert state.last_candle_id == last.id
+
+
+def test_settings_reject_rollups_without_buckets():
+    assert set(ROLLUP_TARGETS) == {timeframe.value for timeframe in rollups.BUCKET_SQL}
+
+    with pytest.raises(RuntimeError):
+        Settings(CANDLE_ROLLUPS={'day': 'hour'})
+
+
+@pytest.mark.asyncio
+async def test_changed_rollup_candle_changes_data_version(instrument):
+    await create_day_candle(instrument, dt.date(2021, 3, 1), 10, 12, 9, 11)
+    await rollups.refresh_rollup(Timeframe.D7, Timeframe.D1)
+    version = await candles.get_data_version([instrument.ticker], [Timeframe.D7])
+
+    await create_day_candle(instrument, dt.date(2021, 3, 2), 11, 20, 10, 19)
+    await rollups.refresh_rollup(Timeframe.D7, Timeframe.D1)
+
+    assert await models.Candle.filter(timeframe=Timeframe.D7).count() == 1
+    assert await candles.get_data_version([instrument.ticker], [Timeframe.D7]) > version
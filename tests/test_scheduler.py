@@ -0,0 +1,91 @@
+import asyncio
+import datetime as dt
+from decimal import Decimal
+
+import pytest
+from tortoise import timezone as tz
+from tortoise.exceptions import IntegrityError
+
+from app import models, scheduler
+from app.schema import Candle, Timeframe
+
+
+class FakeClient:
+
+    def __init__(self, error=None):
+        self.error = error
+
+    async def get_candles(self, figi, timeframe, start_dt, end_dt):
+        if self.error is not None:
+            raise self.error
+
+        return [Candle(o=Decimal(10), h=Decimal(11), l=Decimal(9), c=Decimal(10), v=1, time=start_dt.isoformat())]
+
+
+def make_target(instrument):
+    return scheduler.RefreshTarget(
+        instrument.figi, instrument.ticker, Timeframe.H1, tz.now() - dt.timedelta(hours=2)
+    )
+
+
+@pytest.mark.asyncio
+async def test_refresh_claims_and_runs_job(instrument):
+    target = make_target(instrument)
+
+    await scheduler.AdaptiveScheduler(FakeClient()).refresh(target)
+
+    job = await models.SyncJob.get(instrument_id=instrument.figi)
+    assert job.status == models.SyncJobStatus.DONE
+    assert job.worker is not None and job.attempts == 1
+    assert target.refreshed_at is not None
+    assert await models.Candle.filter(instrument_id=instrument.figi, timeframe=Timeframe.H1).count() == 1
+
+
+@pytest.mark.asyncio
+async def test_refresh_skips_job_running_by_another_worker(instrument):
+    target = make_target(instrument)
+    await models.SyncJob.create(
+        instrument=instrument, timeframe=Timeframe.H1, stage=scheduler.STAGE, status=models.SyncJobStatus.RUNNING,
+        start_dt=target.last_candle_time, end_dt=tz.now(), cursor=target.last_candle_time,
+        worker='other', lease_until=tz.now() + dt.timedelta(minutes=1),
+    )
+
+    await scheduler.AdaptiveScheduler(FakeClient()).refresh(target)
+
+    assert not await models.Candle.filter(instrument_id=instrument.figi).exists()
+    assert (await models.SyncJob.get(instrument_id=instrument.figi)).worker == 'other'
+
+
+@pytest.mark.asyncio
+async def test_refresh_saves_any_job_error(instrument):
+    await scheduler.AdaptiveScheduler(FakeClient(IntegrityError('duplicate key'))).refresh(make_target(instrument))
+
+    job = await models.SyncJob.get(instrument_id=instrument.figi)
+    assert job.status == models.SyncJobStatus.FAILED
+    assert job.error == 'IntegrityError: duplicate key'
+
+
+@pytest.mark.asyncio
+async def test_run_survives_refresh_errors(instrument, monkeypatch):
+    stop_event = asyncio.Event()
+    refreshed = []
+
+    async def refresh(target):
+        refreshed.append(target.key)
+        if len(refreshed) == 2:
+            stop_event.set()
+        raise RuntimeError('connection lost')
+
+    schedule = scheduler.AdaptiveScheduler(FakeClient())
+    monkeypatch.setattr(schedule, 'refresh', refresh)
+    schedule._reloaded_at = tz.now()
+    for timeframe in (Timeframe.H1, Timeframe.D1):
+        target = make_target(instrument)
+        target.timeframe = timeframe
+        schedule._targets[target.key] = target
+        schedule._push(target, tz.now())
+
+    await asyncio.wait_for(schedule.run(stop_event), timeout=5)
+
+    assert len(refreshed) == 2 and len(schedule._targets) == 2
+    assert all(target.refreshed_at is not None for target in schedule._targets.values())
@@ -0,0 +1,81 @@
+import datetime as dt
+
+import numpy as np
+import pytest
+
+from app import models, screener
+from app.schema import Timeframe
+from app.utils import localize_dt
+
+
+@pytest.mark.asyncio
+async def test_load_price_panel_aligns_instruments_by_date(instrument):
+    other = await models.Instrument.create(
+        figi='BBG000BPH459', type=models.InstrumentType.STOCK, name='Microsoft', ticker='MSFT', price_increment=0.01
+    )
+    for figi, day, close in [(instrument.figi, 1, 10), (instrument.figi, 2, 11), (other.figi, 2, 20)]:
+        await models.Candle.create(
+            instrument_id=figi, timeframe=Timeframe.D1, time=localize_dt(dt.datetime(2021, 3, day, 10)),
+            open=close, high=close + 1, low=close - 1, close=close, volume=1,
+        )
+
+    panel = await screener.load_price_panel(dt.date(2021, 3, 1), dt.date(2021, 3, 2))
+
+    rows = {ticker: i for i, ticker in enumerate(panel.tickers)}
+    assert set(rows) == {'AAPL', 'MSFT'}
+    assert panel.dates.tolist() == [dt.date(2021, 3, 1), dt.date(2021, 3, 2)]
+    np.testing.assert_array_equal(panel.close[rows['AAPL']], [10, 11])
+    np.testing.assert_array_equal(panel.close[rows['MSFT']], [np.nan, 20])
+    np.testing.assert_array_equal(panel.high[rows['MSFT']], [np.nan, 21])
+    assert panel.figis[rows['MSFT']] == other.figi
+
+
+def test_zone_weights_sums_neighbourhood_of_each_row():
+    candidates = screener.LevelCandidates(
+        prices=np.array([[1.0, 1.5, 3.0, np.nan], [100.0, 101.0, 150.0, 100.5]]),
+        weights=np.array([[1.0, 2.0, 4.0, 0.0], [1.0, 2.0, 4.0, 8.0]]),
+    )
+    queries = np.array([[1.0, 3.0], [100.0, np.nan]])
+
+    weights = screener.zone_weights(candidates, queries, price_error=np.array([0.6, 1.0]))
+
+    np.testing.assert_array_equal(weights, [[3.0, 4.0], [9.0, 0.0]])
+
+
+def make_panel(num_of_dates) -> screener.PricePanel:
+    rng = np.random.default_rng(0)
+    close = 100 + np.cumsum(rng.normal(size=(3, num_of_dates)), axis=1)
+    return screener.PricePanel(
+        figis=np.array(['A', 'B', 'C']),
+        tickers=np.array(['A', 'B', 'C']),
+        names=np.array(['A', 'B', 'C']),
+        dates=np.datetime64('2021-03-01') + np.arange(num_of_dates),
+        high=close + 1,
+        low=close - 1,
+        close=close,
+    )
+
+
+@pytest.mark.parametrize('num_of_dates', [0, 1, 3, 4])
+def test_screen_of_short_panel_is_empty(num_of_dates):
+    panel = make_panel(num_of_dates)
+
+    assert screener.screen(panel, max_support_distance=None).empty
+    assert screener.find_level_candidates(panel.high, panel.low, panel.dates).prices.shape == (3, 0)
+
+
+def test_level_candidates_merge_repeated_extremes():
+    high = np.array([[1.0, 5.0, 2.0, 3.0, 4.0, 2.0, np.nan, 1.0, 2.0, 3.0]])
+    low = high - 1
+    dates = np.datetime64('2021-03-01') + np.arange(10)
+
+    candidates = screener.find_level_candidates(high, low, dates, max_batch_iterations=2)
+
+    # Batches [0, 10), [0, 5), [5, 10): high at date 1 and low at date 0 are extremes of two batches
+    time_weight = 16 / 9
+    assert sorted(zip(candidates.prices[0], candidates.weights[0])) == pytest.approx([
+        (0.0, 10 + 5),
+        (0.0, 5 + 7 * time_weight),
+        (3.0, 5 + 9 * time_weight),
+        (5.0, 10 + 5 + 2 * time_weight),
+    ])
@@ -0,0 +1,59 @@
+import subprocess
+import sys
+
+import pytest
+
+from app import startup
+
+# Wall time of CLI import in a fresh interpreter, seconds: about 0.1s with lazy subsystems, 0.25s without them
+CLI_IMPORT_BUDGET = 0.5
+
+# Modules loaded by `lazy_import` stay `_LazyModule` until the first attribute access
+IMPORT_SCRIPT = '''
+import sys, time, types
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+print(' '.join(name for name in {heavy_modules!r} if type(sys.modules.get(name)) is types.ModuleType))
+'''
+
+
+def import_in_fresh_interpreter(module, heavy_modules):
+    """Import time of the module in seconds and the heavy modules it has loaded
+    """
+    script = IMPORT_SCRIPT.format(module=module, heavy_modules=heavy_modules)
+    process = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True)
+    duration, loaded = (process.stdout.splitlines() + [''])[:2]
+    return float(duration), loaded.split()
+
+
+def test_cli_import_is_fast_and_lazy():
+    duration, loaded = import_in_fresh_interpreter('app.__main__', ('plotly', 'pandas'))
+
+    assert loaded == []
+    assert duration < CLI_IMPORT_BUDGET
+
+
+def test_dashboard_does_not_load_optional_subsystems():
+    pytest.importorskip('streamlit')
+
+    _, loaded = import_in_fresh_interpreter(
+        'app.dashboard', ('pyarrow', 'app.export', 'app.confluence', 'app.support_resistance', 'app.graphs', 'plotly')
+    )
+
+    assert loaded == []
+
+
+def test_parse_importtime():
+    output = '\n'.join([
+        'import time: self [us] | cumulative | imported package',
+        'import time:       120 |        120 |   _io',
+        'import time:      1500 |       2000 | app',
+        'import time:       300 |        300 |     app.config',
+    ])
+
+    assert startup.parse_importtime(output) == [
+        startup.ImportTime('_io', 0.00012, 0.00012, 1),
+        startup.ImportTime('app', 0.0015, 0.002, 0),
+        startup.ImportTime('app.config', 0.0003, 0.0003, 2),
+    ]
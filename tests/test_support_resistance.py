@@ -0,0 +1,83 @@
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.support_resistance import (
+    StreamingSupportResistanceSearch,
+    SupportResistanceSearch,
+    _query_sparse_table,
+    _sparse_table,
+)
+
+
+def make_candles(size, seed=0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(size=size)).round(1)
+    return pd.DataFrame({
+        'time': pd.date_range('2020-01-01', periods=size, freq='D', tz='UTC'),
+        'high': close + rng.uniform(0, 2, size=size).round(1),
+        'low': close - rng.uniform(0, 2, size=size).round(1),
+    })
+
+
+def split(candles, bounds):
+    return [candles[start:stop] for start, stop in zip([0] + bounds, bounds + [len(candles)])]
+
+
+@pytest.mark.parametrize('size, bounds', [(100, []), (257, [7, 100, 101])])
+def test_single_candle_blocks_give_support_resistance_search_levels(size, bounds):
+    candles = make_candles(size)
+
+    expected = SupportResistanceSearch(candles).find_levels(Decimal(0))
+    levels = StreamingSupportResistanceSearch(split(candles, bounds), block_size=1).find_levels(Decimal(0))
+
+    np.testing.assert_allclose(levels.price.astype(float), expected.price.astype(float))
+    np.testing.assert_allclose(levels.significance.astype(float), expected.significance.astype(float))
+    assert levels.time.tolist() == expected.time.tolist()
+
+
+@pytest.mark.parametrize('block_size', [3, 10, 64])
+def test_partitions_are_not_repeated_after_rounding_to_blocks(block_size):
+    search = StreamingSupportResistanceSearch(split(make_candles(1000), [300, 301]), block_size=block_size)
+    num_of_blocks = len(search._blocks.size)
+
+    partitions = [
+        (first_blocks.tolist(), last_blocks.tolist())
+        for first_blocks, last_blocks, _, _ in search._partitions()
+    ]
+
+    assert len(partitions) <= num_of_blocks
+    assert len(set(map(str, partitions))) == len(partitions)
+    for first_blocks, last_blocks in partitions:
+        assert first_blocks[0] == 0 and last_blocks[-1] == num_of_blocks
+        assert first_blocks[1:] == last_blocks[:-1]
+
+
+def test_block_extremes_are_extremes_of_rounded_batches():
+    candles = make_candles(500)
+    search = StreamingSupportResistanceSearch([candles], block_size=7)
+    extremes = iter(search._batch_extremes())
+
+    for first_blocks, last_blocks, _, repeats in search._partitions():
+        for _ in range(repeats):
+            for first_block, last_block in zip(first_blocks, last_blocks):
+                batch = candles[first_block * 7:last_block * 7]
+                batch_extremes = next(extremes)
+
+                assert batch_extremes.high == batch.high.max()
+                assert batch_extremes.high_time == batch.time[batch.high.idxmax()]
+                assert batch_extremes.low == batch.low.min()
+
+    assert next(extremes, None) is None
+
+
+@pytest.mark.parametrize('better, best', [(np.greater, np.argmax), (np.less, np.argmin)])
+def test_sparse_table_query_returns_the_earliest_best_value(better, best):
+    values = np.random.default_rng(1).integers(0, 5, size=37).astype(float)
+    table = _sparse_table(values, better)
+
+    for start in range(len(values)):
+        for stop in range(start + 1, len(values) + 1):
+            assert _query_sparse_table(table, values, better, start, stop) == start + best(values[start:stop])
@@ -0,0 +1,55 @@
+import datetime as dt
+
+import pandas as pd
+import pytest
+
+from app import candles, models, watchlist
+from app.schema import Timeframe
+from app.utils import localize_dt
+
+
+def _candles(closes):
+    return pd.DataFrame({
+        'open': closes,
+        'close': closes,
+        'high': [close + 1 for close in closes],
+        'low': [close - 1 for close in closes],
+        'volume': [1] * len(closes),
+        'time': pd.date_range('2021-03-01', periods=len(closes), freq='D', tz='UTC'),
+    })
+
+
+@pytest.mark.asyncio
+async def test_load_candles_dfs_splits_tickers(instrument):
+    other = await models.Instrument.create(
+        figi='BBG000BPH459', type=models.InstrumentType.STOCK, name='Microsoft', ticker='MSFT', price_increment=0.01
+    )
+    for figi, day, close in [(instrument.figi, 1, 10), (other.figi, 1, 20), (instrument.figi, 2, 11)]:
+        await models.Candle.create(
+            instrument_id=figi, timeframe=Timeframe.D1, time=localize_dt(dt.datetime(2021, 3, day, 10)),
+            open=close, high=close + 1, low=close - 1, close=close, volume=1,
+        )
+
+    result = await candles.load_candles_dfs(
+        ['MSFT', 'AAPL', 'TSLA'], dt.date(2021, 3, 1), dt.date(2021, 3, 2), Timeframe.D1
+    )
+
+    assert list(result) == ['MSFT', 'AAPL', 'TSLA']
+    assert result['AAPL'].close.tolist() == [10, 11]
+    assert result['MSFT'].close.tolist() == [20]
+    assert result['TSLA'].empty
+    assert list(result['TSLA'].columns) == list(candles.CANDLE_COLUMNS)
+
+
+def test_build_graphs_skips_empty_tickers(process_pool):
+    figures = watchlist.build_graphs({'AAPL': _candles([10, 11, 12]), 'MSFT': _candles([]), 'TSLA': _candles([5, 6])})
+
+    assert list(figures) == ['AAPL', 'TSLA']
+    assert figures['AAPL'].layout.height == watchlist.GRAPH_HEIGHT
+
+
+def test_normalized_graph_is_relative_to_first_close():
+    figure = watchlist.get_normalized_graph({'AAPL': _candles([10, 11, 12]), 'MSFT': _candles([])})
+
+    assert [trace.name for trace in figure.data] == ['AAPL']
+    assert list(figure.data[0].y) == pytest.approx([0, 10, 20])